@@ -75,6 +75,8 @@ setup(
         'console_scripts': [
             'gpg-export-master-key = ulif.gnupgtools.export_master_key:main',
             'gpg-import-master-key = ulif.gnupgtools.import_master_key:main',
+            'gpg-export-homes = ulif.gnupgtools.export_homes:main',
+            'gpg-sync-homes = ulif.gnupgtools.sync:main',
         ]
         }
 )
@@ -4,6 +4,11 @@ import shutil
 import stat
 import sys
 import tempfile
+from ulif.gnupgtools.testing import FakeGnuPG, HomeTemplates
+from ulif.gnupgtools.utils import set_backend
+
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), 'gnupg-samples')
 
 
 class WorkDirCreator(object):
@@ -25,8 +30,9 @@ class WorkDirCreator(object):
 
 class GnuPGHomeCreator(WorkDirCreator):
 
-    def __init__(self):
+    def __init__(self, templates=None):
         super(GnuPGHomeCreator, self).__init__()
+        self.templates = templates
         self.gnupg_home = os.path.join(self.temp_dir, 'gnupghome')
         self._old_env = os.environ.copy()
         os.environ['GNUPGHOME'] = self.gnupg_home
@@ -39,9 +45,10 @@ class GnuPGHomeCreator(WorkDirCreator):
     def create_sample_gnupg_home(self, name):
         # create a gnupg sample config in self.gnupg_home
         # name must be one of the subdirs in `gnupg-samples/`.
-        sample_home = os.path.join(
-            os.path.dirname(__file__), 'gnupg-samples', name)
-        shutil.copytree(sample_home, self.gnupg_home)
+        if self.templates is not None:
+            self.templates.get(name).create(self.gnupg_home)
+            return
+        shutil.copytree(os.path.join(SAMPLES_DIR, name), self.gnupg_home)
 
 
 class ExecutableScript(object):
@@ -107,8 +114,24 @@ def work_dir_creator(request):
     return creator
 
 
+@pytest.fixture(scope="session")
+def home_templates(request):
+    templates = HomeTemplates(SAMPLES_DIR)
+    request.addfinalizer(templates.close)
+    return templates
+
+
 @pytest.fixture(scope="function")
-def gnupg_home_creator(request):
-    creator = GnuPGHomeCreator()
+def gnupg_home_creator(request, home_templates):
+    creator = GnuPGHomeCreator(home_templates)
     request.addfinalizer(creator.tear_down)
     return creator
+
+
+@pytest.fixture(scope="function")
+def fake_gnupg(request):
+    # run all gpg commands in memory (see `testing.FakeGnuPG`)
+    backend = FakeGnuPG()
+    old_backend = set_backend(backend)
+    request.addfinalizer(lambda: set_backend(old_backend))
+    return backend
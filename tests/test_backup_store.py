@@ -0,0 +1,147 @@
+# Tests for ulif.gnupgtools.backup_store module
+import os
+import pytest
+from multiprocessing.pool import ThreadPool
+from ulif.gnupgtools.backup_store import BackupStore, split_chunks
+
+
+def random_bytes(size, seed=0):
+    # get reproducible, not compressable test data
+    import random
+    rnd = random.Random(seed)
+    return bytes(bytearray(rnd.randint(0, 255) for x in range(size)))
+
+
+def test_split_chunks():
+    # chunks joined give the original data
+    data = random_bytes(100000)
+    chunks = split_chunks(data)
+    assert len(chunks) > 1
+    assert b''.join(chunks) == data
+    assert max([len(x) for x in chunks]) <= 16384
+
+
+def test_split_chunks_local_changes():
+    # changes to data only change chunks near the change
+    data = random_bytes(100000)
+    changed = data[:50000] + b'inserted' + data[50000:]
+    old_chunks, new_chunks = split_chunks(data), split_chunks(changed)
+    assert len(set(old_chunks) - set(new_chunks)) <= 2
+
+
+class TestBackupStore(object):
+
+    def test_create(self, work_dir_creator):
+        # stores are created on demand
+        store = BackupStore('store')
+        assert os.path.isdir(os.path.join('store', 'chunks'))
+        assert os.path.isdir(os.path.join('store', 'manifests'))
+        assert store.generations('DAA011C5') == []
+
+    def test_add_get(self, work_dir_creator):
+        # we can store and retrieve members
+        store = BackupStore('store')
+        members = {'DAA011C5.pub': random_bytes(20000), 'DAA011C5.priv': b''}
+        path = store.add('DAA011C5', members)
+        assert os.path.isfile(path)
+        assert store.generations('DAA011C5') == [1]
+        assert store.get('DAA011C5') == members
+
+    def test_generations(self, work_dir_creator):
+        # each add creates a new generation, old ones are kept
+        store = BackupStore('store')
+        store.add('DAA011C5', {'DAA011C5.pub': b'first'})
+        store.add('DAA011C5', {'DAA011C5.pub': b'second'})
+        assert store.generations('DAA011C5') == [1, 2]
+        assert store.get('DAA011C5') == {'DAA011C5.pub': b'second'}
+        assert store.get('DAA011C5', 1) == {'DAA011C5.pub': b'first'}
+
+    def test_dedup(self, work_dir_creator):
+        # unchanged data is stored only once
+        store = BackupStore('store')
+        data = random_bytes(100000)
+        store.add('DAA011C5', {'DAA011C5.pub': data, 'DAA011C5.priv': data})
+        num_chunks = sum(
+            [len(files) for _, _, files in os.walk('store/chunks')])
+        store.add('DAA011C5', {
+            'DAA011C5.pub': data + b'new signature', 'DAA011C5.priv': data})
+        new_num_chunks = sum(
+            [len(files) for _, _, files in os.walk('store/chunks')])
+        assert new_num_chunks - num_chunks == 1
+
+    def test_get_missing(self, work_dir_creator):
+        # we get a KeyError for unknown keys and generations
+        store = BackupStore('store')
+        with pytest.raises(KeyError):
+            store.get('DAA011C5')
+        store.add('DAA011C5', {'DAA011C5.pub': b'first'})
+        with pytest.raises(KeyError):
+            store.get('DAA011C5', 2)
+
+    def test_invalid_key(self, work_dir_creator):
+        # key ids must be hex numbers, paths cannot escape the store
+        store = BackupStore('store')
+        for key in ('../../etc', 'DAA011C5/..', ''):
+            with pytest.raises(ValueError):
+                store.get(key)
+            with pytest.raises(ValueError):
+                store.add(key, {'DAA011C5.pub': b'data'})
+
+    def test_add_concurrent(self, work_dir_creator):
+        # concurrent adds get different generations
+        store = BackupStore('store')
+        pool = ThreadPool(8)
+        try:
+            paths = pool.map(
+                lambda num: store.add(
+                    'DAA011C5', {'DAA011C5.pub': str(num).encode()}),
+                range(16))
+        finally:
+            pool.close()
+            pool.join()
+        assert len(set(paths)) == 16
+        assert store.generations('DAA011C5') == list(range(1, 17))
+        assert sorted(os.listdir(store.key_dir('DAA011C5'))) == sorted(
+            [os.path.basename(x) for x in paths])
+
+    def test_add_concurrent_same_data(self, work_dir_creator):
+        # concurrent adds of identical data share their chunks
+        data = random_bytes(200000, seed=1)
+        for run in range(5):
+            store = BackupStore('store%s' % run)
+            pool = ThreadPool(8)
+            try:
+                paths = pool.map(
+                    lambda num: store.add('DAA011C5', {'DAA011C5.pub': data}),
+                    range(8))
+            finally:
+                pool.close()
+                pool.join()
+            assert len(set(paths)) == 8
+            for generation in store.generations('DAA011C5'):
+                assert store.get('DAA011C5', generation) == {
+                    'DAA011C5.pub': data}
+            chunk_dirs = os.path.join(store.path, 'chunks')
+            for name in os.listdir(chunk_dirs):
+                assert not [x for x in os.listdir(
+                    os.path.join(chunk_dirs, name)) if x.startswith('.tmp')]
+
+    def test_add_generation_taken(self, work_dir_creator, monkeypatch):
+        # generations created meanwhile are skipped
+        store = BackupStore('store')
+        store.add('DAA011C5', {'DAA011C5.pub': b'first'})
+        monkeypatch.setattr(store, 'generations', lambda key: [])
+        path = store.add('DAA011C5', {'DAA011C5.pub': b'second'})
+        assert os.path.basename(path) == '00000002.json'
+
+    def test_get_corrupted(self, work_dir_creator):
+        # corrupted chunks are detected
+        store = BackupStore('store')
+        store.add('DAA011C5', {'DAA011C5.pub': b'data'})
+        digest = split_chunks(b'data')[0]
+        import hashlib
+        path = store.chunk_path(hashlib.sha256(digest).hexdigest())
+        with open(path, 'wb') as fd:
+            fd.write(b'evil')
+        with pytest.raises(ValueError):
+            store.get('DAA011C5')
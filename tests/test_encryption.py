@@ -0,0 +1,101 @@
+# Tests for ulif.gnupgtools.encryption module
+import io
+import os
+import pytest
+import sys
+from ulif.gnupgtools.encryption import (
+    is_encrypted, peek, read_passphrase, encrypted_output, decrypted_input,
+    EncryptionError)
+from ulif.gnupgtools.utils import CommandTimeout
+
+
+def encrypt(data, passphrase=b'secret'):
+    # get `data` symmetrically encrypted
+    result = io.BytesIO()
+    with encrypted_output(
+            result, symmetric=True, passphrase=passphrase) as pipe:
+        pipe.write(data)
+    return result.getvalue()
+
+
+def test_is_encrypted(gnupg_home_creator):
+    # we detect encrypted data
+    gnupg_home_creator.create_sample_gnupg_home('empty')
+    assert is_encrypted(encrypt(b'foo')) is True
+    assert is_encrypted(b'-----BEGIN PGP MESSAGE-----\n\njA0E') is True
+    assert is_encrypted(b'-----BEGIN PGP PUBLIC KEY BLOCK-----\n') is False
+    assert is_encrypted(b'\x1f\x8b\x08\x00') is False
+    assert is_encrypted(b'') is False
+
+
+def test_peek():
+    # we can peek into streams
+    head, reader = peek(io.BytesIO(b'0123456789'), 4)
+    assert head == b'0123'
+    assert reader.read(2) == b'01'
+    assert reader.read(4) == b'23'
+    assert reader.read() == b'456789'
+    head, reader = peek(io.BytesIO(b'0123456789'), 4)
+    assert reader.read() == b'0123456789'
+
+
+def test_read_passphrase(work_dir_creator):
+    # we read the first line of passphrase files
+    with open('passphrase', 'wb') as fd:
+        fd.write(b'my secret\r\nsecond line\n')
+    assert read_passphrase('passphrase') == b'my secret'
+
+
+def test_encrypt_decrypt(gnupg_home_creator):
+    # we can encrypt and decrypt streams
+    gnupg_home_creator.create_sample_gnupg_home('empty')
+    data = os.urandom(100000)
+    with decrypted_input(io.BytesIO(encrypt(data)),
+                         passphrase=b'secret') as pipe:
+        assert pipe.read() == data
+
+
+def test_encrypt_decrypt_files(gnupg_home_creator):
+    # real files are passed to gpg directly
+    gnupg_home_creator.create_sample_gnupg_home('empty')
+    with open('data.gpg', 'wb') as fd:
+        fd.write(b'head')
+        with encrypted_output(
+                fd, symmetric=True, passphrase=b'secret') as pipe:
+            pipe.write(b'foo')
+    with open('data.gpg', 'rb') as fd:
+        assert fd.read(4) == b'head'
+        with decrypted_input(fd, passphrase=b'secret') as pipe:
+            assert pipe.read() == b'foo'
+
+
+def test_decrypt_wrong_passphrase(gnupg_home_creator):
+    # gpg errors are reported, even if we read nothing
+    gnupg_home_creator.create_sample_gnupg_home('empty')
+    encrypted = encrypt(b'foo')
+    with pytest.raises(EncryptionError):
+        with decrypted_input(io.BytesIO(encrypted), passphrase=b'wrong'):
+            pass
+    with pytest.raises(EncryptionError):
+        with decrypted_input(
+                io.BytesIO(encrypted), passphrase=b'wrong') as pipe:
+            if not pipe.read():
+                raise ValueError('no data')
+
+
+def test_encrypt_no_method():
+    # we need recipients or symmetric encryption
+    with pytest.raises(ValueError):
+        encrypted_output(io.BytesIO())
+
+
+def test_encrypt_timeout(work_dir_creator):
+    # hanging gpg processes are killed
+    path = os.path.join(work_dir_creator.workdir, 'slow-gpg')
+    with open(path, 'w') as fd:
+        fd.write('#!%s\nimport time\ntime.sleep(10)\n' % sys.executable)
+    os.chmod(path, 0o700)
+    with pytest.raises(CommandTimeout):
+        with encrypted_output(io.BytesIO(), recipients=['DAA011C5'],
+                              executable=path, timeout=0.2):
+            pass
@@ -0,0 +1,106 @@
+# Tests for ulif.gnupgtools.ephemeral module
+import os
+import pytest
+from ulif.gnupgtools.ephemeral import (
+    is_lock_file, clone_file, clone_home, remove_home, ephemeral_home,
+    HomeTemplate)
+from ulif.gnupgtools.import_master_key import main
+
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), 'gnupg-samples')
+EXPORT_SAMPLES_DIR = os.path.join(os.path.dirname(__file__), 'export-samples')
+
+
+def create_home(path):
+    # create a small fake GnuPG home at `path`
+    os.makedirs(os.path.join(path, 'private-keys-v1.d'))
+    for name in ('pubring.kbx', 'trustdb.gpg', 'pubring.kbx.lock',
+                 os.path.join('private-keys-v1.d', 'ABC.key')):
+        with open(os.path.join(path, name), 'w') as fd:
+            fd.write(name)
+    return path
+
+
+def test_is_lock_file():
+    # we know gpg lock files
+    assert is_lock_file('pubring.kbx.lock') is True
+    assert is_lock_file('.#lk0x0000561d.vm.1234') is True
+    assert is_lock_file('pubring.kbx') is False
+
+
+def test_clone_file(work_dir_creator):
+    # files are cloned as cheap as possible
+    with open('source', 'w') as fd:
+        fd.write('data')
+    assert clone_file('source', 'copy') in ('reflink', 'copy')
+    assert clone_file('source', 'link', link=True) in ('reflink', 'link')
+    assert clone_file(
+        'source', 'copy2', methods={'reflink': False}) == 'copy'
+    for name in ('copy', 'link', 'copy2'):
+        with open(name) as fd:
+            assert fd.read() == 'data'
+    assert os.stat('copy2').st_ino != os.stat('source').st_ino
+
+
+def test_clone_home(work_dir_creator):
+    # only keyrings are linked, lock files are left out
+    source = create_home('source')
+    result = clone_home(source, 'target')
+    assert sum(result.values()) == 3
+    assert sorted(os.listdir('target')) == [
+        'private-keys-v1.d', 'pubring.kbx', 'trustdb.gpg']
+    assert os.listdir(os.path.join('target', 'private-keys-v1.d')) == [
+        'ABC.key']
+    if 'link' in result:
+        assert result['link'] == 1
+        assert os.path.samefile('source/pubring.kbx', 'target/pubring.kbx')
+    assert not os.path.samefile('source/trustdb.gpg', 'target/trustdb.gpg')
+
+
+def test_clone_home_no_links(work_dir_creator):
+    # we can request copies
+    result = clone_home(create_home('source'), 'target', link=False)
+    assert 'link' not in result
+
+
+def test_remove_home(work_dir_creator):
+    # homes are removed
+    remove_home(create_home('home'))
+    assert not os.path.exists('home')
+
+
+def test_ephemeral_home(work_dir_creator):
+    # we get temporary (copies of) homes
+    with ephemeral_home() as home:
+        assert os.listdir(home) == []
+    assert not os.path.exists(home)
+    with ephemeral_home(create_home('template')) as home:
+        assert 'pubring.kbx' in os.listdir(home)
+    assert not os.path.exists(home)
+
+
+def test_home_template(work_dir_creator):
+    # homes are created from snapshots of templates
+    template = HomeTemplate(create_home('template'))
+    try:
+        os.unlink(os.path.join('template', 'trustdb.gpg'))
+        assert 'trustdb.gpg' in os.listdir(template.create('home1'))
+        with template.home() as home:
+            assert 'trustdb.gpg' in os.listdir(home)
+    finally:
+        template.close()
+    assert not os.path.exists(template.snapshot)
+
+
+def test_home_template_gpg(work_dir_creator):
+    # changes gpg makes in homes do not leak into the template
+    with HomeTemplate(os.path.join(SAMPLES_DIR, 'public-only')) as template:
+        with open(os.path.join(template.snapshot, 'pubring.gpg'), 'rb') as fd:
+            pubring = fd.read()
+        with template.home() as home:
+            main(['gpg-import-master-key', '--homedir', home,
+                  os.path.join(EXPORT_SAMPLES_DIR, 'DAA011C5.tar.gz')])
+            with open(os.path.join(home, 'pubring.gpg'), 'rb') as fd:
+                assert fd.read() != pubring
+        with open(os.path.join(template.snapshot, 'pubring.gpg'), 'rb') as fd:
+            assert fd.read() == pubring
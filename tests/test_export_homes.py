@@ -0,0 +1,176 @@
+# Tests for ulif.gnupgtools.export_homes module
+import json
+import os
+import pytest
+import shutil
+from ulif.gnupgtools.export_homes import (
+    handle_options, expand_homes, get_home_dir_name, export_home,
+    export_homes, list_homes, main)
+from ulif.gnupgtools.utils import use_backend
+
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), 'gnupg-samples')
+
+
+def create_homes(workdir, *names):
+    # copy sample homes `names` into `workdir`, return their paths
+    result = []
+    for name in names:
+        path = os.path.join(workdir, 'homes', name)
+        shutil.copytree(os.path.join(SAMPLES_DIR, name), path)
+        result.append(path)
+    return result
+
+
+def test_handle_options_defaults():
+    # we provide sensible defaults
+    result = handle_options(['home1'])
+    assert result.homes == ['home1']
+    assert result.gnupg_path == 'gpg'
+    assert result.output_dir == '.'
+    assert result.jobs is None
+    assert result.native is False
+    assert result.plan is False
+    assert result.history == []
+
+
+def test_handle_options_jobs():
+    # we can set the number of parallel exports
+    assert handle_options(['-j', '3', 'h']).jobs == 3
+    assert handle_options(['--jobs', '2', 'h']).jobs == 2
+
+
+def test_expand_homes(work_dir_creator):
+    # we expand globs, remove dupes and keep unmatched names
+    workdir = work_dir_creator.workdir
+    home1, home2 = create_homes(workdir, 'one-secret', 'two-users')
+    pattern = os.path.join(workdir, 'homes', '*')
+    missing = os.path.join(workdir, 'missing')
+    assert expand_homes([pattern, home1, missing]) == [
+        home1, home2, missing]
+
+
+def test_get_home_dir_name():
+    # homes with same basename get different dir names
+    assert get_home_dir_name('/a/.gnupg') == 'a_.gnupg'
+    assert get_home_dir_name('/b/.gnupg/') == 'b_.gnupg'
+
+
+def test_export_home_missing(work_dir_creator):
+    # missing homes are reported as failures
+    workdir = work_dir_creator.workdir
+    home = os.path.join(workdir, 'missing')
+    result = export_home(
+        (home, os.path.join(workdir, 'out'), 'gpg', True, None))
+    assert result['exported'] == []
+    assert result['failures'] == [
+        (None, 'No such GnuPG home: %s' % home)]
+    assert not os.path.exists(os.path.join(workdir, 'out'))
+
+
+def test_export_home_timeout(work_dir_creator):
+    # hanging gpg commands are killed and reported
+    workdir = work_dir_creator.workdir
+    home, = create_homes(workdir, 'one-secret')
+    gpg_path = os.path.join(workdir, 'hanging-gpg')
+    with open(gpg_path, 'w') as fd:
+        fd.write('#!/bin/sh\nsleep 30\n')
+    os.chmod(gpg_path, 0o700)
+    result = export_home(
+        (home, os.path.join(workdir, 'out'), gpg_path, False, 0.5))
+    cmd = '%s --with-colons --fixed-list-mode --with-fingerprint -K' % (
+        gpg_path)
+    assert result['timeouts'] == [cmd]
+    assert result['failures'] == [
+        (None, 'Command timed out after 0.5 seconds: %s' % cmd)]
+    assert result['seconds'] < 10
+
+
+def test_export_home_gnupg_path(work_dir_creator):
+    # exports use the gpg binary given
+    workdir = work_dir_creator.workdir
+    home, = create_homes(workdir, 'one-secret')
+    calls = []
+
+    class Backend(object):
+        def execute(self, cmd_list, **kw):
+            calls.append(cmd_list[0])
+            return b'', b''
+
+    with use_backend(Backend()):
+        result = export_home(
+            (home, os.path.join(workdir, 'out'), '/opt/gpg', True, None))
+    assert result['exported'] == ['16FD1DE8']
+    assert calls == ['/opt/gpg'] * 3
+
+
+def test_export_homes(work_dir_creator):
+    # we export all keys of all homes into separate dirs
+    workdir = work_dir_creator.workdir
+    homes = create_homes(workdir, 'one-secret', 'two-users', 'empty')
+    out_dir = os.path.join(workdir, 'out')
+    results = export_homes(homes, out_dir, jobs=2, native=True)
+    assert [x['home'] for x in results] == homes
+    assert [x['exported'] for x in results] == [
+        ['16FD1DE8'], ['DAA011C5', '16FD1DE8'], []]
+    assert [x['failures'] for x in results] == [[], [], []]
+    assert [x['timeouts'] for x in results] == [[], [], []]
+    assert sorted(os.listdir(out_dir)) == [
+        get_home_dir_name(homes[0]), get_home_dir_name(homes[1])]
+    assert os.listdir(results[0]['output_dir']) == ['16FD1DE8.tar.gz']
+    assert results[0]['bytes'] == os.path.getsize(
+        os.path.join(results[0]['output_dir'], '16FD1DE8.tar.gz'))
+    assert results[0]['estimated_bytes'] > 0
+
+
+def test_main(work_dir_creator, capsys):
+    # we write a summary and exit with error if something failed
+    workdir = work_dir_creator.workdir
+    create_homes(workdir, 'one-secret')
+    out_dir = os.path.join(workdir, 'out')
+    with pytest.raises(SystemExit) as exc_info:
+        main(['gpg-export-homes', '-n', '-d', out_dir,
+              os.path.join(workdir, 'homes', '*'),
+              os.path.join(workdir, 'missing')])
+    assert exc_info.value.code == 1
+    out, err = capsys.readouterr()
+    assert "2 homes, 1 keys exported, 1 failures, 0 timeouts" in out
+    assert "FAILED (listing): No such GnuPG home" in out
+    with open(os.path.join(out_dir, 'summary.json')) as fd:
+        summary = json.load(fd)
+    assert [len(x['exported']) for x in summary['homes']] == [1, 0]
+
+
+def test_list_homes(work_dir_creator):
+    # we list keys of all homes and report failures
+    workdir = work_dir_creator.workdir
+    home, = create_homes(workdir, 'two-users')
+    missing = os.path.join(workdir, 'missing')
+    listings, failures = list_homes([home, missing], native=True)
+    assert [(x, [r[2] for r in y]) for x, y in listings] == [
+        (home, ['DAA011C5', '16FD1DE8']), (missing, [])]
+    assert failures == [(missing, 'No such GnuPG home: %s' % missing)]
+
+
+def test_main_plan(work_dir_creator, capsys):
+    # we can estimate exports from former runs without exporting
+    workdir = work_dir_creator.workdir
+    create_homes(workdir, 'one-secret', 'two-users')
+    history_path = os.path.join(workdir, 'history.json')
+    with open(history_path, 'w') as fd:
+        json.dump(dict(homes=[dict(
+            exported=['A'], failures=[], seconds=2.0)]), fd)
+    imports_path = os.path.join(workdir, 'imports.json')
+    with open(imports_path, 'w') as fd:
+        json.dump(dict(imports=[dict(
+            sources=2, import_seconds=1.0, trustdb_seconds=0.5)]), fd)
+    out_dir = os.path.join(workdir, 'out')
+    main(['gpg-export-homes', '-p', '-n', '-j', '1', '-d', out_dir,
+          '--history', history_path, '--history', imports_path,
+          os.path.join(workdir, 'homes', '*')])
+    out, err = capsys.readouterr()
+    assert "3 keys" in out
+    assert "in 6.00s\n" in out
+    assert "Based on 2.00s per key" in out
+    assert "Bulk import would take 2.00s, based on 0.50s per key" in out
+    assert not os.path.exists(out_dir)
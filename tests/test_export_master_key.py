@@ -1,4 +1,5 @@
 import grp
+import io
 import os
 import pwd
 import pytest
@@ -7,11 +8,21 @@ import stat
 import sys
 import tarfile
 import tempfile
+import time
 import ulif.gnupgtools.export_master_key
-from ulif.gnupgtools.utils import tarfile_open
+from functools import partial
+from ulif.gnupgtools.backup_store import BackupStore
+from ulif.gnupgtools.encryption import (
+    decrypted_input, encrypted_output, is_encrypted)
+from ulif.gnupgtools.manifest import get_digest, parse_manifest
+from ulif.gnupgtools.packets import scan_keys
+from ulif.gnupgtools.records import KeyTable
+from ulif.gnupgtools.utils import tarfile_open, use_backend
 from ulif.gnupgtools.export_master_key import (
     main, greeting, VERSION, get_secret_keys_output, get_key_list,
-    export_keys, input_key, RE_HEX_NUMBER, create_tarfile, s
+    export_keys, pick_key, RE_HEX_NUMBER, create_tarfile, s,
+    REPRODUCIBLE_MTIME, export_to_store, get_subkey_list, select_subkeys,
+    Subkey, get_export_members, get_minimal_export_options, FORMAT_BINARY,
     )
 
 try:
@@ -47,42 +58,84 @@ def mock_input(request):
     return mocker
 
 
-class TestInputKey(object):
-    # tests for input_key function
+class TestPickKey(object):
+    # tests for pick_key function
 
-    def test_input_key(self, mock_input):
-        # we get a valid input key.
-        mock_input.fake_input_values = ["2", ]
-        result = input_key(3)
-        assert result == 2
+    key_list = [
+        (['Bob Tester <bob@example.org>'], 'sec   2048R/DAA011C5', 'DAA011C5'),
+        (['Gnupg Testuser <gnupg@example.org>'], 'sec   2048R/16FD1DE8',
+         '16FD1DE8'),
+        (['Other Bob <other@example.org>'], 'sec   2048R/DEADBEEF',
+         'DEADBEEF'),
+        ]
 
-    def test_input_key_non_numbers(self, mock_input):
-        # we do not accept non numbers
-        mock_input.fake_input_values = ["not-a-number", "2"]
-        result = input_key(3)
-        assert result == 2
-
-    def test_input_key_min(self, mock_input):
-        # we must enter at least 1
-        mock_input.fake_input_values = ["0", "-1", "1", "2"]
-        result = input_key(3)
-        assert result == 1
-
-    def test_input_key_max(self, mock_input):
-        # we allow at most the number passed in
-        mock_input.fake_input_values = ["12", "4", "3", "2"]
-        result = input_key(3)
-        assert result == 3
-
-    def test_input_key_exit(self, mock_input):
+    def test_pick_key_number(self, mock_input, capsys):
+        # we can pick keys by position
+        mock_input.fake_input_values = ["#0", "#4", "#x", "#2"]
+        assert pick_key(self.key_list) == 2
+        out, err = capsys.readouterr()
+        assert "No such key: #4" in out
+
+    def test_pick_key_numeric_id(self, mock_input, capsys):
+        # plain numbers are searched for, also on short lists
+        key_list = self.key_list + [
+            (['Num <num@example.org>'], 'sec   2048R/12345678', '12345678')]
+        mock_input.fake_input_values = ["16"]
+        assert pick_key(key_list) == 2
+        mock_input.fake_input_values = ["123"]
+        assert pick_key(key_list) == 4
+
+    def test_pick_key_number_no_position(self, mock_input, capsys):
+        # plain numbers that are also positions are never picked
+        mock_input.fake_input_values = ["1", "#1"]
+        assert pick_key(self.key_list[:2]) == 1
+        out, err = capsys.readouterr()
+        lists = out.split("Which key")
+        assert "Enter #1 to pick key #1" in lists[1]
+        assert "[  #2] sec   2048R/16FD1DE8" in lists[1]
+        assert "[  #1]" not in lists[1]
+
+    def test_pick_key_search(self, mock_input, capsys):
+        # we can pick keys by key id or uid directly
+        mock_input.fake_input_values = ["16fd1de8"]
+        assert pick_key(self.key_list) == 2
+        mock_input.fake_input_values = ["gnupg"]
+        assert pick_key(self.key_list) == 2
+
+    def test_pick_key_filter(self, mock_input, capsys):
+        # searches with several results filter the list
+        mock_input.fake_input_values = ["bob", "nomatch", "", "#3"]
+        assert pick_key(self.key_list) == 3
+        out, err = capsys.readouterr()
+        lists = out.split("Which key")
+        assert "[  #2]" in lists[0]
+        assert "[  #2]" not in lists[1]
+        assert "[  #3] sec   2048R/DEADBEEF" in lists[1]
+        assert "No keys found matching: nomatch" in lists[2]
+        assert "[  #2]" in lists[3]
+
+    def test_pick_key_paging(self, mock_input, capsys):
+        # we show large lists in pages
+        mock_input.fake_input_values = ["n", "n", "p", "#3"]
+        assert pick_key(self.key_list, page_size=2) == 3
+        out, err = capsys.readouterr()
+        pages = out.split("Which key")
+        assert "Page 1/2 (3 keys" in pages[0]
+        assert "[  #3]" not in pages[0]
+        assert "Page 2/2 (3 keys" in pages[1]
+        assert "[  #1]" not in pages[1]
+        assert "Page 2/2" in pages[2]
+        assert "Page 1/2" in pages[3]
+
+    def test_pick_key_exit(self, mock_input, capsys):
         # we can abort with 'q'
         mock_input.fake_input_values = ["q"]
         with pytest.raises(SystemExit):
-            input_key(3)
+            pick_key(self.key_list)
 
 
 class TestExportMasterKeyModule(object):
-    # export_master_key module tests (except input_key, s. above)
+    # export_master_key module tests (except pick_key, s. above)
 
     def test_RE_HEX_NUMBER(self):
         assert RE_HEX_NUMBER.match('abcdef0')
@@ -98,6 +151,46 @@ class TestExportMasterKeyModule(object):
         assert s("text") == "text"
         assert s(b"text".decode("utf-8")) == "text"
 
+    def test_create_tarfile_fileobj(self, work_dir_creator):
+        # we can write tarfiles to file objects
+        fd = io.BytesIO()
+        create_tarfile(fd, {'file1': b'content1'})
+        assert not fd.closed
+        fd.seek(0)
+        with tarfile_open(None, 'r|gz', fd) as tar:
+            assert [x.name for x in tar] == ['file1']
+        assert os.listdir('.') == []
+
+    def test_create_tarfile_manifest(self, work_dir_creator):
+        # we can add a (signed) manifest of member digests
+        create_tarfile(
+            'sample.tar.gz', {'file1': b'foo', 'file2': b'bar'},
+            manifest=True, signer=lambda data: b'SIG ' + data[:8])
+        with tarfile_open('sample.tar.gz', 'r:gz') as tar:
+            assert tar.getnames() == [
+                'file1', 'file2', 'SHA256SUMS', 'SHA256SUMS.asc']
+            manifest = tar.extractfile('SHA256SUMS').read()
+            signature = tar.extractfile('SHA256SUMS.asc').read()
+        assert parse_manifest(manifest) == dict(
+            file1=get_digest(b'foo'), file2=get_digest(b'bar'))
+        assert signature == b'SIG ' + manifest[:8]
+
+    def test_create_tarfile_encrypted(self, gnupg_home_creator):
+        # we can encrypt archives while writing them
+        gnupg_home_creator.create_sample_gnupg_home('empty')
+        create_tarfile(
+            'sample.tar.gz.gpg', {'file1': b'foo'},
+            encrypt=partial(
+                encrypted_output, symmetric=True, passphrase=b'secret'))
+        assert stat.S_IMODE(os.stat('sample.tar.gz.gpg').st_mode) == (
+            stat.S_IRUSR | stat.S_IWUSR)
+        with open('sample.tar.gz.gpg', 'rb') as fd:
+            assert is_encrypted(fd.read(64))
+            fd.seek(0)
+            with decrypted_input(fd, passphrase=b'secret') as pipe:
+                with tarfile_open(None, 'r|gz', pipe) as tar:
+                    assert [x.name for x in tar] == ['file1']
+
     def test_create_tarfile(self, work_dir_creator):
         # we can create tarfiles
         create_tarfile(
@@ -135,6 +228,56 @@ class TestExportMasterKeyModule(object):
         assert members[0].uname == pwd.getpwuid(os.getuid()).pw_name
         assert members[0].gname == grp.getgrgid(os.getgid()).gr_name
 
+    def test_create_tarfile_threads(self, work_dir_creator):
+        # we can compress archives in parallel
+        members = {'file1': b'content1' * 100000, 'file2': b'content2'}
+        create_tarfile('sample.tar.gz', members, threads=4)
+        with tarfile_open('sample.tar.gz', 'r:gz') as tar:
+            assert tar.getnames() == ['file1', 'file2']
+            assert tar.extractfile('file1').read() == members['file1']
+        assert stat.S_IMODE(os.stat('sample.tar.gz').st_mode) == (
+            stat.S_IRUSR | stat.S_IWUSR)
+
+    def test_create_tarfile_threads_reproducible(self, work_dir_creator):
+        # parallel compression can be combined with reproducible mode
+        members = {'file1': b'content1' * 100000, 'file2': b'content2'}
+        create_tarfile('sample1.tar.gz', members, True, threads=4)
+        create_tarfile('sample2.tar.gz', members, True, threads=2)
+        assert open('sample1.tar.gz', 'rb').read() == open(
+            'sample2.tar.gz', 'rb').read()
+
+    def test_get_minimal_export_options(self):
+        # we support minimal exports only with sufficiently new versions
+        assert get_minimal_export_options((1, 4, 18)) == [
+            'export-minimal', 'no-export-attributes']
+        assert get_minimal_export_options((1, 3)) == []
+        assert get_minimal_export_options(None) == []
+
+    def test_create_tarfile_sorted(self, work_dir_creator):
+        # members are stored sorted by name
+        create_tarfile(
+            'sample.tar.gz', {'b': b'content', 'c': b'', 'a': b'content'})
+        with tarfile_open('sample.tar.gz', 'r:gz') as tar:
+            names = tar.getnames()
+        assert names == ['a', 'b', 'c']
+
+    def test_create_tarfile_reproducible(self, work_dir_creator):
+        # in reproducible mode, same content results in same archives
+        members = {'file1': b'content1', 'file2': b'content2'}
+        create_tarfile('sample1.tar.gz', members, reproducible=True)
+        time.sleep(1.1)
+        create_tarfile('sample2.tar.gz', dict(reversed(list(
+            members.items()))), reproducible=True)
+        assert open('sample1.tar.gz', 'rb').read() == open(
+            'sample2.tar.gz', 'rb').read()
+        with tarfile_open('sample1.tar.gz', 'r:gz') as tar:
+            members = tar.getmembers()
+        assert [(x.uid, x.gid, x.uname, x.gname) for x in members] == [
+            (0, 0, '', ''), (0, 0, '', '')]
+        assert [x.mtime for x in members] == [REPRODUCIBLE_MTIME] * 2
+        assert [x.mode for x in members] == [
+            stat.S_IRUSR | stat.S_IWUSR] * 2
+
     def test_main_exists(self):
         # the main function exists
         assert main is not None
@@ -154,7 +297,7 @@ class TestExportMasterKeyModule(object):
         # we can get secret keys via gpg commandline tool
         gnupg_home_creator.create_sample_gnupg_home('one-secret')
         out, err = get_secret_keys_output()
-        assert err is None
+        assert isinstance(err, bytes)
         assert out[-161:] == (
             b"----------------------\n"
             b"sec   2048R/16FD1DE8 2015-01-06\n"
@@ -169,7 +312,7 @@ class TestExportMasterKeyModule(object):
         # a passed-in GnuPG path is respected
         gnupg_home_creator.create_sample_gnupg_home('two-users')
         out, err = get_secret_keys_output(gnupg_path=fake_gpg_binary.path)
-        assert err is None
+        assert err == b''
         assert b"Ferdinand Fake" in out
 
     def test_get_key_list(self, gnupg_home_creator):
@@ -199,6 +342,89 @@ class TestExportMasterKeyModule(object):
                 )
             ]
 
+    def test_get_key_list_subkeys(
+            self, gnupg_home_creator, fake_gpg_binary):
+        # parsed key records know their subkeys
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        result = get_key_list(gnupg_path=fake_gpg_binary.path)
+        assert result[0].subkeys == ('FFFFFFFF', )
+        assert result[0].fingerprint == (
+            '2222222222222222222222221111111100000000')
+
+    def test_get_key_list_fingerprints(self, gnupg_home_creator):
+        # records listed by gpg know fingerprints of their primary keys
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        result = get_key_list()
+        assert [x.fingerprint for x in result] == [
+            'ADCDF0520660D3594FA2A5648C3589C9DAA011C5',
+            'E8BB84692E01A0A0A5C7388C7A893D4E16FD1DE8']
+
+    def test_get_key_list_table(self, gnupg_home_creator, fake_gpg_binary):
+        # we can get listings as key tables
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        result = get_key_list(
+            gnupg_path=fake_gpg_binary.path, native=True, table=True)
+        assert isinstance(result, KeyTable)
+        assert [x.key_id for x in result] == ['DAA011C5', '16FD1DE8']
+
+    def test_get_key_list_table_gpg(
+            self, gnupg_home_creator, fake_gpg_binary):
+        # tables are filled from gpg output as well
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        result = get_key_list(gnupg_path=fake_gpg_binary.path, table=True)
+        assert isinstance(result, KeyTable)
+        assert list(result) == get_key_list(gnupg_path=fake_gpg_binary.path)
+
+    def test_get_key_list_native(self, gnupg_home_creator, fake_gpg_binary):
+        # we can read keys without calling gpg
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        result = get_key_list(gnupg_path=fake_gpg_binary.path, native=True)
+        assert [x[2] for x in result] == ['DAA011C5', '16FD1DE8']
+
+    def test_get_key_list_native_fallback(
+            self, gnupg_home_creator, fake_gpg_binary):
+        # we call gpg if keyrings cannot be read natively
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        os.unlink(os.path.join(gnupg_home_creator.gnupg_home, 'secring.gpg'))
+        result = get_key_list(gnupg_path=fake_gpg_binary.path, native=True)
+        assert [x[2] for x in result] == ['00000000']
+
+    def test_get_subkey_list(self, gnupg_home_creator):
+        # we can get the subkeys of a key
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        result = get_subkey_list('16FD1DE8')
+        assert [(x.key_id, x.capabilities) for x in result] == [
+            ('D48259F675DD62A6', 'E'), ('281F197822BBE98B', 'S'),
+            ('BA91C1DA35460AE2', 'S')]
+        assert result[0].created == 1420516379
+        assert result[0].expires == 0
+
+    def test_select_subkeys(self, gnupg_home_creator):
+        # we can pick subkeys by capability
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        subkeys = get_subkey_list('16FD1DE8')
+        assert select_subkeys(subkeys, 'E') == ['D48259F675DD62A6']
+        assert select_subkeys(subkeys, 's') == [
+            '281F197822BBE98B', 'BA91C1DA35460AE2']
+        assert select_subkeys(subkeys, 'A') == []
+
+    def test_select_subkeys_expired(self):
+        # expired and revoked subkeys are not selected
+        subkeys = [
+            Subkey('AAAAAAAA', 'u', 100, 200, 'E'),
+            Subkey('BBBBBBBB', 'e', 100, 0, 'E'),
+            Subkey('CCCCCCCC', 'r', 100, 0, 'E'),
+            Subkey('DDDDDDDD', 'u', 100, 0, 'E')]
+        assert select_subkeys(subkeys, 'E', now=150) == [
+            'AAAAAAAA', 'DDDDDDDD']
+        assert select_subkeys(subkeys, 'E', now=250) == ['DDDDDDDD']
+
+    def test_get_export_members_no_subkeys(self, gnupg_home_creator):
+        # we refuse to export empty selections of subkeys
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        with pytest.raises(ValueError):
+            get_export_members('16FD1DE8', subkeys=[])
+
     def test_export_keys(self, gnupg_home_creator):
         # we can export a certain, existing key
         gnupg_home_creator.create_sample_gnupg_home('two-users')
@@ -213,6 +439,156 @@ class TestExportMasterKeyModule(object):
         assert priv_key_info.size > 0
         return
 
+    def test_export_keys_gnupg_path(self, work_dir_creator):
+        # all gpg calls use the gpg binary given
+        calls = []
+
+        class Backend(object):
+            def execute(self, cmd_list, **kw):
+                calls.append(cmd_list)
+                return b'', b''
+
+        with use_backend(Backend()):
+            export_keys('DAA011C5', minimal=True, gnupg_path='/opt/gpg')
+        assert len(calls) == 4
+        assert [x[0] for x in calls] == ['/opt/gpg'] * 4
+
+    def test_export_to_store(self, gnupg_home_creator):
+        # we can export keys into a backup store
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        result_path = export_to_store('DAA011C5', 'store')
+        assert os.path.isfile(result_path)
+        members = BackupStore('store').get('DAA011C5')
+        assert sorted(members.keys()) == [
+            'DAA011C5.priv', 'DAA011C5.pub', 'DAA011C5.subkeys']
+        # keys are stored in binary format
+        assert members['DAA011C5.pub'][:1] not in (b'', b'-')
+
+    def test_export_to_store_capabilities(self, work_dir_creator):
+        # subkeys selected by capabilities are stored
+        calls = []
+
+        class Backend(object):
+            def execute(self, cmd_list, **kw):
+                calls.append(cmd_list)
+                if '--with-colons' in cmd_list:
+                    return (b'pub:u:2048:1:8C3589C9DAA011C5:1420520124:::u:::'
+                            b'scESC:\nsub:u:2048:1:12044D9EBB615A4F:'
+                            b'1420520124::::::e:\n'), b''
+                return b'', b''
+
+        with use_backend(Backend()):
+            export_to_store('DAA011C5', 'store', capabilities='E',
+                            minimal=True)
+        assert calls[-1][-1] == '12044D9EBB615A4F!'
+        assert ['gpg', '--version'] in calls
+
+    def test_main_option_store_conflicts(self, capsys):
+        # archive options cannot be used with stores
+        with pytest.raises(SystemExit) as exc_info:
+            main(['gpg-export-master-key', '-s', 'store', '-r', '--symmetric'])
+        assert exc_info.value.code == 2
+        out, err = capsys.readouterr()
+        assert ("--reproducible, --symmetric cannot be used with --store"
+                in err)
+
+    def test_get_export_members_export_options(self, gnupg_home_creator):
+        # export options are respected
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        members = get_export_members('DAA011C5', armor=False)
+        minimal = get_export_members(
+            'DAA011C5', armor=False, export_options=['export-minimal'])
+        assert 0 < len(minimal['DAA011C5.pub']) <= len(
+            members['DAA011C5.pub'])
+
+    def test_export_keys_binary(self, gnupg_home_creator):
+        # we can export keys in binary format
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        result_path = export_keys('DAA011C5', armor=False)
+        with tarfile_open(result_path, 'r:gz') as tar:
+            assert sorted(tar.getnames()) == [
+                'DAA011C5.format', 'DAA011C5.priv', 'DAA011C5.pub',
+                'DAA011C5.subkeys', 'SHA256SUMS']
+            pub = tar.extractfile('DAA011C5.pub').read()
+            marker = tar.extractfile('DAA011C5.format').read()
+        assert marker == FORMAT_BINARY
+        assert not pub.startswith(b'-----BEGIN PGP')
+        assert scan_keys(pub)[0].key_id == '8C3589C9DAA011C5'
+
+    def test_export_keys_homedir(self, work_dir_creator):
+        # we can export from explicitly given homes into given dirs
+        home = os.path.join(work_dir_creator.temp_dir, 'home')
+        shutil.copytree(os.path.join(
+            os.path.dirname(__file__), 'gnupg-samples', 'two-users'), home)
+        os.mkdir('out')
+        result_path = export_keys(
+            'DAA011C5', homedir=home, output_dir=os.path.abspath('out'))
+        assert result_path == os.path.abspath(
+            os.path.join('out', 'DAA011C5.tar.gz'))
+        with tarfile_open(result_path, 'r:gz') as tar:
+            pub = tar.extractfile('DAA011C5.pub').read()
+        assert scan_keys(pub)[0].key_id == '8C3589C9DAA011C5'
+
+    def test_export_keys_output(self, work_dir_creator):
+        # we can export into paths and file objects
+        home = os.path.join(work_dir_creator.temp_dir, 'home')
+        shutil.copytree(os.path.join(
+            os.path.dirname(__file__), 'gnupg-samples', 'two-users'), home)
+        result = export_keys('DAA011C5', homedir=home, output='my.tgz')
+        assert result == 'my.tgz'
+        assert tarfile.is_tarfile('my.tgz')
+        fd = io.BytesIO()
+        assert export_keys('DAA011C5', homedir=home, output=fd) is fd
+        assert sorted(os.listdir('.')) == ['my.tgz']
+        fd.seek(0)
+        with tarfile_open(None, 'r|gz', fd) as tar:
+            assert sorted([x.name for x in tar]) == [
+                'DAA011C5.priv', 'DAA011C5.pub', 'DAA011C5.subkeys',
+                'SHA256SUMS']
+
+    def test_export_keys_encrypted(self, work_dir_creator):
+        # we can export encrypted archives
+        home = os.path.join(work_dir_creator.temp_dir, 'home')
+        shutil.copytree(os.path.join(
+            os.path.dirname(__file__), 'gnupg-samples', 'two-users'), home)
+        result_path = export_keys(
+            'DAA011C5', homedir=home, symmetric=True, passphrase=b'secret')
+        assert os.path.basename(result_path) == 'DAA011C5.tar.gz.gpg'
+        with open(result_path, 'rb') as fd:
+            with decrypted_input(
+                    fd, passphrase=b'secret', homedir=home) as pipe:
+                with tarfile_open(None, 'r|gz', pipe) as tar:
+                    assert 'DAA011C5.pub' in [x.name for x in tar]
+
+    def test_export_keys_homedir_threads(self, work_dir_creator):
+        # we can export from different homes in parallel
+        from multiprocessing.pool import ThreadPool
+        samples = os.path.join(os.path.dirname(__file__), 'gnupg-samples')
+        jobs = []
+        for num, (name, key) in enumerate([
+                ('two-users', 'DAA011C5'), ('one-secret', '16FD1DE8')]):
+            home = os.path.join(work_dir_creator.temp_dir, 'home%s' % num)
+            shutil.copytree(os.path.join(samples, name), home)
+            out_dir = os.path.join(work_dir_creator.temp_dir, 'out%s' % num)
+            os.mkdir(out_dir)
+            jobs.append((key, home, out_dir))
+        pool = ThreadPool(2)
+        results = pool.map(
+            lambda job: export_keys(job[0], homedir=job[1], output_dir=job[2]),
+            jobs)
+        pool.close()
+        assert [os.path.basename(x) for x in results] == [
+            'DAA011C5.tar.gz', '16FD1DE8.tar.gz']
+        assert 'GNUPGHOME' not in os.environ or (
+            os.environ['GNUPGHOME'] not in [x[1] for x in jobs])
+
+    def test_get_key_list_homedir(self, work_dir_creator, fake_gpg_binary):
+        # we can list keys of explicitly given homes
+        home = os.path.join(os.path.dirname(__file__), 'gnupg-samples',
+                            'two-users')
+        result = get_key_list(native=True, homedir=home)
+        assert [x[2] for x in result] == ['DAA011C5', '16FD1DE8']
+
     def test_export_keys_requires_valid_hex_num(self, gnupg_home_creator):
         with pytest.raises(ValueError) as exc_info:
             export_keys('not-a-hex')
@@ -221,7 +597,7 @@ class TestExportMasterKeyModule(object):
     def test_main(self, gnupg_home_creator, mock_input, capsys):
         # we can export keys via the main() function
         gnupg_home_creator.create_sample_gnupg_home('two-users')
-        mock_input.fake_input_values = ["1"]
+        mock_input.fake_input_values = ["#1"]
         result_path = main(['gpg-export-master-key', ])
         out, err = capsys.readouterr()
         assert os.path.exists(result_path)
@@ -230,9 +606,77 @@ class TestExportMasterKeyModule(object):
         with tarfile_open(result_path, 'r:gz') as tar:
             members = tar.getmembers()
         assert sorted([x.name for x in members]) == [
-            'DAA011C5.priv', 'DAA011C5.pub', 'DAA011C5.subkeys']
+            'DAA011C5.priv', 'DAA011C5.pub', 'DAA011C5.subkeys', 'SHA256SUMS']
         assert 0 not in [x.size for x in members]
 
+    def test_main_option_key(self, gnupg_home_creator, capsys):
+        # we can select keys from the commandline
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        result_path = main(['gpg-export-master-key', '-n', '-k', 'bob'])
+        assert os.path.basename(result_path) == 'DAA011C5.tar.gz'
+
+    def test_main_option_capabilities_none(self, gnupg_home_creator, capsys):
+        # we complain if no subkey has the capabilities requested
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        with pytest.raises(SystemExit) as exc_info:
+            main(['gpg-export-master-key', '-n', '-k', 'bob', '-c', 'A'])
+        assert exc_info.value.code == 2
+        out, err = capsys.readouterr()
+        assert "No subkeys selected for export: DAA011C5" in err
+
+    def test_main_option_output_stdout(
+            self, gnupg_home_creator, capsys, monkeypatch):
+        # we can write archives to stdout, messages then go to stderr
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        stdout = io.TextIOWrapper(io.BytesIO())
+        monkeypatch.setattr(sys, 'stdout', stdout)
+        result = main(['gpg-export-master-key', '-n', '-k', 'bob', '-o', '-'])
+        assert result is stdout.buffer
+        assert sys.stdout is stdout
+        stdout.buffer.seek(0)
+        with tarfile_open(None, 'r|gz', stdout.buffer) as tar:
+            assert 'DAA011C5.pub' in [x.name for x in tar]
+        out, err = capsys.readouterr()
+        assert "Picked key: 1 (DAA011C5)" in err
+
+    def test_main_option_watch(
+            self, gnupg_home_creator, capsys, monkeypatch):
+        # we can watch keys and export them when they change
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        calls = []
+
+        def fake_watch_keys(list_func, export_func, **kw):
+            calls.append(kw)
+            assert [x[2] for x in list_func()] == ['DAA011C5', '16FD1DE8']
+            yield [export_func('DAA011C5') and 'DAA011C5']
+            raise KeyboardInterrupt()
+        monkeypatch.setattr(
+            ulif.gnupgtools.export_master_key, 'watch_keys', fake_watch_keys)
+        main(['gpg-export-master-key', '-n', '-w', '-d', 'out', '--poll', '2'])
+        assert os.listdir('out') == ['DAA011C5.tar.gz']
+        assert calls[0]['state_path'] == os.path.join(
+            'out', '.watch-state.json')
+        assert calls[0]['poll_interval'] == 2.0
+        out, err = capsys.readouterr()
+        assert "Exported changed keys: DAA011C5" in out
+        assert "Stopped watching." in out
+
+    def test_main_option_watch_output(self, gnupg_home_creator, capsys):
+        # we cannot watch and export into a single output
+        with pytest.raises(SystemExit):
+            main(['gpg-export-master-key', '-w', '-o', 'my.tgz'])
+        out, err = capsys.readouterr()
+        assert "Cannot watch" in err
+
+    def test_main_option_key_ambiguous(self, gnupg_home_creator, capsys):
+        # we complain if keys given on commandline are not unique
+        gnupg_home_creator.create_sample_gnupg_home('two-users')
+        with pytest.raises(SystemExit) as exc_info:
+            main(['gpg-export-master-key', '-n', '-k', 'example'])
+        assert exc_info.value.code == 1
+        out, err = capsys.readouterr()
+        assert "2 keys found matching: example" in err
+
     def test_main_empty(self, gnupg_home_creator, capsys):
         # we cope with empty gnupg homes
         gnupg_home_creator.create_sample_gnupg_home('empty')
@@ -245,7 +689,7 @@ class TestExportMasterKeyModule(object):
             self, gnupg_home_creator, mock_input, capsys, fake_gpg_binary,):
         # we can set a custom gpg path
         gnupg_home_creator.create_sample_gnupg_home('two-users')
-        mock_input.fake_input_values = ["1"]
+        mock_input.fake_input_values = ["#1"]
         main(['gpg-export-master-key', '-b', fake_gpg_binary.path])
         out, err = capsys.readouterr()
         assert "Ferdinand Fake <ferdi@fake.org>" in out
@@ -256,7 +700,7 @@ class TestExportMasterKeyModule(object):
                              capsys, fake_gpg_binary,):
         # we can use gpg2 if installed
         gnupg_home_creator.create_sample_gnupg_home('two-users')
-        mock_input.fake_input_values = ["1"]
+        mock_input.fake_input_values = ["#1"]
         main(['gpg-export-master-key', '-b', 'gpg2'])
         out, err = capsys.readouterr()
         assert "DAA011C5.tar.gz" in out
@@ -270,7 +714,16 @@ class TestExportMasterKeyModule(object):
         out = out.replace(
             os.path.basename(sys.argv[0]), 'gpg-export-master-key')
         assert out == (
-            'usage: gpg-export-master-key [-h] [-b PATH]\n'
+            'usage: gpg-export-master-key [-h] [-b PATH] [--homedir DIR] [-d '
+            'DIR] [-n] [-r]\n'
+            '                             [-c CAPS] [-m] [-s DIR] [--threads '
+            'NUM]\n'
+            '                             [--no-armor] [-o FILE] [-k KEY] [-t '
+            'SECS]\n'
+            '                             [--sign KEY] [-e RECIPIENT] '
+            '[--symmetric]\n'
+            '                             [--passphrase-file FILE] [-w] '
+            '[--poll SECS]\n'
             '\n'
             'Export GnuPG master key\n'
             '\n'
@@ -278,4 +731,39 @@ class TestExportMasterKeyModule(object):
             '  -h, --help            show this help message and exit\n'
             '  -b PATH, --binary PATH\n'
             '                        Path to GnuPG binary to use\n'
+            '  --homedir DIR         GnuPG home to use (default: $GNUPGHOME)\n'
+            '  -d DIR, --output-dir DIR\n'
+            '                        Write archives into DIR\n'
+            '  -n, --native          Read keyrings directly, without calling '
+            'gpg\n'
+            '  -r, --reproducible    Use fixed timestamps and owners in '
+            'archives\n'
+            '  -c CAPS, --capabilities CAPS\n'
+            '                        Export only valid subkeys with any of '
+            'capabilities\n'
+            '                        CAPS (S, E, A)\n'
+            '  -m, --minimal         Strip signatures and photo ids from '
+            'exports\n'
+            '  -s DIR, --store DIR   Export into deduplicating backup store '
+            'DIR\n'
+            '  --threads NUM         Compress archives using NUM threads\n'
+            '  --no-armor            Store keys in binary format\n'
+            '  -o FILE, --output FILE\n'
+            '                        Write archive to FILE (- for stdout)\n'
+            '  -k KEY, --key KEY     Export KEY (key id, fingerprint or uid) '
+            'without asking\n'
+            '  -t SECS, --timeout SECS\n'
+            '                        Abort gpg commands running longer than '
+            'SECS\n'
+            '  --sign KEY            Sign the archive manifest with KEY\n'
+            '  -e RECIPIENT, --encrypt RECIPIENT\n'
+            '                        Encrypt the archive for RECIPIENT\n'
+            '  --symmetric           Encrypt the archive with a passphrase\n'
+            '  --passphrase-file FILE\n'
+            '                        Read passphrase for --symmetric from '
+            'FILE\n'
+            '  -w, --watch           Export keys whenever they change\n'
+            '  --poll SECS           Watch by checking keyrings every SECS '
+            'instead of using\n'
+            '                        inotify\n'
             )
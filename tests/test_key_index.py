@@ -0,0 +1,71 @@
+# Tests for ulif.gnupgtools.key_index module
+from ulif.gnupgtools.key_index import KeyIndex, tokenize
+from ulif.gnupgtools.records import KeyRecord
+
+
+KEY_LIST = [
+    (['Bob Tester <bob@example.org>'],
+     'sec   2048R/DAA011C5 2015-01-06', 'DAA011C5'),
+    (['Gnupg Testuser (no real person) <gnupg@example.org>',
+      'Gnupg Testuser (Other Identity) <gnupg@example.org>'],
+     'sec   2048R/16FD1DE8 2015-01-06', '16FD1DE8'),
+    (['Alice <alice@example.com>'],
+     'sec   2048R/DAB00000 2015-01-06', 'DAB00000'),
+    ]
+
+
+def test_tokenize():
+    # we split texts into lowercase words
+    assert tokenize('') == []
+    assert tokenize('Gnupg (Other) <g@x.org>') == [
+        'gnupg', 'other', 'g', 'x', 'org']
+
+
+def test_search_key_id():
+    # we can search by key ids and their prefixes
+    index = KeyIndex(KEY_LIST)
+    assert index.search('DAA011C5') == [0]
+    assert index.search('daa011c5') == [0]
+    assert index.search('0xDAA011C5') == [0]
+    assert index.search('DA') == [0, 2]
+
+
+def test_search_fingerprint():
+    # fingerprints and long key ids match the key id they end with
+    index = KeyIndex(KEY_LIST)
+    assert index.search('ADCD0C4FE4B2D5C2E8E4DE278C3589C9DAA011C5') == [0]
+    assert index.search('8C3589C9DAA011C5') == [0]
+
+
+def test_search_uid():
+    # we can search by (prefixes of) uid words
+    index = KeyIndex(KEY_LIST)
+    assert index.search('bob') == [0]
+    assert index.search('Test') == [0, 1]
+    assert index.search('example') == [0, 1, 2]
+    assert index.search('example.org') == [0, 1]
+    assert index.search('other identity') == [1]
+    assert index.search('bob other') == []
+
+
+def test_search_substring():
+    # we find substrings of uids not starting a word
+    index = KeyIndex(KEY_LIST)
+    assert index.search('ester') == [0]
+    assert index.search('user') == [1]
+    assert index.search('xyz') == []
+
+
+def test_search_empty():
+    # empty queries give empty results
+    assert KeyIndex(KEY_LIST).search('') == []
+    assert KeyIndex([]).search('bob') == []
+
+
+def test_search_records():
+    # we index fingerprints of key records
+    index = KeyIndex([
+        KeyRecord(['Bob'], 'info', 'DAA011C5',
+                  fingerprint='ADCDF0520660D3594FA2A5648C3589C9DAA011C5')])
+    assert index.search('ADCDF052') == [0]
+    assert index.search('8C3589C9DAA011C5') == [0]
@@ -0,0 +1,118 @@
+# Tests for ulif.gnupgtools.keyring module
+import os
+import pytest
+import shutil
+from ulif.gnupgtools.keyring import (
+    get_gnupg_home, read_secret_keys, UnsupportedKeyring)
+from ulif.gnupgtools.utils import execute
+
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), 'gnupg-samples')
+
+
+def sample_home(name):
+    return os.path.join(SAMPLES_DIR, name)
+
+
+def test_get_gnupg_home(gnupg_home_creator):
+    # we respect passed in homes and GNUPGHOME
+    assert get_gnupg_home('/foo') == '/foo'
+    assert get_gnupg_home() == gnupg_home_creator.gnupg_home
+
+
+def test_read_secret_keys_legacy():
+    # we can read legacy secret keyrings
+    assert read_secret_keys(sample_home('two-users')) == [
+        (
+            ['Bob Tester <bob@example.org>'],
+            'sec   2048R/DAA011C5 2015-01-06', 'DAA011C5'
+            ),
+        (
+            ['Gnupg Testuser (no real person) <gnupg@example.org>',
+             'Gnupg Testuser (Other Identity) <gnupg@example.org>'],
+            'sec   2048R/16FD1DE8 2015-01-06', '16FD1DE8'
+            )
+        ]
+
+
+def test_read_secret_keys_fingerprints():
+    # we get fingerprints and subkey ids as well
+    bob, gnupg = read_secret_keys(sample_home('two-users'))
+    assert bob.fingerprint == 'ADCDF0520660D3594FA2A5648C3589C9DAA011C5'
+    assert bob.subkeys == ('BB615A4F', )
+    assert gnupg.subkeys == ('75DD62A6', '22BBE98B', '35460AE2')
+
+
+def test_read_secret_keys_legacy_all_samples():
+    # we can read all samples
+    assert read_secret_keys(sample_home('empty')) == []
+    assert read_secret_keys(sample_home('public-only')) == []
+    assert [x[2] for x in read_secret_keys(sample_home('one-secret'))] == [
+        '16FD1DE8']
+    assert len(read_secret_keys(sample_home('three-secret-two-uid'))) == 1
+
+
+def test_read_secret_keys_default_home(gnupg_home_creator):
+    # we read $GNUPGHOME by default
+    gnupg_home_creator.create_sample_gnupg_home('one-secret')
+    assert [x[2] for x in read_secret_keys()] == ['16FD1DE8']
+
+
+def test_read_secret_keys_unsupported(work_dir_creator):
+    # we complain about homes we cannot read
+    with pytest.raises(UnsupportedKeyring):
+        read_secret_keys(os.path.join(work_dir_creator.workdir, 'missing'))
+
+
+def test_read_secret_keys_broken(work_dir_creator):
+    # we complain about broken keyrings
+    home = os.path.join(work_dir_creator.workdir, 'home')
+    os.mkdir(home)
+    with open(os.path.join(home, 'secring.gpg'), 'wb') as fd:
+        fd.write(b'not-a-keyring')
+    with pytest.raises(UnsupportedKeyring):
+        read_secret_keys(home)
+
+
+def test_read_secret_keys_agent(gnupg_home_creator):
+    # we can read homes of GnuPG >= 2.1 (keybox and private-keys-v1.d)
+    home = gnupg_home_creator.gnupg_home
+    os.mkdir(home, 0o700)
+    execute(['gpg', '--batch', '--import',
+             os.path.join(SAMPLES_DIR, 'two-users', 'pubring.gpg')])
+    if not os.path.exists(os.path.join(home, 'pubring.kbx')):
+        pytest.skip("needs GnuPG >= 2.1")
+    grips_dir = os.path.join(home, 'private-keys-v1.d')
+    if not os.path.isdir(grips_dir):
+        os.mkdir(grips_dir, 0o700)
+    assert read_secret_keys(home) == []
+    # secret primary key of DAA011C5
+    open(os.path.join(
+        grips_dir, '059FE64A19A0E3C39BF680AD864A4AE04D8ACAC9.key'), 'w')
+    # secret subkey of 16FD1DE8 only
+    open(os.path.join(
+        grips_dir, '018A6C7565941A1061427676F9481C05BBEDDEDA.key'), 'w')
+    assert [x[1:] for x in read_secret_keys(home)] == [
+        ('sec   2048R/DAA011C5 2015-01-06', 'DAA011C5'),
+        ('sec#  2048R/16FD1DE8 2015-01-06', '16FD1DE8')]
+
+
+def test_read_secret_keys_agent_ecc(work_dir_creator):
+    # we can compute keygrips of ECC, DSA and Elgamal keys
+    home = os.path.join(work_dir_creator.workdir, 'home')
+    shutil.copytree(sample_home('ecc-public'), home)
+    assert read_secret_keys(home) == []
+    grips_dir = os.path.join(home, 'private-keys-v1.d')
+    os.mkdir(grips_dir, 0o700)
+    for grip in (
+            'D2890E14F899EA3AB095A5448400A6F91E6E23B1',  # ed25519
+            '0122E62ECA4B706ED083A694C5A33F51E4ACF32F',  # nistp256 sub
+            'FBB62D8FEAB2D16FC697E41BA9E7902113D5B78B',  # nistp521
+            'FEA3A4BC064EACD8583216DA3001F622230DBB39',  # elg1024 sub
+            ):
+        open(os.path.join(grips_dir, grip + '.key'), 'w')
+    assert [x[1:] for x in read_secret_keys(home)] == [
+        ('sec#  1024D/32935A83 2026-10-19', '32935A83'),
+        ('sec   255E/DCC108BF 2026-10-19', 'DCC108BF'),
+        ('sec#  256E/D5F0A26C 2026-10-19', 'D5F0A26C'),
+        ('sec   521E/3C8DD29B 2026-10-19', '3C8DD29B')]
@@ -0,0 +1,123 @@
+# Tests for ulif.gnupgtools.manifest module
+import io
+import os
+import pytest
+import sys
+from ulif.gnupgtools.manifest import (
+    DigestReader, get_digest, format_manifest, parse_manifest,
+    check_digests, sign_manifest, verify_signature, ManifestError,
+    MANIFEST_NAME, SIGNATURE_NAME)
+
+
+#: SHA-256 digest of b'foo'
+FOO_DIGEST = (
+    '2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae')
+
+
+def create_fake_gpg(workdir, output=b'', status=b''):
+    # create a fake gpg printing `output` and status lines `status`
+    path = os.path.join(workdir, 'fake-gpg')
+    log_path = os.path.join(workdir, 'gpg.log')
+    with open(path, 'w') as fd:
+        fd.write(
+            '#!%s\n'
+            'import os, sys\n'
+            'data = getattr(sys.stdin, "buffer", sys.stdin).read()\n'
+            'with open(%r, "a") as fd:\n'
+            '    fd.write("%%s %%r\\n" %% (sys.argv[1:], data))\n'
+            'if sys.argv[1] == "--status-fd":\n'
+            '    os.write(int(sys.argv[2]), %r)\n'
+            'getattr(sys.stdout, "buffer", sys.stdout).write(%r)\n' % (
+                sys.executable, log_path, status, output))
+    os.chmod(path, 0o700)
+    return path, log_path
+
+
+def test_digest_reader():
+    # we hash all data read
+    reader = DigestReader(io.BytesIO(b'foo'))
+    assert reader.read(2) == b'fo'
+    assert reader.read() == b'o'
+    assert reader.hexdigest() == FOO_DIGEST
+
+
+def test_get_digest():
+    # we get hex digests of bytes-like objects
+    assert get_digest(b'foo') == FOO_DIGEST
+    assert get_digest(memoryview(b'foo')) == FOO_DIGEST
+
+
+def test_format_parse_manifest():
+    # manifests are sha256sum compatible and can be parsed
+    manifest = format_manifest({'b.pub': FOO_DIGEST, 'a.pub': FOO_DIGEST})
+    assert manifest == (
+        ('%s  a.pub\n%s  b.pub\n' % (FOO_DIGEST, FOO_DIGEST)).encode('utf-8'))
+    assert parse_manifest(manifest) == {
+        'a.pub': FOO_DIGEST, 'b.pub': FOO_DIGEST}
+
+
+def test_parse_manifest_malformed():
+    # malformed lines are rejected
+    with pytest.raises(ManifestError):
+        parse_manifest(b'1234  a.pub\n')
+
+
+def test_check_digests():
+    # correct archives pass, the signature is not checked
+    check_digests({
+        'a.pub': b'foo', MANIFEST_NAME: format_manifest({'a.pub': FOO_DIGEST}),
+        SIGNATURE_NAME: b'sig'})
+
+
+def test_check_digests_mismatch():
+    # we detect modified, additional and missing members
+    manifest = format_manifest({'a.pub': FOO_DIGEST})
+    with pytest.raises(ManifestError) as exc_info:
+        check_digests({'a.pub': b'bar', MANIFEST_NAME: manifest})
+    assert 'Checksum mismatch: a.pub' in str(exc_info.value)
+    with pytest.raises(ManifestError) as exc_info:
+        check_digests(
+            {'a.pub': b'foo', 'b.pub': b'foo', MANIFEST_NAME: manifest})
+    assert 'Member not in manifest: b.pub' in str(exc_info.value)
+    with pytest.raises(ManifestError) as exc_info:
+        check_digests({MANIFEST_NAME: manifest})
+    assert 'Members missing: a.pub' in str(exc_info.value)
+
+
+def test_sign_manifest(work_dir_creator):
+    # we create detached signatures with the key given
+    gpg_path, log_path = create_fake_gpg(
+        work_dir_creator.workdir, output=b'SIGNATURE')
+    assert sign_manifest(
+        b'manifest', key='DAA011C5', executable=gpg_path) == b'SIGNATURE'
+    with open(log_path) as fd:
+        assert "'--detach-sign', '--local-user', 'DAA011C5'" in fd.read()
+
+
+def test_sign_manifest_failed(work_dir_creator):
+    # we complain if gpg creates no signature
+    gpg_path, log_path = create_fake_gpg(work_dir_creator.workdir)
+    with pytest.raises(ManifestError):
+        sign_manifest(b'manifest', executable=gpg_path)
+
+
+def test_verify_signature(work_dir_creator):
+    # we accept good signatures
+    gpg_path, log_path = create_fake_gpg(
+        work_dir_creator.workdir,
+        status=b'[GNUPG:] VALIDSIG ADCD0C4FE4B2D5C2E8E4DE278C3589C9DAA011C5\n')
+    result = verify_signature(b'manifest', b'sig', executable=gpg_path)
+    assert result.signatures == ['ADCD0C4FE4B2D5C2E8E4DE278C3589C9DAA011C5']
+    with open(log_path) as fd:
+        log = fd.read()
+    assert "'--verify'" in log
+    assert log.endswith(" b'manifest'\n")
+
+
+def test_verify_signature_bad(work_dir_creator):
+    # we reject bad or unverifiable signatures
+    gpg_path, log_path = create_fake_gpg(
+        work_dir_creator.workdir,
+        status=b'[GNUPG:] ERRSIG 8C3589C9DAA011C5 1 8 00 1420531200 9\n')
+    with pytest.raises(ManifestError):
+        verify_signature(b'manifest', b'sig', executable=gpg_path)
@@ -0,0 +1,124 @@
+# Tests for ulif.gnupgtools.packets module
+import os
+import pytest
+from io import BytesIO
+from ulif.gnupgtools.packets import (
+    iter_packets, iter_keyblocks, parse_key, parse_user_id, get_keygrip,
+    scan_keys, ArmorReader, Packet, PacketError, TAG_SECRET_KEY,
+    TAG_USER_ID,
+    )
+
+SECRING_PATH = os.path.join(
+    os.path.dirname(__file__), 'gnupg-samples', 'two-users', 'secring.gpg')
+
+
+def test_iter_packets_new_format():
+    # we can parse new format packet headers
+    data = b'\xcd\x03bob' + b'\xcd\xc0\x00' + b'x' * 192
+    assert list(iter_packets(BytesIO(data))) == [
+        Packet(13, b'bob'), Packet(13, b'x' * 192)]
+
+
+def test_iter_packets_partial():
+    # partial body lengths are supported
+    data = b'\xcb\xe1ab\x01c'
+    assert list(iter_packets(BytesIO(data))) == [Packet(11, b'abc')]
+
+
+def test_iter_packets_old_format():
+    # we can parse old format packet headers
+    data = b'\xb4\x03bob' + b'\xb5\x00\x02ab' + b'\xb7cd'
+    assert list(iter_packets(BytesIO(data))) == [
+        Packet(13, b'bob'), Packet(13, b'ab'), Packet(13, b'cd')]
+
+
+def test_iter_packets_invalid():
+    # we complain about invalid data
+    with pytest.raises(PacketError):
+        list(iter_packets(BytesIO(b'not-a-packet')))
+    with pytest.raises(PacketError):
+        list(iter_packets(BytesIO(b'\xcd\x05ab')))
+
+
+def test_iter_keyblocks():
+    # we can group packets by primary keys
+    packets = [Packet(13, b'a'), Packet(5, b'k1'), Packet(13, b'b'),
+               Packet(6, b'k2')]
+    assert list(iter_keyblocks(packets)) == [
+        [Packet(5, b'k1'), Packet(13, b'b')], [Packet(6, b'k2')]]
+
+
+def test_parse_keys():
+    # we can parse keys and compute fingerprints and keygrips
+    with open(SECRING_PATH, 'rb') as fp:
+        packets = list(iter_packets(fp))
+    key = parse_key(packets[0])
+    assert packets[0].tag == TAG_SECRET_KEY
+    assert key.fingerprint == 'E8BB84692E01A0A0A5C7388C7A893D4E16FD1DE8'
+    assert key.key_id == '7A893D4E16FD1DE8'
+    assert key.bits == 2048
+    assert key.created == 1420516379
+    assert key.is_stub is False
+    assert get_keygrip(key) == '87A8F77C7F5FE01AA420F40EABA9F5054D8D7665'
+    assert packets[1].tag == TAG_USER_ID
+    assert parse_user_id(packets[1]) == (
+        'Gnupg Testuser (no real person) <gnupg@example.org>')
+
+
+def test_get_keygrip_unsupported():
+    # we cannot compute keygrips of keys on unknown curves
+    key = parse_key(Packet(6, b'\x04\x00\x00\x00\x00\x13\x01\x2a'
+                              b'\x00\x03\x04'))
+    assert key.algo == 19
+    assert get_keygrip(key) is None
+
+
+def test_parse_key_invalid():
+    # we complain about unsupported key packets
+    with pytest.raises(PacketError):
+        parse_key(Packet(6, b'\x05\x00\x00\x00\x00\x01'))
+    with pytest.raises(PacketError):
+        parse_key(Packet(6, b'\x04'))
+
+
+def test_armor_reader():
+    # we can read armored data
+    data = (b'-----BEGIN PGP PUBLIC KEY BLOCK-----\n'
+            b'Version: GnuPG v1\n'
+            b'\n'
+            b'zQNib2I=\n'
+            b'=slKg\n'
+            b'-----END PGP PUBLIC KEY BLOCK-----\n')
+    assert ArmorReader(BytesIO(data)).read() == b'\xcd\x03bob'
+    reader = ArmorReader(BytesIO(data))
+    assert reader.read(2) == b'\xcd\x03'
+    assert reader.read(5) == b'bob'
+
+
+def test_armor_reader_invalid():
+    # we detect invalid armored data
+    with pytest.raises(PacketError):
+        ArmorReader(BytesIO(b'not armored'))
+    data = (b'-----BEGIN PGP PUBLIC KEY BLOCK-----\n\n'
+            b'zQNib2I=\n=AAAA\n-----END PGP PUBLIC KEY BLOCK-----\n')
+    with pytest.raises(PacketError):
+        ArmorReader(BytesIO(data)).read()
+    data = b'-----BEGIN PGP PUBLIC KEY BLOCK-----\n\nzQNib2I=\n'
+    with pytest.raises(PacketError):
+        ArmorReader(BytesIO(data)).read()
+
+
+def test_scan_keys():
+    # we can scan binary and armored key data
+    with open(SECRING_PATH, 'rb') as fp:
+        data = fp.read()
+    result = scan_keys(data)
+    assert [x.key_id for x in result] == [
+        '7A893D4E16FD1DE8', '8C3589C9DAA011C5']
+    assert result[0].uids == [
+        'Gnupg Testuser (no real person) <gnupg@example.org>',
+        'Gnupg Testuser (Other Identity) <gnupg@example.org>']
+    assert len(result[0].subkeys) == 3
+    assert result[1].subkeys[0].fingerprint == (
+        'CA222C41D3359903C5EA96D912044D9EBB615A4F')
+    assert scan_keys(memoryview(data)) == result
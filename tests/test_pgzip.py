@@ -0,0 +1,69 @@
+# Tests for ulif.gnupgtools.pgzip module
+import gzip
+import random
+import tarfile
+import zlib
+from io import BytesIO
+from ulif.gnupgtools.pgzip import ParallelGzipFile, compress_block
+
+
+def sample_data(size, seed=0):
+    # get somewhat compressable, reproducible data
+    rnd = random.Random(seed)
+    words = [b'foo', b'bar', b'baz', b'key', b'sig', b'\n']
+    return b' '.join(rnd.choice(words) for x in range(size // 4))[:size]
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=BytesIO(data), mode='rb').read()
+
+
+def test_compress_block():
+    # blocks form a valid deflate stream
+    data = sample_data(1000)
+    compressed = (
+        compress_block(data[:500], b'', 9, False) +
+        compress_block(data[500:], data[:500], 9, True))
+    assert zlib.decompress(compressed, -zlib.MAX_WBITS) == data
+
+
+def test_parallel_gzip_file():
+    # we can create valid gzip files
+    data = sample_data(1000000)
+    out = BytesIO()
+    with ParallelGzipFile(out, threads=4, block_size=65536) as gz:
+        for pos in range(0, len(data), 10000):
+            gz.write(data[pos:pos + 10000])
+    assert gunzip(out.getvalue()) == data
+    assert len(out.getvalue()) < len(data) // 2
+
+
+def test_parallel_gzip_file_empty():
+    # we can create empty gzip files
+    out = BytesIO()
+    ParallelGzipFile(out, threads=2).close()
+    assert gunzip(out.getvalue()) == b''
+
+
+def test_parallel_gzip_file_mtime():
+    # we can set the timestamp in the gzip header
+    out1, out2 = BytesIO(), BytesIO()
+    for out in (out1, out2):
+        with ParallelGzipFile(out, threads=2, mtime=0) as gz:
+            gz.write(sample_data(300000))
+    assert out1.getvalue() == out2.getvalue()
+
+
+def test_parallel_gzip_file_tarfile():
+    # we can write tar archives readable by tarfile
+    out = BytesIO()
+    data = sample_data(500000)
+    with ParallelGzipFile(out, threads=3) as gz:
+        tar = tarfile.open(fileobj=gz, mode='w|')
+        info = tarfile.TarInfo('member')
+        info.size = len(data)
+        tar.addfile(info, BytesIO(data))
+        tar.close()
+    out.seek(0)
+    tar = tarfile.open(fileobj=out, mode='r:gz')
+    assert tar.extractfile('member').read() == data
@@ -0,0 +1,145 @@
+# Tests for ulif.gnupgtools.plan module
+import json
+from ulif.gnupgtools.plan import (
+    get_key_size, estimate_members, estimate_archive_sizes, load_history,
+    get_rates, schedule_jobs, plan_exports, output_plan,
+    DEFAULT_SECONDS_PER_KEY, DEFAULT_IMPORT_SECONDS_PER_KEY,
+    DEFAULT_TRUSTDB_SECONDS)
+from ulif.gnupgtools.records import KeyRecord
+
+
+#: Key DAA011C5 as listed in sample homes
+RECORD_DAA011C5 = KeyRecord(
+    ['Bob Tester <bob@example.org>'], 'sec   2048R/DAA011C5 2015-01-06',
+    'DAA011C5', subkeys=['BB615A4F'])
+
+
+def test_get_key_size():
+    # we get key sizes and algorithms from key infos
+    assert get_key_size('sec   2048R/DAA011C5 2015-01-06') == (2048, 'R')
+    assert get_key_size('sec#  255E/BA91C1DA 2015-01-06') == (255, 'E')
+    assert get_key_size('sec   rsa4096/DAA011C5') == (2048, 'R')
+    assert get_key_size(None) == (2048, 'R')
+
+
+def test_estimate_members():
+    # estimates are close to the sizes of real exports
+    result = estimate_members(RECORD_DAA011C5)
+    assert abs(result['pub'] - 1179) < 20
+    assert abs(result['priv'] - 2557) < 50
+    assert abs(result['subkeys'] - 1876) < 50
+
+
+def test_estimate_members_stub():
+    # master keys not available are exported as stubs
+    record = KeyRecord(
+        RECORD_DAA011C5.uids, 'sec#  2048R/DAA011C5', 'DAA011C5',
+        subkeys=['BB615A4F'])
+    result = estimate_members(record)
+    assert result['priv'] == result['subkeys']
+
+
+def test_estimate_archive_sizes():
+    # archives are estimated for armored and binary exports
+    result = estimate_archive_sizes(RECORD_DAA011C5)
+    assert abs(result['armor'] - 4175) < 200
+    assert result['binary'] < result['armor']
+    assert estimate_archive_sizes(
+        RECORD_DAA011C5, size_factor=0.5)['armor'] == result['armor'] // 2
+
+
+def test_load_history(work_dir_creator):
+    # we read home results from summaries, ignoring unusable files
+    with open('summary.json', 'w') as fd:
+        json.dump(dict(homes=[dict(home='h1')], seconds=1.0), fd)
+    with open('imports.json', 'w') as fd:
+        json.dump(dict(imports=[dict(sources=2, import_seconds=1.0)]), fd)
+    with open('broken.json', 'w') as fd:
+        fd.write('not json')
+    assert load_history(
+        ['summary.json', 'imports.json', 'broken.json', 'missing']) == [
+            dict(home='h1'), dict(sources=2, import_seconds=1.0)]
+
+
+def test_get_rates():
+    # rates are computed from successful exports only
+    history = [
+        dict(exported=['A', 'B'], failures=[], seconds=3.0, bytes=500,
+             estimated_bytes=1000),
+        dict(exported=['C'], failures=[], seconds=1.0),
+        dict(exported=['D'], failures=[['E', 'error']], seconds=10.0),
+        dict(exported=[], failures=[], seconds=0.1)]
+    rates = get_rates(history)
+    assert rates['seconds_per_key'] == 4.0 / 3
+    assert rates['size_factor'] == 0.5
+    assert rates['homes'] == 2
+
+
+def test_get_rates_imports():
+    # import rates are computed from bulk import timings
+    history = [
+        dict(sources=2, import_seconds=1.0, trustdb_seconds=3.0),
+        dict(sources=3, import_seconds=1.5, trustdb_seconds=1.0),
+        dict(sources=0, import_seconds=0.0, trustdb_seconds=0.5),
+        dict(exported=['A'], failures=[], seconds=2.0)]
+    rates = get_rates(history)
+    assert rates['import_seconds_per_key'] == 0.5
+    assert rates['trustdb_seconds'] == 2.0
+    assert rates['imports'] == 2
+    assert rates['seconds_per_key'] == 2.0
+    assert rates['homes'] == 1
+
+
+def test_get_rates_no_history():
+    # without history we use defaults
+    assert get_rates([]) == dict(
+        seconds_per_key=DEFAULT_SECONDS_PER_KEY, size_factor=1.0, homes=0,
+        import_seconds_per_key=DEFAULT_IMPORT_SECONDS_PER_KEY,
+        trustdb_seconds=DEFAULT_TRUSTDB_SECONDS, imports=0)
+
+
+def test_schedule_jobs():
+    # tasks are started in order on the first free worker
+    assert schedule_jobs([3, 1, 1, 2], jobs=2) == [
+        (1, 0, 3), (2, 0, 1), (2, 1, 2), (2, 2, 4)]
+    assert schedule_jobs([1, 1, 1], jobs=1) == [
+        (1, 0, 1), (1, 1, 2), (1, 2, 3)]
+    assert schedule_jobs([], jobs=2) == []
+
+
+def test_plan_exports():
+    # we estimate sizes and durations of homes
+    history = [dict(exported=['A', 'B'], failures=[], seconds=2.0)]
+    plan = plan_exports(
+        [('h1', [RECORD_DAA011C5, RECORD_DAA011C5]), ('h2', []),
+         ('h3', [RECORD_DAA011C5])], jobs=2, history=history)
+    assert plan['rates']['seconds_per_key'] == 1.0
+    assert [x['schedule'] for x in plan['homes']] == [
+        (1, 0, 2.0), (2, 0, 0.0), (2, 0.0, 1.0)]
+    assert plan['seconds'] == 2.0
+    assert plan['import_seconds'] == (
+        3 * DEFAULT_IMPORT_SECONDS_PER_KEY + DEFAULT_TRUSTDB_SECONDS)
+    size = estimate_archive_sizes(RECORD_DAA011C5)['armor']
+    assert plan['homes'][0]['sizes']['armor'] == 2 * size
+    assert plan['sizes']['armor'] == 3 * size
+    assert plan['homes'][2]['keys'] == [
+        ('DAA011C5', 'Bob Tester <bob@example.org>',
+         estimate_archive_sizes(RECORD_DAA011C5))]
+
+
+def test_output_plan(capsys):
+    # plans are printed per home and key
+    output_plan(plan_exports([('h1', [RECORD_DAA011C5])], jobs=1))
+    out, err = capsys.readouterr()
+    lines = out.splitlines()
+    assert lines[0].startswith('h1 ')
+    assert 'job 1     0.00s-0.50s' in lines[0]
+    assert lines[1].startswith('    DAA011C5 ')
+    assert lines[1].endswith(' Bob Tester <bob@example.org>')
+    assert lines[2].startswith('1 homes, 1 keys, ')
+    assert lines[3] == (
+        'Based on 0.50s per key and size factor 1.00 from 0 homes '
+        'exported before')
+    assert lines[4] == (
+        'Bulk import would take 1.20s, based on 0.20s per key and 1.00s '
+        'for the trustdb check from 0 imports before')
@@ -0,0 +1,108 @@
+# Tests for ulif.gnupgtools.records module
+import pytest
+from ulif.gnupgtools.records import KeyRecord, KeyTable, sort_records
+
+
+def make_records():
+    return [
+        KeyRecord(['Gnupg <g@example.org>'], 'sec   2048R/16FD1DE8',
+                  '16FD1DE8', 'E8BB84692E01A0A0A5C7388C7A893D4E16FD1DE8',
+                  ['75DD62A6', '22BBE98B']),
+        KeyRecord(['Bob <b@example.org>', 'Bob 2'], 'sec   2048R/DAA011C5',
+                  'DAA011C5'),
+        KeyRecord([], 'sec   2048R/00000000', '00000000'),
+        ]
+
+
+def test_key_record_tuple_interface():
+    # records can be used like (uids, info, key) tuples
+    record = make_records()[0]
+    uids, info, key = record
+    assert uids == ['Gnupg <g@example.org>']
+    assert (record[1], record[2], record[-1]) == (info, key, key)
+    assert len(record) == 3
+    assert record == (uids, info, key)
+    assert record != (uids, info, 'DAA011C5')
+
+
+def test_key_record_index():
+    # single fields are returned without copying the record
+    record = make_records()[0]
+    assert record[0] == ['Gnupg <g@example.org>']
+    assert record[2] is record.key_id
+    assert record[-2] is record.info
+    assert record[1:] == ('sec   2048R/16FD1DE8', '16FD1DE8')
+    with pytest.raises(IndexError):
+        record[3]
+
+
+def test_key_record_tuple_hash():
+    # records equal to hashable tuples hash like them
+    record = make_records()[1]
+    other = (tuple(record.uids), record.info, record.key_id)
+    assert record == other
+    assert hash(record) == hash(other)
+    assert record != ('a', 'b')
+    assert record != 'DAA011C5'
+
+
+def test_key_record_attributes():
+    # records carry fingerprints and subkeys
+    record = make_records()[0]
+    assert record.uids == ('Gnupg <g@example.org>', )
+    assert record.key_id == '16FD1DE8'
+    assert record.fingerprint == 'E8BB84692E01A0A0A5C7388C7A893D4E16FD1DE8'
+    assert record.subkeys == ('75DD62A6', '22BBE98B')
+
+
+def test_key_record_slots():
+    # records have no instance dicts
+    with pytest.raises(AttributeError):
+        make_records()[0].foo = 'bar'
+
+
+def test_key_record_equality():
+    # records are equal if all fields are equal
+    records1, records2 = make_records(), make_records()
+    assert records1 == records2
+    assert hash(records1[0]) == hash(records2[0])
+    records2[0].subkeys = ()
+    assert records1[0] != records2[0]
+
+
+def test_sort_records():
+    # records are sorted by first uid and key id
+    records = make_records()
+    assert [x.key_id for x in sort_records(records)] == [
+        '00000000', 'DAA011C5', '16FD1DE8']
+    assert sorted(records) == sort_records(records)
+
+
+def test_key_table():
+    # key tables store records as columns
+    records = make_records()
+    table = KeyTable(records)
+    assert len(table) == 3
+    assert list(table) == records
+    assert table[-1] == records[-1]
+    assert table.uid_offsets.tolist() == [0, 1, 3, 3]
+    assert table.subkey_offsets.tolist() == [0, 2, 2, 2]
+    with pytest.raises(IndexError):
+        table[3]
+
+
+def test_key_table_empty():
+    # empty tables are supported
+    assert list(KeyTable()) == []
+
+
+def test_key_table_add_sort():
+    # tables can be filled field by field and sorted in place
+    table = KeyTable()
+    for record in make_records():
+        table.add(record.uids, record.info, record.key_id,
+                  record.fingerprint, record.subkeys)
+    assert list(table) == make_records()
+    table.sort()
+    assert list(table) == sort_records(make_records())
+    assert table.uid_offsets.tolist() == [0, 0, 2, 3]
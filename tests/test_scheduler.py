@@ -0,0 +1,156 @@
+# Tests for ulif.gnupgtools.scheduler module
+import os
+import pytest
+import sys
+import threading
+import time
+from ulif.gnupgtools.import_master_key import keys_from_arch
+from ulif.gnupgtools.scheduler import (
+    ReadWriteLock, PendingResult, KeyringScheduler)
+from multiprocessing import TimeoutError
+
+
+DAA01C5_TAR_GZ_PATH = os.path.join(
+    os.path.dirname(__file__), 'export-samples', 'DAA011C5.tar.gz')
+
+
+def create_logging_gpg(workdir):
+    # create a fake gpg logging args and input size of each call
+    path = os.path.join(workdir, 'logging-gpg')
+    log_path = os.path.join(workdir, 'gpg.log')
+    with open(path, 'w') as fd:
+        fd.write(
+            '#!%s\n'
+            'import os, sys\n'
+            'data = getattr(sys.stdin, "buffer", sys.stdin).read()\n'
+            'with open(%r, "a") as fd:\n'
+            '    fd.write("%%s %%s\\n" %% (sys.argv[3:], len(data)))\n'
+            'os.write(int(sys.argv[2]), b"[GNUPG:] IMPORT_RES 2\\n")\n' % (
+                sys.executable, log_path))
+    os.chmod(path, 0o700)
+    return path, log_path
+
+
+def test_read_write_lock_readers():
+    # many readers can hold the lock at the same time
+    lock = ReadWriteLock()
+    lock.acquire_read()
+    lock.acquire_read()
+    lock.release_read()
+    lock.release_read()
+    lock.acquire_write()
+    lock.release_write()
+
+
+def test_read_write_lock_writer_waits():
+    # writers wait for readers, new readers wait for writers
+    lock = ReadWriteLock()
+    events = []
+    lock.acquire_read()
+
+    def writer():
+        lock.acquire_write()
+        events.append('write')
+        lock.release_write()
+
+    def reader():
+        lock.acquire_read()
+        events.append('read')
+        lock.release_read()
+    writer_thread = threading.Thread(target=writer)
+    writer_thread.start()
+    time.sleep(0.1)
+    reader_thread = threading.Thread(target=reader)
+    reader_thread.start()
+    time.sleep(0.1)
+    assert events == []
+    lock.release_read()
+    writer_thread.join()
+    reader_thread.join()
+    assert events == ['write', 'read']
+
+
+def test_pending_result():
+    # pending results work like AsyncResults
+    result = PendingResult()
+    assert result.ready() is False
+    with pytest.raises(TimeoutError):
+        result.get(0.01)
+    result.set('foo')
+    assert result.get() == 'foo'
+    result = PendingResult()
+    result.set(error=ValueError('bar'))
+    with pytest.raises(ValueError):
+        result.get()
+
+
+def test_scheduler_readers_concurrent(work_dir_creator):
+    # readers of the same home run concurrently
+    barrier = []
+    both_running = threading.Event()
+
+    def read():
+        barrier.append(1)
+        if len(barrier) == 2:
+            both_running.set()
+        return both_running.wait(5)
+    with KeyringScheduler(threads=2) as scheduler:
+        results = [scheduler.submit_reader('home', read) for x in (1, 2)]
+    assert [x.get() for x in results] == [True, True]
+
+
+def test_scheduler_writers_serialized(work_dir_creator):
+    # writers of the same home run one after another
+    running, max_running = [], []
+
+    def write():
+        running.append(1)
+        max_running.append(len(running))
+        time.sleep(0.05)
+        running.pop()
+    with KeyringScheduler(threads=4) as scheduler:
+        for x in range(4):
+            scheduler.submit_writer('home', write)
+    assert max_running == [1, 1, 1, 1]
+
+
+def test_scheduler_coalesces_imports(work_dir_creator):
+    # imports queued for the same home are done in one gpg call
+    gpg_path, log_path = create_logging_gpg(work_dir_creator.workdir)
+    keys_dict = keys_from_arch(DAA01C5_TAR_GZ_PATH)
+    size = len(keys_dict['pub']) + len(keys_dict['subkeys'])
+    release = threading.Event()
+    with KeyringScheduler(threads=2, executable=gpg_path) as scheduler:
+        # block the home, so that imports get queued
+        scheduler.submit_writer('home', release.wait)
+        time.sleep(0.1)
+        results = [
+            scheduler.import_keys(keys_dict, homedir='home'),
+            scheduler.import_archive(DAA01C5_TAR_GZ_PATH, homedir='home'),
+            scheduler.import_keys(keys_dict, homedir='other')]
+        release.set()
+    with open(log_path) as fd:
+        log = sorted(fd.read().splitlines())
+    assert log == [
+        "['--import'] %s" % size, "['--import'] %s" % (2 * size)]
+    assert results[0].get() is results[1].get()
+    assert results[0].get().counts['count'] == 2
+    assert results[2].get().counts['count'] == 2
+
+
+def test_scheduler_import_invalid(work_dir_creator):
+    # invalid keys are rejected before anything is scheduled
+    keys_dict = keys_from_arch(DAA01C5_TAR_GZ_PATH)
+    keys_dict['key'] = '16FD1DE8'
+    with KeyringScheduler(threads=1) as scheduler:
+        with pytest.raises(ValueError):
+            scheduler.import_keys(keys_dict, homedir='home')
+
+
+def test_scheduler_import_error(work_dir_creator):
+    # errors during import are passed to all results
+    with KeyringScheduler(threads=1, executable='invalid-gpg') as scheduler:
+        result = scheduler.import_archive(
+            DAA01C5_TAR_GZ_PATH, homedir='home')
+    with pytest.raises(OSError):
+        result.get()
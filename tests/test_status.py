@@ -0,0 +1,87 @@
+# Tests for ulif.gnupgtools.status module
+from ulif.gnupgtools.status import (
+    parse_status_line, parse_counts, StatusCollector, ImportResult,
+    ExportResult, VerifyResult, EXPORT_RES_FIELDS)
+
+
+def test_parse_status_line():
+    # we can parse status lines
+    assert parse_status_line(b'[GNUPG:] IMPORTED 8C3589C9DAA011C5 Bob') == (
+        'IMPORTED', ['8C3589C9DAA011C5', 'Bob'])
+    assert parse_status_line(b'[GNUPG:] NODATA\n') == ('NODATA', [])
+    assert parse_status_line(b'[GNUPG:] ') is None
+    assert parse_status_line(b'gpg: key DAA011C5: public key imported\n') is (
+        None)
+
+
+def test_parse_counts():
+    # missing counts are set to zero
+    assert parse_counts(['3', '1'], EXPORT_RES_FIELDS) == dict(
+        count=3, secret_count=1, exported=0)
+
+
+def test_status_collector():
+    # we collect all lines, errors and output
+    collector = StatusCollector()
+    collector('KEY_CONSIDERED', ['ABC', '0'])
+    collector('ERROR', ['keydb_search', '11'])
+    collector.add_output(b'out', None)
+    collector.add_output(None, b'err')
+    assert collector.lines == [
+        ('KEY_CONSIDERED', ['ABC', '0']), ('ERROR', ['keydb_search', '11'])]
+    assert collector.errors == [('ERROR', ['keydb_search', '11'])]
+    assert collector.ok is False
+    assert (collector.stdout, collector.stderr) == (b'out', b'err')
+
+
+def test_import_result():
+    # we sum up import results of several gpg runs
+    result = ImportResult()
+    for line in (
+            b'[GNUPG:] IMPORTED 8C3589C9DAA011C5 Bob Tester <bob@example.org>',
+            b'[GNUPG:] IMPORT_OK 1 ADCD0C4FE4B2D5C2E8E4DE278C3589C9DAA011C5',
+            b'[GNUPG:] IMPORT_RES 1 0 1 1 0 0 0 0 0 0 0 0 0 0 0',
+            b'[GNUPG:] IMPORT_OK 0 ADCD0C4FE4B2D5C2E8E4DE278C3589C9DAA011C5',
+            b'[GNUPG:] IMPORT_RES 1 0 0 0 1 0 0 0 0 1 0 1 0 0 0'):
+        result(*parse_status_line(line))
+    assert result.imported == [
+        ('8C3589C9DAA011C5', 'Bob Tester <bob@example.org>')]
+    assert result.import_ok == [
+        (1, 'ADCD0C4FE4B2D5C2E8E4DE278C3589C9DAA011C5'),
+        (0, 'ADCD0C4FE4B2D5C2E8E4DE278C3589C9DAA011C5')]
+    assert result.unchanged == ['ADCD0C4FE4B2D5C2E8E4DE278C3589C9DAA011C5']
+    assert result.counts['count'] == 2
+    assert result.counts['imported'] == 1
+    assert result.counts['unchanged'] == 1
+    assert result.counts['sec_read'] == 1
+    assert result.ok is True
+
+
+def test_import_result_problem():
+    # import problems are errors
+    result = ImportResult()
+    result('IMPORT_PROBLEM', ['1', 'ADCD'])
+    assert result.errors == [('IMPORT_PROBLEM', ['1', 'ADCD'])]
+    assert result.ok is False
+
+
+def test_export_result():
+    # we collect exported fingerprints
+    result = ExportResult()
+    result('EXPORTED', ['ADCD0C4FE4B2D5C2E8E4DE278C3589C9DAA011C5'])
+    result('EXPORT_RES', ['1', '0', '1'])
+    result('EXPORT_RES', ['1', '1', '1'])
+    assert result.exported == ['ADCD0C4FE4B2D5C2E8E4DE278C3589C9DAA011C5']
+    assert result.counts == dict(count=2, secret_count=1, exported=2)
+
+
+def test_verify_result():
+    # good signatures are valid, bad ones spoil the result
+    result = VerifyResult()
+    assert result.valid is False
+    result('VALIDSIG', ['ADCD0C4FE4B2D5C2E8E4DE278C3589C9DAA011C5', '2015'])
+    assert result.signatures == ['ADCD0C4FE4B2D5C2E8E4DE278C3589C9DAA011C5']
+    assert result.valid is True
+    result('BADSIG', ['8C3589C9DAA011C5', 'Bob'])
+    assert result.bad == ['8C3589C9DAA011C5']
+    assert result.valid is False
@@ -0,0 +1,167 @@
+# Tests for ulif.gnupgtools.sync module
+import os
+import pytest
+import shutil
+import sys
+from ulif.gnupgtools.sync import (
+    handle_options, parse_secret_listing, get_secret_fingerprints,
+    plan_sync, get_export_commands, transfer_keys, sync_homes, main,
+    SyncPlan, SyncError)
+
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), 'gnupg-samples')
+
+#: Fingerprints of keys in sample homes
+FPR_16FD1DE8 = 'E8BB84692E01A0A0A5C7388C7A893D4E16FD1DE8'
+FPR_DAA011C5 = 'ADCDF0520660D3594FA2A5648C3589C9DAA011C5'
+FPR_BA91C1DA = '64CDFF6C79BC28D7637F83B3BA91C1DA35460AE2'
+
+LISTING = (
+    b'sec:u:2048:1:7A893D4E16FD1DE8:1420516379:::u:::scESC:::+:::23::0:\n'
+    b'fpr:::::::::E8BB84692E01A0A0A5C7388C7A893D4E16FD1DE8:\n'
+    b'uid:u::::1420516379::57660D0BDD3C4CD6::Gnupg Testuser::::::::::0:\n'
+    b'ssb:u:2048:1:D48259F675DD62A6:1420516379::::::e:::+:::23:\n'
+    b'fpr:::::::::5FE7450F2D7BA45FDA4777FCD48259F675DD62A6:\n'
+    b'ssb:u:2048:1:281F197822BBE98B:1420517380::::::s:::#:::23:\n'
+    b'fpr:::::::::7913CD0539212682250C4BBE281F197822BBE98B:\n'
+    b'sec:u:2048:1:8C3589C9DAA011C5:1420520124:::u:::scESC:::#:::23::0:\n'
+    b'fpr:::::::::ADCDF0520660D3594FA2A5648C3589C9DAA011C5:\n'
+    b'ssb:u:2048:1:12044D9EBB615A4F:1420520124::::::e:::+:::23:\n'
+    b'fpr:::::::::CA222C41D3359903C5EA96D912044D9EBB615A4F:\n')
+
+
+def create_homes(workdir, *names):
+    # copy sample homes `names` into `workdir`, return their paths
+    result = []
+    for num, name in enumerate(names):
+        path = os.path.join(workdir, 'home%d' % num)
+        shutil.copytree(os.path.join(SAMPLES_DIR, name), path)
+        result.append(path)
+    return result
+
+
+def create_fake_gpg(workdir, export_rc=0):
+    # create a fake gpg exporting its args and logging imported data
+    path = os.path.join(workdir, 'fake-gpg')
+    log_path = os.path.join(workdir, 'gpg.log')
+    with open(path, 'w') as fd:
+        fd.write(
+            '#!%s\n'
+            'import os, sys\n'
+            'args = sys.argv[1:]\n'
+            'if "--import" in args:\n'
+            '    data = getattr(sys.stdin, "buffer", sys.stdin).read()\n'
+            '    with open(%r, "a") as fd:\n'
+            '        fd.write(data.decode("utf-8") + "\\n")\n'
+            '    os.write(int(args[1]), b"[GNUPG:] IMPORT_RES 1\\n")\n'
+            'else:\n'
+            '    sys.stdout.write(" ".join(args))\n'
+            '    sys.stderr.write("export failed")\n'
+            '    sys.exit(%d)\n' % (sys.executable, log_path, export_rc))
+    os.chmod(path, 0o700)
+    return path, log_path
+
+
+def test_handle_options_defaults():
+    # we provide sensible defaults
+    result = handle_options(['src', 'dst'])
+    assert result.source == 'src'
+    assert result.target == 'dst'
+    assert result.gnupg_path == 'gpg'
+    assert result.dry_run is False
+    assert result.timeout is None
+
+
+def test_parse_secret_listing():
+    # we get fingerprints of available secret keys, without stubs
+    assert parse_secret_listing(LISTING) == {
+        FPR_16FD1DE8: (
+            True, frozenset(['5FE7450F2D7BA45FDA4777FCD48259F675DD62A6'])),
+        FPR_DAA011C5: (
+            False, frozenset(['CA222C41D3359903C5EA96D912044D9EBB615A4F']))}
+    assert parse_secret_listing(b'') == dict()
+
+
+def test_get_secret_fingerprints(work_dir_creator):
+    # we can list real GnuPG homes
+    home, = create_homes(work_dir_creator.workdir, 'one-secret')
+    result = get_secret_fingerprints(homedir=home)
+    assert list(result) == [FPR_16FD1DE8]
+    assert result[FPR_16FD1DE8][0] is True
+    assert len(result[FPR_16FD1DE8][1]) == 1
+
+
+def test_plan_sync():
+    # we transfer missing master keys completely, else missing subkeys
+    source = {'A': (True, frozenset(['A1', 'A2'])),
+              'B': (True, frozenset(['B1', 'B2'])),
+              'C': (False, frozenset(['C1']))}
+    target = {'A': (True, frozenset(['A1'])),
+              'B': (False, frozenset(['B1']))}
+    assert plan_sync(source, target) == SyncPlan(['B'], ['A2', 'C1'])
+    assert plan_sync(source, source) == SyncPlan([], [])
+
+
+def test_get_export_commands():
+    # single subkeys are exported with '!'
+    assert get_export_commands(SyncPlan(['A', 'B'], ['C1'])) == [
+        ['--export-secret-keys', 'A', 'B'],
+        ['--export-secret-subkeys', 'C1!']]
+    assert get_export_commands(SyncPlan([], [])) == []
+
+
+def test_transfer_keys(work_dir_creator):
+    # exported keys are piped into the importing gpg
+    gpg_path, log_path = create_fake_gpg(work_dir_creator.workdir)
+    result = transfer_keys(
+        ['--export-secret-keys', 'A'], 'src', 'dst', executable=gpg_path)
+    assert result.counts['count'] == 1
+    with open(log_path) as fd:
+        assert fd.read() == '--batch --export-secret-keys A\n'
+
+
+def test_transfer_keys_export_failed(work_dir_creator):
+    # failing exports are reported
+    gpg_path, log_path = create_fake_gpg(
+        work_dir_creator.workdir, export_rc=2)
+    with pytest.raises(SyncError) as exc_info:
+        transfer_keys(['--export-secret-keys', 'A'], 'src', 'dst',
+                      executable=gpg_path)
+    assert str(exc_info.value) == 'gpg failed (2): export failed'
+
+
+def test_sync_homes_dry_run(work_dir_creator):
+    # we find keys missing in target homes
+    source, target = create_homes(
+        work_dir_creator.workdir, 'two-users', 'two-secret')
+    plan, result = sync_homes(source, target, dry_run=True)
+    assert plan == SyncPlan([FPR_DAA011C5], [FPR_BA91C1DA])
+    assert result is None
+
+
+def test_sync_homes_nothing_missing(work_dir_creator):
+    # homes containing all keys of the source are not touched
+    source, target = create_homes(
+        work_dir_creator.workdir, 'one-secret', 'two-secret')
+    assert sync_homes(source, target) == (SyncPlan([], []), None)
+
+
+def test_main_dry_run(work_dir_creator, capsys):
+    # we can see what would be transferred
+    source, target = create_homes(
+        work_dir_creator.workdir, 'two-users', 'two-secret')
+    main(['gpg-sync-homes', '--dry-run', source, target])
+    out, err = capsys.readouterr()
+    assert out == (
+        'Would transfer master keys: %s\n'
+        'Would transfer subkeys: %s\n' % (FPR_DAA011C5, FPR_BA91C1DA))
+
+
+def test_main_same_home(work_dir_creator, capsys):
+    # we refuse to sync homes with themselves
+    home, = create_homes(work_dir_creator.workdir, 'one-secret')
+    with pytest.raises(SystemExit) as exc_info:
+        main(['gpg-sync-homes', home, home + '/'])
+    assert exc_info.value.code == 2
+    out, err = capsys.readouterr()
+    assert err == 'Source and target are the same home\n'
@@ -3,9 +3,19 @@ import os
 import shutil
 import tempfile
 import unittest
+from multiprocessing.pool import ThreadPool
+from ulif.gnupgtools.export_master_key import (
+    get_key_list, get_subkey_list, export_keys)
+from ulif.gnupgtools.import_master_key import import_master_key
+from ulif.gnupgtools.packets import scan_keys
+from ulif.gnupgtools.scheduler import KeyringScheduler
 from ulif.gnupgtools.testing import (
-    FakeGnuPGHomeTestCase,
+    FakeGnuPGHomeTestCase, HomeTemplates, encode_mpi,
     )
+from ulif.gnupgtools.utils import execute, get_gnupg_version
+
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), 'gnupg-samples')
 
 
 class FakeGnuPGHomeTestCaseTests(unittest.TestCase):
@@ -36,6 +46,16 @@ class FakeGnuPGHomeTestCaseTests(unittest.TestCase):
         assert os.getenv('GNUPGHOME', None) == result
         assert os.path.isdir(result)
 
+    def test_create_new_home_from_template(self):
+        # new homes can be created from templates
+        templates = HomeTemplates(SAMPLES_DIR)
+        try:
+            case = FakeGnuPGHomeTestCase()
+            result = case.create_empty_gpg_home(templates.get('two-users'))
+            assert 'pubring.gpg' in os.listdir(result)
+        finally:
+            templates.close()
+
     def test_cleanup_gpg_home(self):
         # we can cleanup a fake GPG home
         fake_home = tempfile.mkdtemp()
@@ -64,3 +84,94 @@ class FakeGnuPGHomeTestCaseTests(unittest.TestCase):
         os.environ['GNUPGHOME'] = 'MY-FAKE-HOME'
         case.cleanup_gpg_home()
         assert 'GNUPGHOME' not in os.environ
+
+
+
+class HomeTemplatesTests(unittest.TestCase):
+
+    def test_get(self):
+        # templates are created once
+        templates = HomeTemplates(SAMPLES_DIR)
+        template = templates.get('one-secret')
+        assert templates.get('one-secret') is template
+        templates.close()
+        assert not os.path.exists(template.snapshot)
+
+
+def test_encode_mpi():
+    # MPIs start with the number of significant bits
+    assert encode_mpi(b'\x01\x00\x01') == b'\x00\x11\x01\x00\x01'
+    assert encode_mpi(b'\x00\xff') == b'\x00\x08\xff'
+
+
+def test_fake_gnupg_version(fake_gnupg):
+    # the fake pretends to be a recent GnuPG
+    assert get_gnupg_version() == (2, 2, 40)
+
+
+def test_fake_gnupg_unsupported(fake_gnupg):
+    # unknown commands produce errors only
+    out, err = execute(['gpg', '--gen-key'])
+    assert out == b''
+    assert b'unsupported command' in err
+
+
+def test_fake_gnupg_list(fake_gnupg):
+    # keys created can be listed
+    fpr = fake_gnupg.create_key('Bob <bob@example.org>', homedir='/home1',
+                                subkeys='es', created=1420520124)
+    fake_gnupg.create_key('Alice', homedir='/home1', secret=False)
+    key_list = get_key_list(homedir='/home1')
+    assert len(key_list) == 1
+    assert list(key_list[0].uids) == ['Bob <bob@example.org>']
+    assert key_list[0].info == 'sec   2048R/%s 2015-01-06' % fpr[-8:]
+    assert len(key_list[0].subkeys) == 2
+    assert [x.capabilities for x in get_subkey_list(
+        fpr[-8:], homedir='/home1')] == ['E', 'S']
+    assert get_key_list(homedir='/home2') == []
+
+
+def test_fake_gnupg_export_import(fake_gnupg, work_dir_creator):
+    # keys exported can be imported into other homes
+    fpr = fake_gnupg.create_key('Bob', homedir='/home1')
+    key_id = fpr[-8:]
+    export_keys(key_id, homedir='/home1', output_dir='.')
+    result = import_master_key('%s.tar.gz' % key_id, homedir='/home2')
+    assert result.counts['imported'] == 1
+    assert result.counts['sec_imported'] == 1
+    assert get_key_list(homedir='/home2')[0].info.startswith('sec#')
+    result = import_master_key('%s.tar.gz' % key_id, homedir='/home2')
+    assert result.counts['unchanged'] == 2
+
+
+def test_fake_gnupg_export_secret_subkeys(fake_gnupg):
+    # single subkeys can be exported, primary keys as stubs
+    fpr = fake_gnupg.create_key('Bob', subkeys='es')
+    subkey = fake_gnupg.get_keyring()[0].subkeys[1].key
+    out, err = execute(
+        ['gpg', '--export-secret-subkeys', subkey.key_id + '!'])
+    scanned = scan_keys(out)
+    assert scanned[0].fingerprint == fpr
+    assert [x.fingerprint for x in scanned[0].subkeys] == [subkey.fingerprint]
+    out, err = execute(['gpg', '--export-secret-keys', 'DEADBEEF'])
+    assert out == b''
+
+
+def test_fake_gnupg_many_keys_parallel(fake_gnupg):
+    # thousands of keys in many homes are handled in memory
+    for num in range(2000):
+        fake_gnupg.create_key('User %d' % num, homedir='/home%d' % (num % 4))
+    pool = ThreadPool(4)
+    try:
+        key_lists = pool.map(
+            lambda num: get_key_list(homedir='/home%d' % num), range(4))
+    finally:
+        pool.close()
+    assert [len(x) for x in key_lists] == [500] * 4
+    out, err = execute(['gpg', '--export', '--armor'], homedir='/home0')
+    with KeyringScheduler(threads=4) as scheduler:
+        results = [scheduler.import_keys(
+            dict(key=key_lists[0][0].key_id, pub=out, subkeys=out,
+                 format='armor'), homedir='/target%d' % num)
+            for num in range(4)]
+    assert [x.get().counts['imported'] for x in results] == [500] * 4
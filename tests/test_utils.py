@@ -1,8 +1,35 @@
 # Tests for ulif.gnupgtools.utils module
 import os
 import pytest
+import signal
+import sys
 import tarfile
-from ulif.gnupgtools.utils import execute, get_tmp_dir, tarfile_open
+import threading
+import time
+from ulif.gnupgtools.utils import (
+    execute, get_env, get_gnupg_version, get_tmp_dir, tarfile_open,
+    get_backend, set_backend, use_backend, SubprocessBackend,
+    CommandTimeout, CommandCancelled)
+
+
+class RecordingBackend(object):
+    # a backend remembering commands instead of running them
+
+    def __init__(self):
+        self.calls = []
+
+    def execute(self, cmd_list, **kw):
+        self.calls.append((cmd_list, kw['homedir']))
+        return b'out', b'err'
+
+
+def is_running(pid):
+    # tell whether process `pid` is running (not a zombie)
+    try:
+        with open('/proc/%s/stat' % pid) as fd:
+            return fd.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except IOError:
+        return False
 
 
 @pytest.mark.skipif(
@@ -14,6 +41,163 @@ def test_execute():
     assert out == b'Hello $PATH\n'
 
 
+@pytest.mark.skipif(
+    not os.path.exists('/bin/cat'), reason="needs /bin/cat")
+def test_execute_input():
+    # we can pass input to commands, also as memoryviews
+    out, err = execute(["/bin/cat"], input=b'Hello')
+    assert out == b'Hello'
+    out, err = execute(["/bin/cat"], input=memoryview(b'Hello World')[6:])
+    assert out == b'World'
+
+
+@pytest.mark.skipif(
+    not os.path.exists('/usr/bin/env'), reason="needs /usr/bin/env")
+def test_execute_homedir():
+    # we can set GNUPGHOME for single commands
+    old_env = os.environ.copy()
+    out, err = execute(["/usr/bin/env"], homedir='/my/home')
+    assert b'GNUPGHOME=/my/home\n' in out
+    assert os.environ == old_env
+
+
+@pytest.mark.skipif(
+    not os.path.exists('/bin/cat'), reason="needs /bin/cat")
+def test_execute_timeout_not_reached():
+    # commands finishing in time work as usual, also with input
+    out, err = execute(["/bin/cat"], input=b'Hello', timeout=10)
+    assert out == b'Hello'
+    out, err = execute(
+        ["/bin/cat"], input=b'Hello', cancel=threading.Event())
+    assert out == b'Hello'
+
+
+@pytest.mark.skipif(
+    not os.path.exists('/proc/self/stat'), reason="needs /proc")
+def test_execute_timeout(work_dir_creator):
+    # hanging commands are killed, including their children
+    pid_path = os.path.join(work_dir_creator.workdir, 'child.pid')
+    cmd = ["/bin/sh", "-c", "sleep 30 & echo $! > %s; wait" % pid_path]
+    start = time.time()
+    with pytest.raises(CommandTimeout) as exc_info:
+        execute(cmd, timeout=0.5)
+    assert time.time() - start < 10
+    assert exc_info.value.cmd_list == cmd
+    assert exc_info.value.timeout == 0.5
+    with open(pid_path) as fd:
+        child_pid = int(fd.read())
+    time.sleep(0.2)
+    assert not is_running(child_pid)
+
+
+@pytest.mark.skipif(
+    not os.path.exists('/proc/self/stat'), reason="needs /proc")
+def test_execute_interrupted(work_dir_creator):
+    # commands are killed if waiting for them is interrupted
+    pid_path = os.path.join(work_dir_creator.workdir, 'child.pid')
+    cmd = ["/bin/sh", "-c", "sleep 30 & echo $! > %s; wait" % pid_path]
+
+    def interrupt(signum, frame):
+        raise KeyboardInterrupt()
+
+    old_handler = signal.signal(signal.SIGALRM, interrupt)
+    signal.setitimer(signal.ITIMER_REAL, 0.5)
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            execute(cmd)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old_handler)
+    with open(pid_path) as fd:
+        child_pid = int(fd.read())
+    time.sleep(0.2)
+    assert not is_running(child_pid)
+
+
+@pytest.mark.skipif(
+    not os.path.exists('/bin/sleep'), reason="needs /bin/sleep")
+def test_execute_cancel():
+    # running commands can be cancelled from other threads
+    cancel = threading.Event()
+    timer = threading.Timer(0.3, cancel.set)
+    timer.start()
+    with pytest.raises(CommandCancelled) as exc_info:
+        execute(["/bin/sleep", "30"], cancel=cancel, timeout=20)
+    assert exc_info.value.cmd_list == ["/bin/sleep", "30"]
+    assert str(exc_info.value) == 'Command cancelled: /bin/sleep 30'
+
+
+@pytest.mark.skipif(
+    not os.path.exists('/bin/sh'), reason="needs /bin/sh")
+def test_execute_stderr():
+    # we capture stderr
+    out, err = execute(["/bin/sh", "-c", "echo out; echo err >&2"])
+    assert (out, err) == (b'out\n', b'err\n')
+
+
+def test_execute_status_callback(work_dir_creator):
+    # we can get status lines while commands run
+    script_path = os.path.join(work_dir_creator.workdir, 'fake-gpg')
+    with open(script_path, 'w') as fd:
+        fd.write(
+            '#!%s\n'
+            'import os, sys\n'
+            'fd = int(sys.argv[2])\n'
+            'os.write(fd, b"[GNUPG:] IMPORT_OK 1 ABCD\\nno status\\n")\n'
+            'print("args: %%s" %% sys.argv[3])\n' % sys.executable)
+    os.chmod(script_path, 0o700)
+    lines = []
+    out, err = execute(
+        [script_path, '--import'],
+        status_callback=lambda *args: lines.append(args))
+    assert out == b'args: --import\n'
+    assert lines == [('IMPORT_OK', ['1', 'ABCD'])]
+
+
+def test_set_backend():
+    # commands can be run by other backends
+    backend = RecordingBackend()
+    old_backend = set_backend(backend)
+    try:
+        assert isinstance(old_backend, SubprocessBackend)
+        assert get_backend() is backend
+        assert execute(['gpg', '-K'], homedir='/home') == (b'out', b'err')
+    finally:
+        set_backend(old_backend)
+    assert backend.calls == [(['gpg', '-K'], '/home')]
+
+
+def test_use_backend():
+    # backends can be used temporarily
+    backend = RecordingBackend()
+    old_backend = get_backend()
+    with use_backend(backend):
+        assert get_backend() is backend
+        execute(['gpg', '--version'])
+    assert get_backend() is old_backend
+    assert len(backend.calls) == 1
+
+
+def test_get_env():
+    # we can get environments for certain gnupg homes
+    assert get_env() is None
+    env = get_env('/my/home')
+    assert env['GNUPGHOME'] == '/my/home'
+    assert os.environ.get('GNUPGHOME') != '/my/home'
+
+
+def test_get_gnupg_version():
+    # we can get the version of installed gpg
+    version = get_gnupg_version()
+    assert isinstance(version, tuple)
+    assert version >= (1, 0)
+
+
+def test_get_gnupg_version_fake(fake_gpg_binary):
+    # we get None if a version cannot be determined
+    assert get_gnupg_version(fake_gpg_binary.path) is None
+
+
 def test_get_tmp_dir():
     # we can create temporary dirs
     d = None
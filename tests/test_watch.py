@@ -0,0 +1,193 @@
+# Tests for ulif.gnupgtools.watch module
+import os
+import pytest
+import shutil
+import time
+from functools import partial
+from ulif.gnupgtools.export_master_key import get_key_list
+from ulif.gnupgtools.records import KeyRecord
+from ulif.gnupgtools.watch import (
+    is_keyring_file, InotifyWatcher, PollingWatcher, get_watcher,
+    wait_for_changes, get_key_state, diff_listings, load_state, save_state,
+    watch_keys, load_libc)
+
+
+SAMPLES = os.path.join(os.path.dirname(__file__), 'gnupg-samples')
+
+needs_inotify = pytest.mark.skipif(
+    load_libc() is None, reason='inotify not available')
+
+
+def touch(path, content=b'changed'):
+    with open(path, 'ab') as fd:
+        fd.write(content)
+
+
+def copy_keyrings(sample, home):
+    # replace keyrings in `home` with the ones of `sample`, like gpg does
+    for name in ('pubring.gpg', 'secring.gpg'):
+        shutil.copy(os.path.join(SAMPLES, sample, name),
+                    os.path.join(home, name + '.tmp'))
+        os.rename(os.path.join(home, name + '.tmp'), os.path.join(home, name))
+
+
+def test_is_keyring_file():
+    # we know which files contain keys
+    assert is_keyring_file('pubring.kbx') is True
+    assert is_keyring_file('ABCDEF0123.key') is True
+    assert is_keyring_file('pubring.kbx.lock') is False
+    assert is_keyring_file('trustdb.gpg') is False
+    assert is_keyring_file('S.gpg-agent') is False
+
+
+@needs_inotify
+def test_inotify_watcher(work_dir_creator):
+    # we get notified about changes of keyring files
+    home = work_dir_creator.workdir
+    watcher = InotifyWatcher(home)
+    try:
+        assert watcher.read_changes(0.05) == set()
+        touch(os.path.join(home, 'trustdb.gpg'))
+        assert watcher.read_changes(0.05) == set()
+        touch(os.path.join(home, 'pubring.kbx'))
+        assert watcher.read_changes(1) == set(['pubring.kbx'])
+    finally:
+        watcher.close()
+
+
+@needs_inotify
+def test_inotify_watcher_private_keys(work_dir_creator):
+    # new private keys dirs are watched as well
+    home = work_dir_creator.workdir
+    watcher = InotifyWatcher(home)
+    try:
+        os.mkdir(os.path.join(home, 'private-keys-v1.d'))
+        assert watcher.read_changes(1) == set(['private-keys-v1.d'])
+        touch(os.path.join(home, 'private-keys-v1.d', 'ABC.key'))
+        assert watcher.read_changes(1) == set(['ABC.key'])
+    finally:
+        watcher.close()
+
+
+def test_polling_watcher(work_dir_creator):
+    # we can detect changes by polling
+    home = work_dir_creator.workdir
+    watcher = PollingWatcher(home, interval=0.01)
+    assert watcher.read_changes(0.05) == set()
+    touch(os.path.join(home, 'trustdb.gpg'))
+    touch(os.path.join(home, 'secring.gpg'))
+    assert watcher.read_changes(1) == set(['secring.gpg'])
+    os.unlink(os.path.join(home, 'secring.gpg'))
+    assert watcher.read_changes(1) == set(['secring.gpg'])
+
+
+def test_get_watcher(work_dir_creator):
+    # we get inotify watchers, unless polling is requested
+    home = work_dir_creator.workdir
+    watcher = get_watcher(home, poll_interval=0.5)
+    assert isinstance(watcher, PollingWatcher)
+    assert watcher.interval == 0.5
+    watcher = get_watcher(home)
+    watcher.close()
+    if load_libc() is not None:
+        assert isinstance(watcher, InotifyWatcher)
+
+
+def test_wait_for_changes(work_dir_creator):
+    # bursts of changes are collected
+    home = work_dir_creator.workdir
+    watcher = PollingWatcher(home, interval=0.01)
+    touch(os.path.join(home, 'pubring.gpg'))
+    start = time.time()
+    assert wait_for_changes(watcher, timeout=1, quiet=0.1) == set([
+        'pubring.gpg'])
+    assert time.time() - start >= 0.1
+    assert wait_for_changes(watcher, timeout=0.05, quiet=0.1) == set()
+
+
+def test_diff_listings():
+    # we find keys added or changed
+    old = [KeyRecord(['Bob'], 'sec', 'DAA011C5', 'F1', ['BB615A4F']),
+           KeyRecord(['Alice'], 'sec', '16FD1DE8', 'F2')]
+    new = [KeyRecord(['Bob'], 'sec', 'DAA011C5', 'F1', ['BB615A4F']),
+           KeyRecord(['Alice', 'Al'], 'sec', '16FD1DE8', 'F2'),
+           KeyRecord(['Carol'], 'sec', 'DEADBEEF', 'F3')]
+    states = dict((x.key_id, get_key_state(x)) for x in old)
+    assert diff_listings(states, new) == ['16FD1DE8', 'DEADBEEF']
+    assert diff_listings(dict(), old) == ['DAA011C5', '16FD1DE8']
+
+
+def test_load_save_state(work_dir_creator):
+    # we can store states
+    assert load_state('state.json') == dict()
+    save_state('state.json', {'DAA011C5': [['Bob'], 'sec', None, []]})
+    assert load_state('state.json') == {
+        'DAA011C5': [['Bob'], 'sec', None, []]}
+    assert os.listdir('.') == ['state.json']
+
+
+def test_watch_keys(work_dir_creator):
+    # we export keys added or changed
+    home = os.path.join(work_dir_creator.temp_dir, 'home')
+    shutil.copytree(os.path.join(SAMPLES, 'two-secret'), home)
+    exported = []
+    rounds = watch_keys(
+        partial(get_key_list, native=True, homedir=home), exported.append,
+        homedir=home, state_path='state.json', poll_interval=0.01,
+        quiet=0.05, wait=2)
+    assert next(rounds) == ['16FD1DE8']
+    copy_keyrings('three-secret-two-uid', home)
+    assert next(rounds) == ['16FD1DE8']
+    copy_keyrings('two-users', home)
+    assert next(rounds) == ['DAA011C5']
+    rounds.close()
+    assert exported == ['16FD1DE8', '16FD1DE8', 'DAA011C5']
+    # after restarts only changes are exported
+    rounds = watch_keys(
+        partial(get_key_list, native=True, homedir=home), exported.append,
+        homedir=home, state_path='state.json', poll_interval=0.01, wait=0.05)
+    assert next(rounds) == []
+    assert next(rounds) == []
+    rounds.close()
+
+
+def test_watch_keys_export_failed(work_dir_creator):
+    # failed exports are reported, keys are exported with next change
+    home = os.path.join(work_dir_creator.temp_dir, 'home')
+    shutil.copytree(os.path.join(SAMPLES, 'two-secret'), home)
+    exported, failures = [], []
+
+    def export_func(key_id):
+        if not failures:
+            raise ValueError('export failed')
+        exported.append(key_id)
+
+    rounds = watch_keys(
+        partial(get_key_list, native=True, homedir=home), export_func,
+        homedir=home, state_path='state.json', poll_interval=0.01,
+        quiet=0.05, wait=2,
+        error_func=lambda key_id, err: failures.append((key_id, str(err))))
+    assert next(rounds) == []
+    assert failures == [('16FD1DE8', 'export failed')]
+    assert load_state('state.json') == dict()
+    copy_keyrings('two-users', home)
+    assert next(rounds) == ['DAA011C5', '16FD1DE8']
+    rounds.close()
+    assert sorted(load_state('state.json')) == ['16FD1DE8', 'DAA011C5']
+
+
+def test_watch_keys_state_saved_on_interrupt(work_dir_creator):
+    # the state of keys exported is stored when watching is interrupted
+    home = os.path.join(work_dir_creator.temp_dir, 'home')
+    shutil.copytree(os.path.join(SAMPLES, 'two-users'), home)
+
+    def export_func(key_id):
+        if key_id == '16FD1DE8':
+            raise KeyboardInterrupt()
+
+    rounds = watch_keys(
+        partial(get_key_list, native=True, homedir=home), export_func,
+        homedir=home, state_path='state.json', poll_interval=0.01)
+    with pytest.raises(KeyboardInterrupt):
+        next(rounds)
+    assert list(load_state('state.json')) == ['DAA011C5']
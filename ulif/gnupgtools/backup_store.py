@@ -0,0 +1,241 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Deduplicating backup store for exported keys.
+
+ A backup store is a directory that looks like this::
+
+   <store>/chunks/<2 hex digits>/<sha256 hexdigest>
+   <store>/manifests/<key-id>/<generation>.json
+
+ Exported key data is split into content-defined chunks. Each chunk
+ is stored only once, named by its SHA-256 digest. For each export
+ of a key we write a new manifest ("generation") listing the chunks
+ each member consists of.
+"""
+import errno
+import hashlib
+import json
+import os
+import re
+import stat
+import tempfile
+import time
+
+#: Flags to set for user read/write permissions (no group, nor others)
+PERM_USER_RW_ONLY = stat.S_IRUSR | stat.S_IWUSR
+
+#: Flags to set for user only directories (rwx------)
+PERM_USER_RWX_ONLY = stat.S_IRWXU
+
+#: Chunks are never smaller than this (except the last chunk of data)
+CHUNK_MIN_SIZE = 512
+
+#: Chunks are never larger than this
+CHUNK_MAX_SIZE = 16384
+
+#: Cut points are set where the rolling hash has all these bits unset.
+#: Results in an average chunk size of about 2 KiB above minimum.
+CHUNK_MASK = 0x7ff
+
+#: Key ids (or fingerprints) keys can be stored under
+RE_KEY = re.compile(r'^[0-9A-Fa-f]+$')
+
+#: Table of pseudo random numbers for the rolling ("gear") hash
+GEAR_TABLE = tuple(
+    int(hashlib.sha256(bytes(bytearray([x]))).hexdigest()[:8], 16)
+    for x in range(256))
+
+
+def split_chunks(data, min_size=CHUNK_MIN_SIZE, max_size=CHUNK_MAX_SIZE,
+                 mask=CHUNK_MASK):
+    """Split `data` into content-defined chunks.
+
+    Returns a list of (binary) chunks. Cut points depend on the local
+    content only, so inserting or removing data will change only the
+    chunks around the place where data was changed.
+
+      >>> split_chunks(b'')
+      []
+      >>> split_chunks(b'abc')
+      [b'abc']
+
+    """
+    result = []
+    start, h = 0, 0
+    data_view = bytearray(data)
+    for pos, byte in enumerate(data_view):
+        h = ((h << 1) + GEAR_TABLE[byte]) & 0xffffffff
+        size = pos + 1 - start
+        if size < min_size:
+            continue
+        if (h & mask) == 0 or size >= max_size:
+            result.append(bytes(data_view[start:pos + 1]))
+            start, h = pos + 1, 0
+    if start < len(data_view):
+        result.append(bytes(data_view[start:]))
+    return result
+
+
+class BackupStore(object):
+    """A deduplicating store for exported key data located at `path`.
+
+    The store directory is created if it does not exist yet.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        for subdir in ('chunks', 'manifests'):
+            self._makedirs(os.path.join(self.path, subdir))
+
+    def _makedirs(self, path):
+        # dirs created meanwhile by concurrent adds are fine.
+        try:
+            os.makedirs(path, PERM_USER_RWX_ONLY)
+        except OSError as err:
+            if err.errno != errno.EEXIST or not os.path.isdir(path):
+                raise
+
+    def _create_file(self, path, content):
+        # write atomically, so we never leave half-written files. Raise
+        # `OSError` (EEXIST) if `path` exists. Temporary files are
+        # private to each call (also to threads of one process).
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(content)
+            os.link(tmp_path, path)
+        finally:
+            os.unlink(tmp_path)
+
+    def chunk_path(self, digest):
+        """Get the path of chunk with SHA-256 hexdigest `digest`.
+        """
+        return os.path.join(self.path, 'chunks', digest[:2], digest)
+
+    def put_chunk(self, chunk):
+        """Store `chunk` if not stored yet.
+
+        Returns the digest of `chunk`.
+        """
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self.chunk_path(digest)
+        if not os.path.exists(path):
+            self._makedirs(os.path.dirname(path))
+            try:
+                self._create_file(path, chunk)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise  # else stored meanwhile by a concurrent add
+        return digest
+
+    def get_chunk(self, digest):
+        """Get contents of chunk `digest`.
+
+        Raises `ValueError` if the chunk content does not match its
+        digest.
+        """
+        with open(self.chunk_path(digest), 'rb') as fp:
+            chunk = fp.read()
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise ValueError('Corrupted chunk in store: %s' % digest)
+        return chunk
+
+    def key_dir(self, key):
+        """Get the path of the dir containing manifests of `key`.
+
+        Raises `ValueError` if `key` is not a hex number (key id or
+        fingerprint).
+        """
+        if not RE_KEY.match(key):
+            raise ValueError('Not a valid key id: %s' % key)
+        return os.path.join(self.path, 'manifests', key)
+
+    def generations(self, key):
+        """Get a sorted list of generation numbers stored for `key`.
+        """
+        key_dir = self.key_dir(key)
+        if not os.path.isdir(key_dir):
+            return []
+        return sorted(
+            int(name[:-5]) for name in os.listdir(key_dir)
+            if name.endswith('.json') and name[:-5].isdigit())
+
+    def manifest_path(self, key, generation):
+        """Get path of manifest for `key` and `generation`.
+        """
+        return os.path.join(self.key_dir(key), '%08d.json' % generation)
+
+    def add(self, key, members_dict):
+        """Store members of `members_dict` as new generation of `key`.
+
+        `members_dict` should contain names (keys) and file contents
+        (values) as passed to `create_tarfile()`. Only chunks not
+        already in store are written.
+
+        Concurrent exports of the same key get different generations:
+        manifests are created exclusively, taken generations are
+        skipped.
+
+        Returns path of the manifest written.
+        """
+        members = dict()
+        for name, content in members_dict.items():
+            members[name] = dict(
+                size=len(content),
+                sha256=hashlib.sha256(content).hexdigest(),
+                chunks=[self.put_chunk(x) for x in split_chunks(content)])
+        manifest = dict(key=key, created=int(time.time()), members=members)
+        content = json.dumps(manifest, sort_keys=True, indent=2).encode(
+            'utf-8')
+        self._makedirs(self.key_dir(key))
+        generation = (self.generations(key) or [0])[-1] + 1
+        while True:
+            path = self.manifest_path(key, generation)
+            try:
+                self._create_file(path, content)
+                return path
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+            generation += 1
+
+    def get(self, key, generation=None):
+        """Get members stored for `key`.
+
+        If no `generation` is given, the latest one is taken. Returns a
+        dict with member names as keys and member contents as values.
+
+        Raises `KeyError` if no such generation is stored and
+        `ValueError` if stored data is corrupted.
+        """
+        if generation is None:
+            generation = (self.generations(key) or [None])[-1]
+        if generation is None or generation not in self.generations(key):
+            raise KeyError('No such key/generation in store: %s/%s' % (
+                key, generation))
+        with open(self.manifest_path(key, generation), 'rb') as fp:
+            manifest = json.loads(fp.read().decode('utf-8'))
+        result = dict()
+        for name, info in manifest['members'].items():
+            content = b''.join(
+                [self.get_chunk(digest) for digest in info['chunks']])
+            if hashlib.sha256(content).hexdigest() != info['sha256']:
+                raise ValueError('Corrupted member in store: %s' % name)
+            result[name] = content
+        return result
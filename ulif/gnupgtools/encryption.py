@@ -0,0 +1,280 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Encrypt and decrypt archives while they are written or read.
+
+ Archive data is piped through a gpg process. Encryption therefore
+ happens in the same pass as compression and decryption in the same
+ pass as unpacking, without temporary files::
+
+   with open('key.tar.gz.gpg', 'wb') as fd:
+       with encrypted_output(fd, recipients=['DAA011C5']) as pipe:
+           pipe.write(data)
+
+"""
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from io import BytesIO
+from ulif.gnupgtools.packets import (
+    read_packet_header, PacketError, ARMOR_BEGIN, TAG_PUBKEY_ENC_SESSION_KEY,
+    TAG_SYMKEY_ENC_SESSION_KEY)
+from ulif.gnupgtools.utils import (
+    get_env, get_error, get_gnupg_version, kill_process_group, wait_exited,
+    CommandTimeout, EXIT_WAIT, NEW_SESSION)
+
+#: Number of bytes needed to detect encrypted data
+HEAD_SIZE = 64
+
+#: Tags of packets encrypted OpenPGP messages start with
+ENCRYPTED_TAGS = (TAG_PUBKEY_ENC_SESSION_KEY, TAG_SYMKEY_ENC_SESSION_KEY)
+
+
+class EncryptionError(Exception):
+    """Raised if gpg could not encrypt or decrypt data.
+    """
+
+
+def is_encrypted(head):
+    """Tell whether `head`, the first bytes of some data, is encrypted.
+
+    That is, whether it starts like an OpenPGP message encrypted for
+    some recipient or with a passphrase (binary or armored).
+    """
+    head = bytes(head[:HEAD_SIZE])
+    if head.lstrip().startswith(ARMOR_BEGIN + b'MESSAGE-----'):
+        return True
+    try:
+        header = read_packet_header(BytesIO(head))
+    except PacketError:
+        return False
+    return header is not None and header[0] in ENCRYPTED_TAGS
+
+
+class PrefixedReader(object):
+    """A readable file object, returning `head` before data of `fileobj`.
+    """
+
+    def __init__(self, head, fileobj):
+        self.head = head
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.fileobj.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.fileobj.read(), b''
+            return data
+        data, self.head = self.head[:size], self.head[size:]
+        return data
+
+
+def peek(fileobj, size=HEAD_SIZE):
+    """Read the first `size` bytes of `fileobj` without consuming them.
+
+    Returns a tuple (`head`, `reader`) with `reader` being a file
+    object returning all data of `fileobj`, including `head`. Works
+    also for streams that cannot seek.
+    """
+    head = fileobj.read(size)
+    return head, PrefixedReader(head, fileobj)
+
+
+def read_passphrase(path):
+    """Read a passphrase (the first line) from file at `path`.
+    """
+    with open(path, 'rb') as fd:
+        return fd.readline().rstrip(b'\r\n')
+
+
+def get_fileno(fileobj):
+    """Get the file descriptor of `fileobj` or ``None``.
+    """
+    try:
+        return fileobj.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return None
+
+
+def sync_position(fileobj):
+    """Move the file descriptor of `fileobj` to its current position.
+
+    Buffered file objects might have read ahead. Does nothing for
+    files that cannot seek.
+    """
+    try:
+        os.lseek(fileobj.fileno(), fileobj.tell(), os.SEEK_SET)
+    except (IOError, OSError, io.UnsupportedOperation):
+        pass
+
+
+def copy_stream(source, target, close=False):
+    """Copy all data from `source` into `target`.
+
+    If `close` is set, `target` is closed afterwards.
+    """
+    try:
+        shutil.copyfileobj(source, target)
+    except (IOError, OSError):
+        pass  # gpg died, which is reported when it is waited for
+    finally:
+        if close:
+            try:
+                target.close()
+            except (IOError, OSError):
+                pass
+
+
+@contextmanager
+def gpg_filter(cmd_list, source=None, target=None, passphrase=None,
+               homedir=None, timeout=None):
+    """Run gpg command `cmd_list` as filter between file objects.
+
+    If `source` is given, gpg reads its input from there and the
+    readable output of gpg is yielded. If `target` is given, gpg
+    writes its output there and a writable pipe into gpg is yielded.
+    File objects with file descriptors are passed to gpg directly,
+    starting at their current position, others are fed by threads.
+
+    `passphrase` (bytes) is passed to gpg via a separate pipe. If gpg
+    does not finish within `timeout` seconds it is killed and
+    `utils.CommandTimeout` is raised. If gpg fails, we raise
+    :exc:`EncryptionError`.
+    """
+    kw = dict(NEW_SESSION)
+    pass_fd = None
+    if passphrase is not None:
+        pass_fd, write_fd = os.pipe()
+        os.write(write_fd, passphrase + b'\n')
+        os.close(write_fd)
+        cmd_list = cmd_list[:1] + ['--passphrase-fd', str(pass_fd)] + (
+            cmd_list[1:])
+        if (get_gnupg_version(cmd_list[0]) or (0, )) >= (2, 1):
+            cmd_list[1:1] = ['--pinentry-mode', 'loopback']
+        if sys.version_info >= (3, 2):
+            kw['pass_fds'] = (pass_fd, )
+    stdin, stdout, feeders = subprocess.PIPE, subprocess.PIPE, []
+    if source is not None and get_fileno(source) is not None:
+        sync_position(source)
+        stdin = source
+    if target is not None and get_fileno(target) is not None:
+        target.flush()
+        stdout = target
+    stderr = tempfile.TemporaryFile()
+    try:
+        proc = subprocess.Popen(
+            cmd_list, stdin=stdin, stdout=stdout, stderr=stderr,
+            env=get_env(homedir), **kw)
+    except Exception:
+        stderr.close()
+        raise
+    finally:
+        if pass_fd is not None:
+            os.close(pass_fd)
+    if source is not None and stdin is subprocess.PIPE:
+        feeders.append(threading.Thread(
+            target=copy_stream, args=(source, proc.stdin, True)))
+    if target is not None and stdout is subprocess.PIPE:
+        feeders.append(threading.Thread(
+            target=copy_stream, args=(proc.stdout, target)))
+    timer, timed_out = None, threading.Event()
+    if timeout is not None:
+        def kill():
+            timed_out.set()
+            kill_process_group(proc, reap=False)
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+    try:
+        for feeder in feeders:
+            feeder.daemon = True
+            feeder.start()
+        if source is None:
+            yield proc.stdin
+            proc.stdin.close()
+        else:
+            yield proc.stdout
+            while proc.stdout.read(io.DEFAULT_BUFFER_SIZE):
+                pass  # let gpg finish, checking integrity of all data
+        for feeder in feeders:
+            feeder.join()
+        proc.wait()
+    except Exception:
+        # broken pipes and truncated data are mostly caused by gpg
+        # failing, which is the more helpful error then.
+        failed = wait_exited(proc, EXIT_WAIT) and proc.returncode > 0
+        kill_process_group(proc, reap=False)
+        proc.wait()
+        if timed_out.is_set():
+            raise CommandTimeout(cmd_list, timeout)
+        if failed:
+            raise EncryptionError(get_error(proc, stderr))
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+        for pipe in (proc.stdin, proc.stdout):
+            if pipe is not None:
+                pipe.close()
+        error = get_error(proc, stderr)
+        stderr.close()
+    if timed_out.is_set():
+        raise CommandTimeout(cmd_list, timeout)
+    if proc.returncode != 0:
+        raise EncryptionError(error)
+
+
+def encrypted_output(fileobj, recipients=None, passphrase=None,
+                     symmetric=False, executable='gpg', homedir=None,
+                     timeout=None):
+    """Get a writable pipe encrypting all data written into `fileobj`.
+
+    Contextmanager. Data is encrypted for all keys in `recipients`
+    and/or, if `symmetric` is set, with `passphrase` (bytes, or asked
+    for by gpg if ``None``). Keys of recipients are looked up in GnuPG
+    home `homedir`. Data is not compressed again.
+    """
+    if not (recipients or symmetric):
+        raise ValueError('Neither recipients nor symmetric encryption set')
+    cmd = [executable, '--batch', '--compress-algo', 'none']
+    if symmetric:
+        cmd.append('--symmetric')
+    for recipient in recipients or []:
+        cmd += ['--recipient', recipient]
+    if recipients:
+        cmd.append('--encrypt')
+    return gpg_filter(
+        cmd, target=fileobj, passphrase=symmetric and passphrase or None,
+        homedir=homedir, timeout=timeout)
+
+
+def decrypted_input(fileobj, passphrase=None, executable='gpg',
+                    homedir=None, timeout=None):
+    """Get a readable pipe delivering decrypted data of `fileobj`.
+
+    Contextmanager. Data encrypted for some recipient is decrypted with
+    secret keys from GnuPG home `homedir`, symmetrically encrypted data
+    with `passphrase` (bytes, or asked for by gpg if ``None``).
+    Integrity of the data is checked when leaving the `with` block.
+    """
+    return gpg_filter(
+        [executable, '--batch', '--decrypt'], source=fileobj,
+        passphrase=passphrase, homedir=homedir, timeout=timeout)
@@ -0,0 +1,215 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Cheap throw-away copies of GnuPG homes.
+
+ Ephemeral homes are used to check imports without touching the real
+ home and to give each test its own home. Files are cloned
+ copy-on-write (reflinks) where the filesystem supports it. Otherwise
+ keyrings, which gpg only ever replaces by renaming a new file over
+ them, are hardlinked. All other files (trust database, key files of
+ gpg-agent, ...) might be changed in place and are copied.
+
+ A :class:`HomeTemplate` snapshots a home once, so that many homes can
+ be created from it quickly::
+
+   with HomeTemplate('/path/to/home') as template:
+       with template.home() as homedir:
+           import_master_key('DAA011C5.tar.gz', homedir=homedir)
+
+"""
+import errno
+import os
+import shutil
+import stat
+import tempfile
+from contextlib import contextmanager
+from ulif.gnupgtools.utils import execute
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+#: ioctl request cloning files copy-on-write (see ioctl_ficlone(2))
+FICLONE = 0x40049409
+
+#: Names of files gpg replaces by renaming, never writing in place
+LINKABLE_FILES = ('pubring.gpg', 'pubring.kbx', 'secring.gpg')
+
+#: Name of the gpg-agent socket in GnuPG homes
+AGENT_SOCKET = 'S.gpg-agent'
+
+
+def is_lock_file(name):
+    """Tell whether `name` is the name of a gpg lock file.
+    """
+    return name.endswith('.lock') or name.startswith('.#lk')
+
+
+def reflink(source, target):
+    """Clone file `source` as `target` copy-on-write.
+
+    Returns ``False`` (and creates no `target`) if the filesystem or
+    platform does not support it.
+    """
+    if fcntl is None:
+        return False
+    with open(source, 'rb') as src:
+        with open(target, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                failed = False
+            except (IOError, OSError):
+                failed = True
+    if failed:
+        os.unlink(target)
+        return False
+    shutil.copystat(source, target)
+    return True
+
+
+def clone_file(source, target, link=False, methods=None):
+    """Clone file `source` as `target`, as cheap as possible.
+
+    Files are reflinked if possible, else hardlinked if `link` is set
+    (then `source` must not be changed in place afterwards) and copied
+    otherwise. Returns the method used: ``'reflink'``, ``'link'`` or
+    ``'copy'``.
+
+    `methods`, a dict, remembers methods that failed, so that they are
+    not tried again for further files.
+    """
+    if methods is None:
+        methods = dict()
+    if methods.get('reflink', True):
+        if reflink(source, target):
+            return 'reflink'
+        methods['reflink'] = False
+    if link and methods.get('link', True):
+        try:
+            os.link(source, target)
+            return 'link'
+        except OSError as err:
+            if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            methods['link'] = False
+    shutil.copy2(source, target)
+    return 'copy'
+
+
+def clone_home(source, target, link=True):
+    """Create `target` as a copy of GnuPG home `source`.
+
+    Only regular files and dirs are cloned, sockets and lock files are
+    left out. Keyrings are hardlinked if `link` is set and reflinks
+    are not available (see :func:`clone_file`). `target` may exist
+    already, but must be empty then.
+
+    Returns a dict mapping clone methods to the number of files
+    cloned that way.
+    """
+    result, methods = dict(), dict()
+    if not os.path.isdir(target):
+        os.mkdir(target, 0o700)
+    for dirpath, dirnames, filenames in os.walk(source):
+        target_dir = os.path.join(target, os.path.relpath(dirpath, source))
+        for name in dirnames:
+            os.mkdir(os.path.join(target_dir, name), 0o700)
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if is_lock_file(name) or not stat.S_ISREG(os.lstat(path).st_mode):
+                continue
+            method = clone_file(
+                path, os.path.join(target_dir, name),
+                link=link and name in LINKABLE_FILES, methods=methods)
+            result[method] = result.get(method, 0) + 1
+    return result
+
+
+def remove_home(homedir, gpgconf='gpgconf'):
+    """Remove GnuPG home `homedir` completely.
+
+    A gpg-agent started for `homedir` is stopped before.
+    """
+    if os.path.exists(os.path.join(homedir, AGENT_SOCKET)):
+        try:
+            execute([gpgconf, '--homedir', homedir, '--kill', 'gpg-agent'])
+        except OSError:
+            pass  # no gpgconf (GnuPG < 2.1), agent exits by itself
+    shutil.rmtree(homedir, ignore_errors=True)
+
+
+@contextmanager
+def ephemeral_home(template=None, link=True):
+    """Get a temporary GnuPG home, removed when leaving the `with` block.
+
+    If `template`, the path of an existing GnuPG home, is given, the
+    new home is a copy of it (see :func:`clone_home`). Otherwise the
+    new home is empty.
+    """
+    temp_dir = tempfile.mkdtemp()
+    homedir = os.path.join(temp_dir, 'gnupghome')
+    try:
+        if template is not None and os.path.isdir(template):
+            clone_home(template, homedir, link=link)
+        else:
+            os.mkdir(homedir, 0o700)
+        yield homedir
+    finally:
+        remove_home(homedir)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+class HomeTemplate(object):
+    """A snapshot of GnuPG home `homedir` to create homes from.
+
+    The snapshot is taken once, when the template is created. Later
+    changes of `homedir` do not show up in homes created from it.
+    Homes created share the snapshot keyrings via hardlinks where
+    possible, so creating them is cheap also for large keyrings.
+    """
+
+    def __init__(self, homedir):
+        self.homedir = homedir
+        self._temp_dir = tempfile.mkdtemp()
+        self.snapshot = os.path.join(self._temp_dir, 'snapshot')
+        clone_home(homedir, self.snapshot, link=False)
+
+    def create(self, path):
+        """Create a new home at `path` from the snapshot.
+        """
+        clone_home(self.snapshot, path)
+        return path
+
+    def home(self):
+        """Get a temporary home created from the snapshot.
+
+        Contextmanager, see :func:`ephemeral_home`.
+        """
+        return ephemeral_home(self.snapshot)
+
+    def close(self):
+        """Remove the snapshot.
+        """
+        shutil.rmtree(self._temp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
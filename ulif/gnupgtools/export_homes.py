@@ -0,0 +1,262 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Export all secret master keys of several GnuPG homes.
+
+ Each home is handled by a separate worker process. Archives are
+ written into one subdirectory per home. A summary of timings and
+ failures is printed and stored as ``summary.json`` in the output
+ directory. Summaries of former runs are used to estimate exports in
+ plan mode (see `plan`).
+"""
+from __future__ import print_function
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+from ulif.gnupgtools.export_master_key import get_key_list, export_keys
+from ulif.gnupgtools.plan import (
+    estimate_archive_sizes, load_history, plan_exports, output_plan)
+from ulif.gnupgtools.status import ExportResult
+from ulif.gnupgtools.utils import CommandTimeout
+
+
+def handle_options(args):
+    """Handle commandline options.
+    """
+    parser = argparse.ArgumentParser(
+        prog="gpg-export-homes",
+        description="Export GnuPG master keys of several GnuPG homes")
+    parser.add_argument('homes', metavar='HOME', nargs='+',
+                        help='GnuPG home or glob pattern matching homes')
+    parser.add_argument('-b', '--binary', dest="gnupg_path", default='gpg',
+                        metavar='PATH', help='Path to GnuPG binary to use')
+    parser.add_argument('-d', '--output-dir', default='.', metavar='DIR',
+                        help='Write archives into subdirs of DIR')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        metavar='NUM', help='Export NUM homes in parallel')
+    parser.add_argument('-n', '--native', action='store_true',
+                        help='Read keyrings directly, without calling gpg')
+    parser.add_argument('-p', '--plan', action='store_true',
+                        help='Only estimate sizes and duration of exports')
+    parser.add_argument('--history', action='append', default=[],
+                        metavar='FILE',
+                        help='Estimate from summary FILE of former runs')
+    parser.add_argument('-t', '--timeout', type=float, default=None,
+                        metavar='SECS',
+                        help='Abort gpg commands running longer than SECS')
+    return parser.parse_args(args)
+
+
+def expand_homes(patterns):
+    """Expand glob `patterns` into a sorted list of GnuPG homes.
+
+    Patterns not matching anything are kept as they are (exporting
+    them will fail later on). Duplicates are removed.
+    """
+    result = set()
+    for pattern in patterns:
+        result.update(glob.glob(pattern) or [pattern])
+    return sorted(os.path.abspath(x) for x in result)
+
+
+def get_home_dir_name(home):
+    """Get the name of the output subdir for GnuPG home `home`.
+
+    The name is derived from the absolute path of `home`, so different
+    homes always get different subdirs:
+
+      >>> get_home_dir_name('/srv/alice/.gnupg')
+      'srv_alice_.gnupg'
+
+    """
+    return os.path.abspath(home).strip(os.sep).replace(os.sep, '_')
+
+
+def export_home(args):
+    """Export all secret master keys of a single GnuPG home.
+
+    `args` is a tuple (`home`, `output_dir`, `gnupg_path`, `native`,
+    `timeout`). All gpg commands are run with the binary at
+    `gnupg_path`. Archives are written into `output_dir`, which is
+    created if needed.
+
+    Returns a dict with the `home`, the `output_dir`, the keys
+    `exported`, the `fingerprints` of all keys exported as reported by
+    gpg, a list of `failures` (key, error message), the gpg
+    commands that ran into `timeouts`, the size of all archives in
+    `bytes` (and their size as estimated by `plan`, in
+    `estimated_bytes`) and the time in `seconds` needed. Errors never
+    propagate; listing failures are reported with key ``None``.
+    """
+    home, output_dir, gnupg_path, native, timeout = args
+    result = dict(home=home, output_dir=output_dir, exported=[],
+                  fingerprints=[], failures=[], timeouts=[], bytes=0,
+                  estimated_bytes=0, seconds=0.0)
+    start = time.time()
+    old_stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        if not os.path.isdir(home):
+            raise IOError('No such GnuPG home: %s' % home)
+        key_list = get_key_list(
+            gnupg_path=gnupg_path, native=native, homedir=home,
+            timeout=timeout)
+        if key_list and not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        for record in key_list:
+            key = record[2]
+            try:
+                status = ExportResult()
+                path = export_keys(key, homedir=home, output_dir=output_dir,
+                                   timeout=timeout, status=status,
+                                   gnupg_path=gnupg_path)
+                result['exported'].append(key)
+                result['bytes'] += os.path.getsize(path)
+                result['estimated_bytes'] += estimate_archive_sizes(
+                    record)['armor']
+                result['fingerprints'].extend(
+                    sorted(set(status.exported)))
+            except CommandTimeout as err:
+                result['timeouts'].append(' '.join(err.cmd_list))
+                result['failures'].append((key, str(err)))
+            except Exception as err:
+                result['failures'].append((key, str(err)))
+    except CommandTimeout as err:
+        result['timeouts'].append(' '.join(err.cmd_list))
+        result['failures'].append((None, str(err)))
+    except Exception as err:
+        result['failures'].append((None, str(err)))
+    finally:
+        sys.stdout.close()
+        sys.stdout = old_stdout
+    result['seconds'] = time.time() - start
+    return result
+
+
+def export_homes(homes, output_dir, gnupg_path='gpg', jobs=None,
+                 native=False, timeout=None):
+    """Export all secret master keys of all GnuPG `homes`.
+
+    Archives of each home are written into a subdir of `output_dir`
+    (see :func:`get_home_dir_name`). At most `jobs` homes (default:
+    number of CPUs) are exported in parallel, each in its own
+    process. gpg commands running longer than `timeout` seconds are
+    killed and reported as failures.
+
+    Returns a list of results as returned by :func:`export_home`,
+    in order of `homes`.
+    """
+    output_dir = os.path.abspath(output_dir)
+    tasks = [
+        (home, os.path.join(output_dir, get_home_dir_name(home)),
+         gnupg_path, native, timeout) for home in homes]
+    pool = Pool(jobs)
+    try:
+        return pool.map(export_home, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def output_summary(results, total_seconds):
+    """Print a summary of export `results` to screen.
+    """
+    for result in results:
+        print("%-40s %3d keys %3d failures %3d timeouts %8.2fs" % (
+            result['home'], len(result['exported']),
+            len(result['failures']), len(result['timeouts']),
+            result['seconds']))
+        for key, error in result['failures']:
+            print("    FAILED %s: %s" % (key or '(listing)', error))
+    print("%d homes, %d keys exported, %d failures, %d timeouts in %.2fs" % (
+        len(results), sum([len(x['exported']) for x in results]),
+        sum([len(x['failures']) for x in results]),
+        sum([len(x['timeouts']) for x in results]), total_seconds))
+
+
+def list_homes(homes, gnupg_path='gpg', native=False, timeout=None):
+    """List secret master keys of all GnuPG `homes`.
+
+    Returns a list of (`home`, `key_list`) tuples and a list of
+    failures (`home`, error message). Homes that cannot be listed get
+    an empty key list.
+    """
+    listings, failures = [], []
+    for home in homes:
+        key_list = []
+        try:
+            if not os.path.isdir(home):
+                raise IOError('No such GnuPG home: %s' % home)
+            key_list = get_key_list(
+                gnupg_path=gnupg_path, native=native, homedir=home,
+                timeout=timeout)
+        except Exception as err:
+            failures.append((home, str(err)))
+        listings.append((home, key_list))
+    return listings, failures
+
+
+def get_history_paths(options):
+    """Get paths of summary files to estimate exports from.
+
+    These are the files given with ``--history`` or, if none was
+    given, the summary of the last run in the output dir, if any.
+    """
+    if options.history:
+        return options.history
+    path = os.path.join(options.output_dir, 'summary.json')
+    return os.path.isfile(path) and [path] or []
+
+
+def main(args=None):
+    """Export master keys of several GnuPG homes.
+
+    This is the interface for the commandline. If `args` is not given, we
+    lookup `sys.argv`. Exits with status 1 if any export failed.
+    """
+    if args is None:
+        args = sys.argv
+    options = handle_options(args[1:])
+    homes = expand_homes(options.homes)
+    if options.plan:
+        listings, failures = list_homes(
+            homes, gnupg_path=options.gnupg_path, native=options.native,
+            timeout=options.timeout)
+        output_plan(plan_exports(
+            listings, jobs=options.jobs,
+            history=load_history(get_history_paths(options))))
+        for home, error in failures:
+            print("FAILED %s: %s" % (home, error))
+        if failures:
+            sys.exit(1)
+        return
+    start = time.time()
+    results = export_homes(
+        homes, options.output_dir, gnupg_path=options.gnupg_path,
+        jobs=options.jobs, native=options.native, timeout=options.timeout)
+    total_seconds = time.time() - start
+    output_summary(results, total_seconds)
+    if not os.path.isdir(options.output_dir):
+        os.makedirs(options.output_dir)
+    summary_path = os.path.join(options.output_dir, 'summary.json')
+    with open(summary_path, 'w') as fd:
+        json.dump(dict(homes=results, seconds=total_seconds), fd, indent=2)
+    if [x for x in results if x['failures']]:
+        sys.exit(1)
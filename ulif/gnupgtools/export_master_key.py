@@ -26,8 +26,10 @@
 
  *Before* running this script you must create additional subkeys.
 """
+from __future__ import print_function
 import argparse
 import grp
+import gzip
 import os
 import pkg_resources
 import pwd
@@ -36,15 +38,55 @@ import stat
 import sys
 import tarfile
 import time
+from collections import namedtuple
+from functools import partial
 from io import BytesIO
-from ulif.gnupgtools.utils import execute, tarfile_open
+from ulif.gnupgtools.backup_store import BackupStore
+from ulif.gnupgtools.encryption import encrypted_output, read_passphrase
+from ulif.gnupgtools.pgzip import ParallelGzipFile
+from ulif.gnupgtools.key_index import KeyIndex
+from ulif.gnupgtools.keyring import (
+    format_key_info, read_secret_keys, UnsupportedKeyring)
+from ulif.gnupgtools.manifest import (
+    DigestReader, format_manifest, sign_manifest, MANIFEST_NAME,
+    SIGNATURE_NAME)
+from ulif.gnupgtools.packets import Key, TAG_SECRET_KEY
+from ulif.gnupgtools.records import KeyRecord, KeyTable, sort_records
+from ulif.gnupgtools.utils import execute, get_gnupg_version, tarfile_open
+from ulif.gnupgtools.watch import watch_keys, STATE_FILE
 
 #: Regular expression representing a hexadecimal number
 RE_HEX_NUMBER = re.compile('(^[a-f0-9]+)$|(^[A-F0-9]+$)')
 
+#: Escaped chars in fields of gpg colon listings, like ``\x3a``
+RE_COLON_ESCAPE = re.compile(r'\\x([0-9a-fA-F]{2})')
+
 #: Flags to set for user read/write permissions (no group, nor others)
 PERM_USER_RW_ONLY = stat.S_IRUSR | stat.S_IWUSR
 
+#: Modification time set for all archive members in reproducible mode
+#: (2000-01-01 00:00:00 UTC)
+REPRODUCIBLE_MTIME = 946684800
+
+#: Content of the format marker member in archives of binary exports
+FORMAT_BINARY = b'binary\n'
+
+#: Export options used for minimal exports and the GnuPG version
+#: required for each of them.
+MINIMAL_EXPORT_OPTIONS = (
+    ('export-minimal', (1, 4, 0)),
+    ('no-export-attributes', (1, 4, 0)),
+    )
+
+#: Number of keys shown at once when picking keys
+PAGE_SIZE = 20
+
+#: A subkey as listed by gpg. `created` and `expires` are timestamps,
+#: `expires` is zero for subkeys that never expire. `capabilities` is
+#: a string of uppercase capability letters ('S', 'E', 'A').
+Subkey = namedtuple(
+    'Subkey', ['key_id', 'validity', 'created', 'expires', 'capabilities'])
+
 input_func = input
 if sys.version[0] < "3":
     input_func = raw_input  # NOQA  # pragma: no cover
@@ -77,38 +119,193 @@ def s(text):
     return text
 
 
-def create_tarfile(archive_name, members_dict):
+def create_tarfile(archive_name, members_dict, reproducible=False,
+                   threads=None, manifest=False, signer=None, encrypt=None):
     """Create a tar archive.
 
-    The archive will be created as `archive_name`. `members_dict`
+    The archive will be created as `archive_name`, which can also be a
+    writable binary file object (like ``sys.stdout.buffer``). File
+    objects are written sequentially and not closed. `members_dict`
     should contain names (keys) and file contents (values).
 
     Currently we support only one level of files.
 
     All files are stored with user perms set only (no group or other
-    permissions.)
+    permissions.) Members are stored sorted by name.
+
+    If `reproducible` is ``True``, all timestamps (including the one
+    in the gzip header) are set to :data:`REPRODUCIBLE_MTIME` and
+    owner fields are normalized, so that same `members_dict` always
+    results in byte-identical archives.
+
+    If `threads` is a number greater than one, compression is done in
+    parallel by that many threads (see `pgzip.ParallelGzipFile`).
+
+    If `manifest` is set, SHA-256 digests of all members are computed
+    while they are written and stored in an additional last member
+    `manifest.MANIFEST_NAME`. `signer` can be a callable that gets
+    the manifest contents and returns a signature for it (see
+    `manifest.sign_manifest()`), which is stored as
+    `manifest.SIGNATURE_NAME`.
+
+    `encrypt` can be a callable that gets the file object written to
+    and returns a contextmanager yielding a file object encrypting all
+    data written (see `encryption.encrypted_output()`). The archive is
+    then encrypted while it is compressed, in a single pass.
     """
-    with tarfile_open(archive_name, "w:gz") as tar:
+    if hasattr(archive_name, 'write'):
+        write_archive(archive_name, members_dict, reproducible, threads,
+                      manifest, signer, encrypt)
+        return
+    with open(archive_name, "wb") as fd:
         os.chmod(archive_name, PERM_USER_RW_ONLY)  # ~ octal 0600 ~ rw-------
-        for name, content in members_dict.items():
-            info = tarfile.TarInfo(name=name)
-            info.mode = PERM_USER_RW_ONLY          # ~ octal 0600 = rw-------
-            info.mtime = time.time()
-            info.size = len(content)
-            info.uid = os.getuid()
-            info.gid = os.getgid()
-            info.uname = pwd.getpwuid(os.getuid()).pw_name
-            info.gname = grp.getgrgid(os.getgid()).gr_name
-            tar.addfile(tarinfo=info, fileobj=BytesIO(content))
+        write_archive(fd, members_dict, reproducible, threads, manifest,
+                      signer, encrypt)
+
+
+def write_archive(fd, members_dict, reproducible=False, threads=None,
+                  manifest=False, signer=None, encrypt=None):
+    """Write a tar archive to `fd`, encrypted if `encrypt` is given.
+
+    See :func:`create_tarfile` for details.
+    """
+    if encrypt is None:
+        write_tarfile(fd, members_dict, reproducible, threads, manifest,
+                      signer)
+        return
+    with encrypt(fd) as pipe:
+        write_tarfile(pipe, members_dict, reproducible, threads, manifest,
+                      signer)
+
+
+def write_tarfile(fd, members_dict, reproducible=False, threads=None,
+                  manifest=False, signer=None):
+    """Write a tar archive of `members_dict` to file object `fd`.
+
+    See :func:`create_tarfile` for details.
+    """
+    mtime = time.time()
+    if reproducible:
+        mtime = REPRODUCIBLE_MTIME
+    # we create the gzip stream ourselves to control the header.
+    if threads and threads > 1:
+        gz, tar_mode = ParallelGzipFile(
+            fd, threads=threads, mtime=mtime), "w|"
+    else:
+        gz, tar_mode = gzip.GzipFile(
+            filename='', mode='wb', fileobj=fd, mtime=mtime), "w"
+    try:
+        with tarfile_open(None, tar_mode, gz) as tar:
+            digests = dict()
+            for name in sorted(members_dict):
+                content = members_dict[name]
+                reader = DigestReader(BytesIO(content))
+                tar.addfile(
+                    tarinfo=get_tarinfo(name, len(content), mtime,
+                                        reproducible),
+                    fileobj=reader)
+                digests[name] = reader.hexdigest()
+            extra = []
+            if manifest:
+                manifest_data = format_manifest(digests)
+                extra.append((MANIFEST_NAME, manifest_data))
+                if signer is not None:
+                    extra.append((SIGNATURE_NAME, signer(manifest_data)))
+            for name, content in extra:
+                tar.addfile(
+                    tarinfo=get_tarinfo(name, len(content), mtime,
+                                        reproducible),
+                    fileobj=BytesIO(content))
+    finally:
+        gz.close()
+
+
+def get_tarinfo(name, size, mtime, reproducible=False):
+    """Get a `tarfile.TarInfo` for a member called `name`.
+
+    Members are readable and writable for the owner only. If
+    `reproducible` is set, uid, gid and names of owner and group are
+    normalized (``0``, ``0``, ``''``, ``''``), otherwise the current
+    user and group are set.
+    """
+    info = tarfile.TarInfo(name=name)
+    info.mode = PERM_USER_RW_ONLY          # ~ octal 0600 = rw-------
+    info.mtime = mtime
+    info.size = size
+    if reproducible:
+        info.uid, info.gid, info.uname, info.gname = 0, 0, '', ''
+    else:
+        info.uid = os.getuid()
+        info.gid = os.getgid()
+        info.uname = pwd.getpwuid(os.getuid()).pw_name
+        info.gname = grp.getgrgid(os.getgid()).gr_name
+    return info
 
 
 def handle_options(args):
     """Handle commandline options.
     """
-    parser = argparse.ArgumentParser(description="Export GnuPG master key")
+    parser = argparse.ArgumentParser(
+        prog="gpg-export-master-key", description="Export GnuPG master key")
     parser.add_argument('-b', '--binary', dest="gnupg_path", default='gpg',
                         metavar='PATH', help='Path to GnuPG binary to use')
+    parser.add_argument('--homedir', default=None, metavar='DIR',
+                        help='GnuPG home to use (default: $GNUPGHOME)')
+    parser.add_argument('-d', '--output-dir', default=None, metavar='DIR',
+                        help='Write archives into DIR')
+    parser.add_argument('-n', '--native', action='store_true',
+                        help='Read keyrings directly, without calling gpg')
+    parser.add_argument('-r', '--reproducible', action='store_true',
+                        help='Use fixed timestamps and owners in archives')
+    parser.add_argument('-c', '--capabilities', default=None,
+                        metavar='CAPS',
+                        help=('Export only valid subkeys with any of '
+                              'capabilities CAPS (S, E, A)'))
+    parser.add_argument('-m', '--minimal', action='store_true',
+                        help='Strip signatures and photo ids from exports')
+    parser.add_argument('-s', '--store', dest="store_path", default=None,
+                        metavar='DIR',
+                        help='Export into deduplicating backup store DIR')
+    parser.add_argument('--threads', dest="threads", type=int,
+                        default=None, metavar='NUM',
+                        help='Compress archives using NUM threads')
+    parser.add_argument('--no-armor', dest="armor", action='store_false',
+                        help='Store keys in binary format')
+    parser.add_argument('-o', '--output', default=None, metavar='FILE',
+                        help='Write archive to FILE (- for stdout)')
+    parser.add_argument('-k', '--key', default=None, metavar='KEY',
+                        help=('Export KEY (key id, fingerprint or uid) '
+                              'without asking'))
+    parser.add_argument('-t', '--timeout', type=float, default=None,
+                        metavar='SECS',
+                        help='Abort gpg commands running longer than SECS')
+    parser.add_argument('--sign', dest="sign_key", default=None,
+                        metavar='KEY',
+                        help='Sign the archive manifest with KEY')
+    parser.add_argument('-e', '--encrypt', dest="recipients",
+                        action='append', default=None, metavar='RECIPIENT',
+                        help='Encrypt the archive for RECIPIENT')
+    parser.add_argument('--symmetric', action='store_true',
+                        help='Encrypt the archive with a passphrase')
+    parser.add_argument('--passphrase-file', default=None, metavar='FILE',
+                        help='Read passphrase for --symmetric from FILE')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='Export keys whenever they change')
+    parser.add_argument('--poll', dest="poll_interval", type=float,
+                        default=None, metavar='SECS',
+                        help=('Watch by checking keyrings every SECS '
+                              'instead of using inotify'))
     args = parser.parse_args(args)
+    if args.store_path is not None:
+        # stores keep binary keys, no archives
+        conflicts = [name for name, value in (
+            ('--reproducible', args.reproducible), ('--threads', args.threads),
+            ('--output', args.output), ('--sign', args.sign_key),
+            ('--encrypt', args.recipients), ('--symmetric', args.symmetric))
+            if value]
+        if conflicts:
+            parser.error('%s cannot be used with --store' % (
+                ', '.join(conflicts)))
     return args
 
 
@@ -123,39 +320,191 @@ def greeting():
     )
 
 
-def get_secret_keys_output(gnupg_path='gpg'):
+def get_secret_keys_output(gnupg_path='gpg', homedir=None, timeout=None,
+                           colons=False):
     """Get a list of all secret keys as output by GPG.
 
+    Keys are looked up in GnuPG home `homedir` (default: the home set
+    in environment). If gpg runs longer than `timeout` seconds,
+    `utils.CommandTimeout` is raised. If `colons` is set, keys are
+    listed in colon format, including fingerprints of primary keys.
+
     Returns a tuple `(stdout, stderr)` containing output generated
     during command runtime.
     """
-    return execute([gnupg_path, "-K"])
+    options = []
+    if colons:
+        options = ['--with-colons', '--fixed-list-mode', '--with-fingerprint']
+    return execute(
+        [gnupg_path] + options + ["-K"], homedir=homedir, timeout=timeout)
+
 
+def unescape_colon_field(text):
+    """Unescape `text`, a field of a gpg colon listing.
 
-def get_key_list(gnupg_path='gpg'):
+      >>> unescape_colon_field('Bob\\x3a Tester')
+      'Bob: Tester'
+
+    """
+    return RE_COLON_ESCAPE.sub(lambda m: chr(int(m.group(1), 16)), text)
+
+
+def get_colon_key_info(fields):
+    """Get key info like ``'sec   2048R/DAA011C5 2015-01-06'``.
+
+    `fields` are the fields of a ``sec`` line of a colon listing. The
+    text looks like key infos in gpg (1.x) key lists (see
+    `keyring.format_key_info()`).
+    """
+    key = Key(
+        tag=TAG_SECRET_KEY, version=4, created=int(fields[5] or 0),
+        algo=int(fields[3] or 0), bits=int(fields[2] or 0),
+        fingerprint=None, key_id=fields[4], public=b'', mpis=[],
+        is_stub=fields[14:15] == ['#'])
+    return format_key_info(key, key.is_stub)
+
+
+def get_key_list(gnupg_path='gpg', native=False, homedir=None,
+                 timeout=None, table=False):
     """Parse gpg output to create a list of secret keys.
+
+    Returns a list of `records.KeyRecord`, sorted by first uid and key
+    id. Records can also be used as ``(uids, info, key)`` tuples. If
+    `table` is set, the list is returned as `records.KeyTable`, which
+    needs less memory for huge listings. The table is filled while gpg
+    output is parsed, no records are created.
+
+    Keys are looked up in GnuPG home `homedir` (default: the home set
+    in environment). `timeout` is passed to gpg calls (see
+    :func:`get_secret_keys_output`). Keys are listed in colon format,
+    so that records know the fingerprints of their primary keys.
+
+    If `native` is set, we try to read the keyring files directly,
+    without calling gpg (see `keyring.read_secret_keys()`). If the
+    keyring cannot be read that way, we fall back to gpg.
     """
-    output, err = get_secret_keys_output(gnupg_path=gnupg_path)
-    key_list = []
-    curr_key = None
-    curr_ids = []
-    id_info = []
-    for line in output.split(b"\n"):
-        if line.startswith(b"sec"):
+    if native:
+        try:
+            records = read_secret_keys(homedir)
+            if table:
+                return KeyTable(records)
+            return records
+        except UnsupportedKeyring:
+            pass
+    output, err = get_secret_keys_output(
+        gnupg_path=gnupg_path, homedir=homedir, timeout=timeout,
+        colons=True)
+    if table:
+        key_list = KeyTable()
+        add = key_list.add
+    else:
+        key_list = []
+
+        def add(*args, **kw):
+            key_list.append(KeyRecord(*args, **kw))
+    curr_key = curr_fpr = id_info = None
+    curr_ids, curr_subkeys = [], []
+    last_type = None
+    for line in s(output).split("\n"):
+        fields = line.split(":")
+        if fields[0] == "sec":
             if curr_key is not None:
-                key_list.append((curr_ids, s(id_info), s(curr_key)))
-            curr_ids = []
-            id_info = line
-            curr_key = line.split(b"/")[1].split(b" ")[0]
-        elif line.startswith(b"uid"):
-            uid = line[3:].strip()
-            curr_ids.append(s(uid))
+                add(curr_ids, id_info, curr_key, fingerprint=curr_fpr,
+                    subkeys=curr_subkeys)
+            curr_ids, curr_subkeys, curr_fpr = [], [], None
+            id_info = get_colon_key_info(fields)
+            curr_key = fields[4][-8:]
+        elif fields[0] == "fpr" and last_type == "sec":
+            curr_fpr = fields[9] or None
+        elif fields[0] == "uid" and curr_key is not None:
+            curr_ids.append(unescape_colon_field(fields[9]))
+        elif fields[0] == "ssb" and curr_key is not None:
+            curr_subkeys.append(fields[4][-8:])
+        last_type = fields[0]
     if curr_key is not None:
-        key_list.append((curr_ids, s(id_info), s(curr_key)))
-    return sorted(key_list)
+        add(curr_ids, id_info, curr_key, fingerprint=curr_fpr,
+            subkeys=curr_subkeys)
+    if table:
+        key_list.sort()
+        return key_list
+    return sort_records(key_list)
+
+
+def get_subkey_list(hex_id, gnupg_path='gpg', homedir=None, timeout=None):
+    """Get a list of subkeys bound to key `hex_id` in GnuPG home `homedir`.
+
+    The list is parsed from the (public) gpg key listing in colon
+    format. Returns a list of :class:`Subkey` tuples.
+    """
+    output, err = execute(
+        [gnupg_path, "--with-colons", "--fixed-list-mode", "--list-keys",
+         str(hex_id)], homedir=homedir, timeout=timeout)
+    result = []
+    for line in s(output).split("\n"):
+        fields = line.split(":")
+        if fields[0] != "sub" or len(fields) < 12:
+            continue
+        result.append(Subkey(
+            key_id=fields[4], validity=fields[1],
+            created=int(fields[5] or 0), expires=int(fields[6] or 0),
+            capabilities=fields[11].upper()))
+    return result
+
+
+def select_subkeys(subkeys, capabilities, now=None):
+    """Select subkeys by capability and expiry.
+
+    From `subkeys`, a list of :class:`Subkey` tuples, we pick all
+    subkeys having at least one of the capabilities in `capabilities`
+    (a string like ``'SE'``). Revoked, disabled, invalid and expired
+    subkeys are ignored. Expiry is checked against `now` (default: the
+    current time).
+
+    Returns a list of key ids.
+
+      >>> keys = [Subkey('AA', 'u', 0, 0, 'E'), Subkey('BB', 'u', 0, 0, 'S'),
+      ...         Subkey('CC', 'u', 0, 10, 'E'), Subkey('DD', 'r', 0, 0, 'E')]
+      >>> select_subkeys(keys, 'E', now=20)
+      ['AA']
+      >>> select_subkeys(keys, 'es', now=5)
+      ['AA', 'BB', 'CC']
+
+    """
+    if now is None:
+        now = time.time()
+    result = []
+    for subkey in subkeys:
+        if not set(capabilities.upper()).intersection(subkey.capabilities):
+            continue
+        if subkey.validity in ('e', 'r', 'd', 'i', 'n'):
+            continue
+        if subkey.expires and subkey.expires <= now:
+            continue
+        result.append(subkey.key_id)
+    return result
+
+
+def get_minimal_export_options(version):
+    """Get export options for minimal exports with GnuPG `version`.
+
+    `version` should be a tuple as returned by `get_gnupg_version()`.
+    Returns a list of options supported by this version:
+
+      >>> get_minimal_export_options((2, 2, 40))
+      ['export-minimal', 'no-export-attributes']
+      >>> get_minimal_export_options((1, 2, 6))
+      []
+      >>> get_minimal_export_options(None)
+      []
+
+    """
+    if version is None:
+        return []
+    return [opt for opt, min_version in MINIMAL_EXPORT_OPTIONS
+            if version >= min_version]
 
 
-def output_key_list(key_list):
+def output_key_list(key_list, positions=None):
     """Output key list to screen.
 
     We expect a list of triples (ids, id_info, key) where `ids` is a
@@ -171,48 +520,110 @@ def output_key_list(key_list):
         ...   (['boo'], 'far', 'bar'),
         ... ]
         >>> output_key_list(key_list)
-        [  1] bar
-              foo1
-              foo2
-        [  2] far
-              boo
+        [  #1] bar
+               foo1
+               foo2
+        [  #2] far
+               boo
+
+    If `positions` is given, only entries at these positions are
+    output, numbered as in the complete list:
+
+        >>> output_key_list(key_list, positions=[1])
+        [  #2] far
+               boo
 
     """
-    for num, list_entry in enumerate(key_list):
-        ids, info, key = list_entry
-        print("[%3d] %s" % (num + 1, info))
+    if positions is None:
+        positions = range(len(key_list))
+    for num in positions:
+        ids, info, key = key_list[num]
+        print("[%4s] %s" % ("#%d" % (num + 1), info))
         for name in ids:
-            print("      %s" % name)
+            print("       %s" % name)
 
 
-def input_key(max_key):
-    """Ask user for an entry.
+def pick_key(key_list, page_size=PAGE_SIZE):
+    """Let the user pick an entry of `key_list`.
 
-    Returns a number or exits (with status 0, if the user types
-    ``q``). The number is between ``1`` and `max_key`.
+    Keys are shown in pages of `page_size` entries. Users can enter a
+    position like ``#2``, ``n`` or ``p`` to go to the next or previous
+    page, ``q`` to quit or any other text to search keys (by key id,
+    fingerprint or uid, see `key_index.KeyIndex`). Plain numbers are
+    searched for as well, as they might be key ids. If a search
+    matches exactly one key, it is picked directly, otherwise matching
+    keys are listed. Matches of plain numbers that are also positions
+    in the list are always listed, never picked. An empty input
+    resets the search.
+
+    Returns the number of the picked entry (starting with ``1``) or
+    exits (with status 0, if the user types ``q``).
     """
-    prompt_text = "Which key do you want to export? (1..%s; q to quit): " % (
-        max_key)
-    # pick an entry to process
-    entry_num = None
-    while entry_num is None:
-        entry_num = input_func(prompt_text)
-        if entry_num == "q":
+    index = KeyIndex(key_list)
+    matches = list(range(len(key_list)))
+    page = 0
+    while True:
+        pages = max((len(matches) + page_size - 1) // page_size, 1)
+        page = min(max(page, 0), pages - 1)
+        output_key_list(
+            key_list, matches[page * page_size:(page + 1) * page_size])
+        if pages > 1:
+            print("Page %s/%s (%s keys; n: next, p: previous page)" % (
+                page + 1, pages, len(matches)))
+        answer = input_func(
+            "Which key do you want to export? "
+            "(#1..#%s or search text; q to quit): " % len(key_list)).strip()
+        if answer == "q":
             print("Okay, abort.")
             sys.exit(0)
-        try:
-            entry_num = int(entry_num)
-        except ValueError:
-            entry_num = 0
-        if (entry_num < 1) or (entry_num > max_key):
-            entry_num = None
-    return entry_num
-
-
-def export_keys(hex_id):
-    """Export key wih id `hex_id`.
-
-    Returns directory, where all exported data was written to.
+        elif answer in ("n", "p"):
+            page += (answer == "n") and 1 or -1
+        elif answer.startswith("#"):
+            if answer[1:].isdigit() and 0 < int(answer[1:]) <= len(key_list):
+                return int(answer[1:])
+            print("No such key: %s" % answer)
+        elif answer:
+            hits = index.search(answer)
+            is_position = answer.isdigit() and (
+                0 < int(answer) <= len(key_list))
+            if len(hits) == 1 and not is_position:
+                return hits[0] + 1
+            if is_position:
+                print("Enter #%s to pick key #%s" % (answer, answer))
+            if not hits:
+                print("No keys found matching: %s" % answer)
+                continue
+            matches, page = hits, 0
+        else:
+            matches, page = list(range(len(key_list))), 0
+
+
+def get_export_members(hex_id, armor=True, subkeys=None,
+                       export_options=None, homedir=None, timeout=None,
+                       status=None, gnupg_path='gpg'):
+    """Export keys of key with id `hex_id` from GnuPG.
+
+    Returns a dict with archive member names (``<hex_id>.pub``,
+    ``<hex_id>.priv`` and ``<hex_id>.subkeys``) as keys and the
+    respective key data as exported by gpg as values.
+
+    If `armor` is ``False``, keys are exported as binary OpenPGP
+    packets.
+
+    If `subkeys` is a list of subkey ids, only these secret subkeys
+    are exported into ``<hex_id>.subkeys``. By default all secret
+    subkeys are exported.
+
+    `export_options` is a list of options passed to gpg via
+    ``--export-options`` for all exports.
+
+    Keys are exported with the gpg binary at `gnupg_path` from GnuPG
+    home `homedir` (default: the home set in environment). If any gpg
+    call runs longer than `timeout` seconds, `utils.CommandTimeout` is
+    raised.
+
+    If `status` is given (for instance a `status.ExportResult`), it is
+    passed status output of all gpg calls.
     """
     hex_id = str(hex_id)
     if not RE_HEX_NUMBER.match(hex_id):
@@ -220,43 +631,260 @@ def export_keys(hex_id):
     pub_path = "%s.pub" % hex_id
     priv_path = "%s.priv" % hex_id
     subs_path = "%s.subkeys" % hex_id
-    tar_path = os.path.join(os.getcwd(), "%s.tar.gz" % hex_id)
+    export_opts = armor and ["--armor"] or []
+    if export_options:
+        export_opts += ["--export-options", ",".join(export_options)]
 
-    pub_file, err = execute(["gpg", "--export", "--armor", hex_id])
+    pub_file, err = execute(
+        [gnupg_path, "--export"] + export_opts + [hex_id], homedir=homedir,
+        timeout=timeout, status_callback=status)
     print("Extract public keys to: %s" % (pub_path, ))
 
     priv_file, err = execute(
-        ["gpg", "--export-secret-keys", "--armor", hex_id])
+        [gnupg_path, "--export-secret-keys"] + export_opts + [hex_id],
+        homedir=homedir, timeout=timeout, status_callback=status)
     print("Extract secret keys to: %s" % (priv_path))
 
+    subkey_ids = [hex_id]
+    if subkeys is not None:
+        if not subkeys:
+            raise ValueError('No subkeys selected for export: %s' % hex_id)
+        subkey_ids = ["%s!" % x for x in subkeys]
     subs_file, err = execute(
-        ["gpg", "--export-secret-subkeys", "--armor", hex_id])
+        [gnupg_path, "--export-secret-subkeys"] + export_opts + subkey_ids,
+        homedir=homedir, timeout=timeout, status_callback=status)
     print("Extract subkeys belonging to this key to: %s" % (subs_path))
+    return {
+        pub_path: pub_file,
+        priv_path: priv_file,
+        subs_path: subs_file}
+
+
+def get_selected_members(hex_id, capabilities=None, minimal=False,
+                         gnupg_path='gpg', homedir=None, timeout=None, **kw):
+    """Export keys of key with id `hex_id` from GnuPG.
+
+    Like :func:`get_export_members`, but only subkeys with any of
+    `capabilities` are exported and third-party signatures are
+    stripped if `minimal` is set (see :func:`export_keys`). Further
+    keywords are passed to :func:`get_export_members`.
+    """
+    subkeys = None
+    if capabilities:
+        subkeys = select_subkeys(
+            get_subkey_list(hex_id, gnupg_path=gnupg_path, homedir=homedir,
+                            timeout=timeout),
+            capabilities)
+    export_options = None
+    if minimal:
+        export_options = get_minimal_export_options(
+            get_gnupg_version(gnupg_path))
+    return get_export_members(
+        hex_id, subkeys=subkeys, export_options=export_options,
+        homedir=homedir, timeout=timeout, gnupg_path=gnupg_path, **kw)
+
+
+def export_keys(hex_id, reproducible=False, capabilities=None,
+                minimal=False, armor=True, threads=None, homedir=None,
+                output_dir=None, timeout=None, status=None, output=None,
+                manifest=True, sign_key=None, recipients=None,
+                symmetric=False, passphrase=None, gnupg_path='gpg'):
+    """Export key wih id `hex_id`.
+
+    If `reproducible` is set, the archive is created in reproducible
+    mode (see :func:`create_tarfile`).
+
+    If `capabilities` is given (a string like ``'E'`` or ``'SA'``),
+    only valid, unexpired secret subkeys with at least one of these
+    capabilities are exported (see :func:`select_subkeys`).
+
+    If `minimal` is set, third-party signatures and attribute packets
+    (like photo ids) are stripped from exports, as far as supported by
+    the installed GnuPG version.
+
+    If `armor` is ``False``, keys are stored as binary OpenPGP packets,
+    which results in smaller archives. The archive then contains an
+    additional member ``<hex_id>.format`` marking the format.
+
+    `threads` is the number of threads used for compression (see
+    :func:`create_tarfile`).
+
+    Keys are exported with the gpg binary at `gnupg_path` from GnuPG
+    home `homedir` (default: the home set in environment) into
+    directory `output_dir` (default: the current working directory).
+    gpg calls running longer than `timeout` seconds are aborted. For
+    `status` see :func:`get_export_members`.
 
+    If `output` is given, the archive is written there instead. It
+    can be a path or a writable binary file object (like
+    ``sys.stdout.buffer``), which allows to pipe exports into other
+    processes.
+
+    If `manifest` is set, the archive contains SHA-256 digests of all
+    members, computed while writing (see :func:`create_tarfile`). The
+    digests are signed with key `sign_key`, if given.
+
+    If `recipients` (a list of key ids) is given or `symmetric` is
+    set, the archive is encrypted for these recipients and/or with
+    `passphrase` while it is written (see
+    `encryption.encrypted_output()`). The archive name then ends with
+    ``.tar.gz.gpg``.
+
+    Returns the path of the archive written (or `output`).
+    """
+    members = get_selected_members(
+        hex_id, capabilities=capabilities, minimal=minimal, armor=armor,
+        homedir=homedir, timeout=timeout, status=status,
+        gnupg_path=gnupg_path)
+    if not armor:
+        members["%s.format" % hex_id] = FORMAT_BINARY
+    encrypt, suffix = None, ".tar.gz"
+    if recipients or symmetric:
+        encrypt = partial(
+            encrypted_output, recipients=recipients, symmetric=symmetric,
+            passphrase=passphrase, executable=gnupg_path, homedir=homedir,
+            timeout=timeout)
+        suffix = ".tar.gz.gpg"
+    tar_path = output
+    if tar_path is None:
+        tar_path = os.path.join(
+            output_dir or os.getcwd(), "%s%s" % (hex_id, suffix))
+    signer = None
+    if manifest and sign_key is not None:
+        signer = partial(
+            sign_manifest, key=sign_key, executable=gnupg_path,
+            homedir=homedir, timeout=timeout)
     create_tarfile(
-        tar_path,
-        {
-            pub_path: pub_file,
-            priv_path: priv_file,
-            subs_path: subs_file}
-    )
-    print("\nAll export files written to: %s." % (tar_path))
+        tar_path, members, reproducible=reproducible, threads=threads,
+        manifest=manifest, signer=signer, encrypt=encrypt)
+    print("\nAll export files written to: %s." % (
+        getattr(tar_path, 'name', tar_path)))
     return tar_path
 
 
+def export_to_store(hex_id, store_path, capabilities=None, minimal=False,
+                    homedir=None, timeout=None, gnupg_path='gpg'):
+    """Export key with id `hex_id` into backup store at `store_path`.
+
+    Keys are exported with the gpg binary at `gnupg_path` from GnuPG
+    home `homedir` (default: the home set in environment). gpg calls
+    running longer than `timeout` seconds are aborted.
+
+    Keys are exported in binary form, which lets the store deduplicate
+    unchanged parts of keys across generations. For `capabilities`
+    and `minimal` see :func:`export_keys`.
+
+    Returns path to the manifest written.
+    """
+    members = get_selected_members(
+        hex_id, capabilities=capabilities, minimal=minimal, armor=False,
+        homedir=homedir, timeout=timeout, gnupg_path=gnupg_path)
+    store = BackupStore(store_path)
+    manifest_path = store.add(str(hex_id), members)
+    print("\nAll export files written to store: %s." % (manifest_path))
+    return manifest_path
+
+
 def main(args=sys.argv):
     options = handle_options(args[1:])
+    output, old_stdout = options.output, sys.stdout
+    if output == '-':
+        # keep stdout clean for archive data; messages go to stderr
+        output = getattr(sys.stdout, 'buffer', sys.stdout)
+        sys.stdout = sys.stderr
+    try:
+        return export_from_options(options, output)
+    finally:
+        sys.stdout = old_stdout
+
+
+def export_from_options(options, output=None):
+    """Export a key as requested by commandline `options`.
+
+    The archive is written to `output` (see :func:`export_keys`).
+    """
     greeting()
-    key_list = get_key_list(gnupg_path=options.gnupg_path)
+    if options.watch:
+        if output is not None:
+            print("Cannot watch and export into a single output",
+                  file=sys.stderr)
+            sys.exit(2)
+        return watch_and_export(options)
+    key_list = get_key_list(
+        gnupg_path=options.gnupg_path, native=options.native,
+        homedir=options.homedir, timeout=options.timeout)
     print("Locally available keys (with secret parts available):")
     if len(key_list) == 0:
         print("No keys found. Exiting.")
         return
-    output_key_list(key_list)
-    max_key = len(key_list)
-    entry_num = input_key(max_key)
+    if options.key is not None:
+        hits = KeyIndex(key_list).search(options.key)
+        if len(hits) != 1:
+            print("%s keys found matching: %s" % (len(hits), options.key),
+                  file=sys.stderr)
+            sys.exit(1)
+        entry_num = hits[0] + 1
+    else:
+        entry_num = pick_key(key_list)
 
     picked_hex_id = key_list[entry_num - 1][2]
     print("Picked key: %s (%s)" % (entry_num, key_list[entry_num - 1][2]))
+    try:
+        return get_export_func(options, output)(picked_hex_id)
+    except ValueError as err:
+        # nothing to export, for instance no subkeys with capabilities
+        print(str(err), file=sys.stderr)
+        sys.exit(2)
 
-    return export_keys(picked_hex_id)
+
+def get_export_func(options, output=None):
+    """Get a callable exporting keys as requested by `options`.
+
+    The callable expects a key id and exports it into an archive
+    written to `output` (see :func:`export_keys`) or into a backup
+    store.
+    """
+    if options.store_path is not None:
+        return partial(
+            export_to_store, store_path=options.store_path,
+            capabilities=options.capabilities, minimal=options.minimal,
+            homedir=options.homedir, timeout=options.timeout,
+            gnupg_path=options.gnupg_path)
+    passphrase = None
+    if options.passphrase_file is not None:
+        passphrase = read_passphrase(options.passphrase_file)
+    return partial(export_keys, reproducible=options.reproducible,
+                   capabilities=options.capabilities,
+                   minimal=options.minimal, armor=options.armor,
+                   threads=options.threads, homedir=options.homedir,
+                   output_dir=options.output_dir,
+                   timeout=options.timeout, output=output,
+                   sign_key=options.sign_key,
+                   recipients=options.recipients,
+                   symmetric=options.symmetric, passphrase=passphrase,
+                   gnupg_path=options.gnupg_path)
+
+
+def watch_and_export(options):
+    """Export keys as requested by `options` whenever they change.
+
+    Runs until interrupted. The state of keys exported is stored in the
+    output dir (or store), so that only keys changed meanwhile are
+    exported after restarts (see `watch.watch_keys()`).
+    """
+    state_dir = options.store_path or options.output_dir or os.getcwd()
+    if not os.path.isdir(state_dir):
+        os.makedirs(state_dir, 0o700)
+    list_func = partial(
+        get_key_list, gnupg_path=options.gnupg_path, native=options.native,
+        homedir=options.homedir, timeout=options.timeout)
+    print("Watching keys for changes. Press Ctrl-C to stop.")
+    try:
+        for exported in watch_keys(
+                list_func, get_export_func(options), homedir=options.homedir,
+                state_path=os.path.join(state_dir, STATE_FILE),
+                poll_interval=options.poll_interval):
+            if exported:
+                print("Exported changed keys: %s" % ", ".join(exported))
+    except KeyboardInterrupt:
+        print("Stopped watching.")
@@ -22,26 +22,88 @@
 """
 from __future__ import print_function
 import argparse
+import gzip
+import json
+import mmap
 import os
+import shutil
 import sys
 import tarfile
-from ulif.gnupgtools.utils import get_tmp_dir, execute
+import tempfile
+import time
+import warnings
+from contextlib import contextmanager
+from ulif.gnupgtools.backup_store import BackupStore
+from ulif.gnupgtools.encryption import (
+    decrypted_input, is_encrypted, peek, read_passphrase, HEAD_SIZE)
+from ulif.gnupgtools.ephemeral import ephemeral_home
+from ulif.gnupgtools.keyring import get_gnupg_home
+from ulif.gnupgtools.manifest import (
+    check_digests, verify_signature, ManifestError, MANIFEST_NAME,
+    MANIFEST_MEMBERS, SIGNATURE_NAME)
+from ulif.gnupgtools.packets import scan_keys, enarmor, PacketError
+from ulif.gnupgtools.status import ImportResult
+from ulif.gnupgtools.utils import execute, tarfile_open
+
+#: Extensions of archive members we process
+MEMBER_EXTENSIONS = ('.subkeys', '.priv', '.pub', '.format')
+
+#: Armor block types of archive members
+ARMOR_BLOCK_TYPES = {
+    'pub': 'PUBLIC KEY BLOCK',
+    'priv': 'PRIVATE KEY BLOCK',
+    'subkeys': 'PRIVATE KEY BLOCK',
+    }
+
+#: The first bytes of any gzip file
+GZIP_MAGIC = b'\x1f\x8b'
+
+#: gpg options used for imports in bulk mode
+BULK_IMPORT_OPTIONS = ['--batch', '--no-auto-check-trustdb']
+
+
+class UnverifiedKeysWarning(UserWarning):
+    """Issued if keys of an archive member cannot be verified.
+    """
 
 
 def handle_options(args):
     """Handle commandline options.
     """
-    parser = argparse.ArgumentParser(description="Import GnuPG master key")
-    parser.add_argument('infile', metavar='FILE',
-                        help='tar.gz file created by gpg-export-master-key.')
+    parser = argparse.ArgumentParser(
+        prog="gpg-import-master-key", description="Import GnuPG master key")
+    parser.add_argument('infile', metavar='FILE', nargs='+',
+                        help=('tar.gz file created by gpg-export-master-key '
+                              '(- for stdin). Several files are imported in '
+                              'bulk mode.'))
     parser.add_argument('-b', '--binary', dest="gnupg_path", default='gpg',
                         metavar='PATH', help='Path to GnuPG binary to use')
+    parser.add_argument('--homedir', default=None, metavar='DIR',
+                        help='GnuPG home to use (default: $GNUPGHOME)')
+    parser.add_argument('-s', '--store', dest="store_path", default=None,
+                        metavar='DIR',
+                        help='Import key with id FILE from backup store DIR')
+    parser.add_argument('-t', '--timeout', type=float, default=None,
+                        metavar='SECS',
+                        help='Abort gpg commands running longer than SECS')
+    parser.add_argument('--verify-signature', action='store_true',
+                        help='Require a valid signature of archive manifests')
+    parser.add_argument('--passphrase-file', default=None, metavar='FILE',
+                        help='Read passphrase of encrypted archives from FILE')
+    parser.add_argument('--dry-run', action='store_true',
+                        help=('Import into a temporary copy of the GnuPG '
+                              'home only'))
+    parser.add_argument('--summary', default=None, metavar='FILE',
+                        help='Store timings of bulk imports in FILE')
     opts = parser.parse_args(args)
     return opts
 
 
 def is_valid_input_file(path):
     """Detect whether `path` leads to a valid input file.
+
+    Valid input files are tar archives or encrypted files (which we
+    cannot check further without decrypting them).
     """
     if not path:
         return False
@@ -49,10 +111,55 @@ def is_valid_input_file(path):
     if not os.path.exists(path):
         return False
     if not tarfile.is_tarfile(path):
-        return False
+        return is_encrypted_file(path)
     return True
 
 
+def is_encrypted_file(path):
+    """Tell whether the file at `path` is encrypted.
+
+    See `encryption.is_encrypted()`.
+    """
+    with open(path, 'rb') as fd:
+        return is_encrypted(fd.read(HEAD_SIZE))
+
+
+def is_key_member(info):
+    """Tell whether `tarfile.TarInfo` `info` describes a key member.
+
+    Key members have filename extension '.subkeys' | '.pub' | '.priv'
+    | '.format', are regular files and not stored in subdirs.
+    """
+    if not info.isfile():
+        return False  # ignore non-regular files
+    if os.path.split(info.name)[0] != "":
+        return False  # ignore stuff in subdirs
+    # ignore files with unwanted filename extension
+    return os.path.splitext(info.name)[1] in MEMBER_EXTENSIONS
+
+
+def is_archive_member(info):
+    """Tell whether `tarfile.TarInfo` `info` describes a member we read.
+
+    These are key members (see :func:`is_key_member`) and the manifest
+    members (see `manifest.MANIFEST_MEMBERS`).
+    """
+    if info.isfile() and info.name in MANIFEST_MEMBERS:
+        return True
+    return is_key_member(info)
+
+
+def get_key_members(tar):
+    """Get the members of opened tarfile `tar` that contain keys.
+
+    Yields `tarfile.TarInfo` objects of members accepted by
+    :func:`is_archive_member`, i.e. key members and manifests.
+    """
+    for info in tar.getmembers():
+        if is_archive_member(info):
+            yield info
+
+
 def extract_archive(path):
     """Turn tar archive at `path` into a dict.
 
@@ -60,43 +167,109 @@ def extract_archive(path):
 
     - File format must be ``.tar.gz``.
     - Only members with filename extension '.subkeys' | '.pub' | '.priv'
-      are extracted.
+      | '.format' are extracted.
     - Only regular files are extracted (no dirs, etc.)
+    - Manifest members (see `manifest.MANIFEST_MEMBERS`) are extracted
+      as well.
 
     The archive is returned as a dict with member names as keys and
     file contents as value.
     """
     result = dict()
     tar = tarfile.open(path, "r:gz")
-    for info in tar.getmembers():
-        if not info.isfile():
-            continue  # ignore non-regular files
-        if os.path.split(info.name)[0] != "":
-            continue  # ignore stuff in subdirs
-        ext = os.path.splitext(info.name)[1]
-        if ext not in ('.subkeys', '.priv', '.pub'):
-            continue  # ignore files with unwanted filename extension
+    for info in get_key_members(tar):
         result[info.name] = tar.extractfile(info).read()
     tar.close()
     return result
 
 
-def keys_from_arch(path):
-    """Turn archive at path into dict with predefined keys.
+def stream_archive(fileobj):
+    """Turn tar archive read from file object `fileobj` into a dict.
+
+    Works like :func:`extract_archive`, but reads `fileobj` strictly
+    sequentially, so it can be a pipe like ``sys.stdin.buffer``.
+    Compressed and uncompressed archives are accepted.
+    """
+    result = dict()
+    with tarfile_open(None, "r|*", fileobj) as tar:
+        for info in tar:
+            if is_archive_member(info):
+                result[info.name] = tar.extractfile(info).read()
+    return result
 
-    Keys are ``'pub'``, ``'priv'``, ``'subkeys'``, and ``'key'``. The
-    latter represents the master key's short fingerprint. The other
-    items contain keys as exported from gpg.
+
+@contextmanager
+def mapped_archive(path):
+    """Get members of archive at `path` as memoryviews.
+
+    Contextmanager that works like :func:`extract_archive` but does
+    not read member contents into memory. Instead, the values of the
+    dict yielded are `memoryview` slices of a memory-mapped file.
+
+    Uncompressed tar archives are mapped directly. Compressed archives
+    are decompressed into a temporary spool file first.
+
+    The memoryviews are released when leaving the `with` block.
+    """
+    with open(path, 'rb') as fd:
+        is_gzipped = fd.read(2) == GZIP_MAGIC
+        fd.seek(0)
+        spool = fd
+        if is_gzipped:
+            spool = tempfile.TemporaryFile()
+            with gzip.GzipFile(fileobj=fd, mode='rb') as gz:
+                shutil.copyfileobj(gz, spool)
+            spool.seek(0)
+        try:
+            tar = tarfile.open(fileobj=spool, mode="r:")
+            infos = list(get_key_members(tar))
+            tar.close()
+            mapped = mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapped)
+            result = dict(
+                (info.name, view[info.offset_data:
+                                 info.offset_data + info.size])
+                for info in infos)
+            try:
+                yield result
+            finally:
+                for member_view in result.values():
+                    member_view.release()
+                view.release()
+                mapped.close()
+        finally:
+            if is_gzipped:
+                spool.close()
+
+
+def keys_from_members(archive_dict, armor=False):
+    """Turn dict of archive members into dict with predefined keys.
+
+    `archive_dict` should contain member names as keys and member
+    contents as values, as returned by :func:`extract_archive`.
+
+    Keys are ``'pub'``, ``'priv'``, ``'subkeys'``, ``'format'`` and
+    ``'key'``. The latter represents the master key's short
+    fingerprint. ``'format'`` is ``'binary'`` for archives containing
+    binary keys and ``'armor'`` otherwise. The other items contain
+    keys as exported from gpg.
+
+    If `armor` is set, binary keys are ASCII armored.
 
     If keys are not consistend (i.e. we have 'AAAAAAA.pub' and
     'BBBBBBB.priv' in archive, a `ValueError` is raised.
+
+    If `archive_dict` contains a manifest, all members are checked
+    against it first. `manifest.ManifestError` (a `ValueError`) is
+    raised if any digest does not match.
     """
-    archive_dict = extract_archive(path)
+    if MANIFEST_NAME in archive_dict:
+        check_digests(archive_dict)
     result = dict()
     name = None
     for key, value in archive_dict.items():
         member_name, ext = os.path.splitext(key)
-        for ext_name in ('.pub', '.priv', '.subkeys'):
+        for ext_name in ('.pub', '.priv', '.subkeys', '.format'):
             if ext != ext_name:
                 continue
             if name is not None and member_name != name:
@@ -104,40 +277,377 @@ def keys_from_arch(path):
             name = member_name
             result[ext_name[1:]] = value
     result['key'] = name
+    marker = bytes(result.get('format', b'armor')).strip()
+    result['format'] = (marker == b'binary') and 'binary' or 'armor'
+    if armor and result['format'] == 'binary':
+        for member, block_type in ARMOR_BLOCK_TYPES.items():
+            if member in result:
+                result[member] = enarmor(result[member], block_type)
+        result['format'] = 'armor'
     return result
 
 
-def import_master_key(path, executable='gpg'):
-    """Import master key from archive in `path`.
+def keys_from_arch(path):
+    """Turn archive at path into dict with predefined keys.
+
+    See :func:`keys_from_members` for the keys of the returned dict.
+    """
+    return keys_from_members(extract_archive(path))
+
+
+def scan_archive(path):
+    """Scan key archive at `path` for keys without calling gpg.
 
-    Use `executable` as `gpg` binary.
+    Returns a dict with member names as keys and lists of
+    `packets.ScannedKey` tuples (containing fingerprints, uids, etc.)
+    as values.
     """
-    keys_dict = keys_from_arch(path)
-    out, err = None, None
+    with mapped_archive(path) as archive_dict:
+        return dict(
+            (name, scan_keys(value)) for name, value in archive_dict.items()
+            if name not in MANIFEST_MEMBERS)
+
+
+def verify_keys(keys_dict):
+    """Verify that keys in `keys_dict` belong to the key named there.
+
+    `keys_dict` must be a dict as returned by
+    :func:`keys_from_members`. The public keys and subkeys contained
+    must have the key named in ``keys_dict['key']`` (a key id or
+    fingerprint) as (first) primary key. Raises `ValueError` if not,
+    also if members are missing.
+
+    Members the packet scanner cannot parse (for instance keys of
+    versions or algorithms not supported by `packets.parse_key`) are
+    left to gpg: an :exc:`UnverifiedKeysWarning` is issued for them.
+    """
+    name = (keys_dict.get('key') or '').upper()
+    for member in ('pub', 'subkeys'):
+        if member not in keys_dict:
+            raise ValueError('Archive member %s.%s missing' % (name, member))
+        try:
+            scanned = scan_keys(keys_dict[member])
+        except PacketError as err:
+            warnings.warn(UnverifiedKeysWarning(
+                'Cannot verify keys in %s.%s: %s' % (name, member, err)))
+            continue
+        # names can be key ids or fingerprints
+        if not scanned or not name or (
+                not scanned[0].fingerprint.endswith(name)):
+            raise ValueError('Archive member %s.%s does not contain key %s' % (
+                name, member, name))
+
+
+def import_keys(keys_dict, executable='gpg', homedir=None, timeout=None,
+                options=None):
+    """Import keys from `keys_dict`.
+
+    `keys_dict` must be a dict as returned by
+    :func:`keys_from_members`. Use `executable` as `gpg` binary.
+
+    Keys are passed to gpg via stdin. They can be given as any
+    bytes-like objects. Before any import we check whether the keys
+    match the key name in `keys_dict` (see :func:`verify_keys`).
+
+    Keys are imported into GnuPG home `homedir` (default: the home set
+    in environment). If a gpg call runs longer than `timeout` seconds,
+    `utils.CommandTimeout` is raised.
+
+    `options` is a list of additional options passed to gpg (see, for
+    instance, `BULK_IMPORT_OPTIONS`).
+
+    Returns a `status.ImportResult`, filled from gpg status output
+    while gpg runs. gpg output is available as its `stdout` and
+    `stderr` attributes.
+    """
+    verify_keys(keys_dict)
+    result = ImportResult()
     for key, opt in (('pub', '--import'),
                      ('subkeys', '--import')):
-        with get_tmp_dir() as tmp_dir:
-            infile_path = os.path.join(tmp_dir, 'key.%s' % key)
-            with open(infile_path, 'wb') as infile_fd:
-                infile_fd.write(keys_dict[key])
-            new_out, new_err = execute([executable, opt, infile_path])
-            out = (out or b'') + (new_out or b'')
-            err = (err or b'') + (new_err or b'')
-    return out, err
+        out, err = execute(
+            [executable] + (options or []) + [opt], input=keys_dict[key],
+            homedir=homedir,
+            timeout=timeout, status_callback=result)
+        result.add_output(out, err)
+    return result
+
+
+def check_signature(archive_dict, executable='gpg', homedir=None,
+                    timeout=None):
+    """Verify the manifest signature contained in `archive_dict`.
+
+    The signing key must be available in GnuPG home `homedir`. Raises
+    `manifest.ManifestError` if the archive contains no signed
+    manifest or the signature is not valid. Returns a
+    `status.VerifyResult` otherwise.
+    """
+    if SIGNATURE_NAME not in archive_dict or (
+            MANIFEST_NAME not in archive_dict):
+        raise ManifestError('Archive contains no signed manifest')
+    return verify_signature(
+        archive_dict[MANIFEST_NAME], bytes(archive_dict[SIGNATURE_NAME]),
+        executable=executable, homedir=homedir, timeout=timeout)
+
+
+def import_master_key(path, executable='gpg', homedir=None, timeout=None,
+                      options=None, verify_signature=False, passphrase=None):
+    """Import master key from archive in `path`.
+
+    Use `executable` as `gpg` binary. Keys are imported into GnuPG home
+    `homedir` (default: the home set in environment). Archive members
+    are memory-mapped and passed to gpg without intermediate copies.
+    For `timeout` and `options` see :func:`import_keys`.
+
+    `path` can also be a readable binary file object (like
+    ``sys.stdin.buffer``), which is read as a stream (see
+    :func:`stream_archive`).
+
+    Encrypted archives are decrypted while they are read, using
+    `passphrase` for symmetrically encrypted archives and secret keys
+    of `homedir` otherwise (see `encryption.decrypted_input()`).
+
+    Archives containing a manifest are checked against it before
+    anything is imported. If `verify_signature` is set, the manifest
+    must also be signed by a key known in `homedir` (see
+    :func:`check_signature`).
+    """
+    if hasattr(path, 'read'):
+        head, fileobj = peek(path)
+        if not is_encrypted(head):
+            return import_members(
+                stream_archive(fileobj), executable, homedir, timeout,
+                options, verify_signature)
+        return import_encrypted(
+            fileobj, executable, homedir, timeout, options,
+            verify_signature, passphrase)
+    if is_encrypted_file(path):
+        with open(path, 'rb') as fd:
+            return import_encrypted(
+                fd, executable, homedir, timeout, options,
+                verify_signature, passphrase)
+    with mapped_archive(path) as archive_dict:
+        return import_members(
+            archive_dict, executable, homedir, timeout, options,
+            verify_signature)
+
+
+def import_encrypted(fileobj, executable='gpg', homedir=None, timeout=None,
+                     options=None, verify_signature=False, passphrase=None):
+    """Import keys from encrypted archive read from `fileobj`.
+
+    The archive is decrypted and unpacked in one pass. Nothing is
+    imported unless decryption succeeded completely. See
+    :func:`import_master_key` for the other arguments.
+    """
+    with decrypted_input(fileobj, passphrase=passphrase,
+                         executable=executable, homedir=homedir,
+                         timeout=timeout) as stream:
+        archive_dict = stream_archive(stream)
+    return import_members(
+        archive_dict, executable, homedir, timeout, options,
+        verify_signature)
+
+
+def import_members(archive_dict, executable='gpg', homedir=None,
+                   timeout=None, options=None, verify_signature=False):
+    """Import keys from `archive_dict`.
+
+    `archive_dict` maps archive member names to their contents. See
+    :func:`import_master_key` for the other arguments.
+    """
+    keys_dict = keys_from_members(archive_dict)
+    if verify_signature:
+        check_signature(
+            archive_dict, executable=executable, homedir=homedir,
+            timeout=timeout)
+    return import_keys(
+        keys_dict, executable=executable, homedir=homedir,
+        timeout=timeout, options=options)
+
+
+def import_from_store(store_path, key, executable='gpg', generation=None,
+                      homedir=None, timeout=None, options=None):
+    """Import master key `key` from backup store in `store_path`.
+
+    If no `generation` is given, the latest generation stored is
+    imported. Use `executable` as `gpg` binary. Keys are imported
+    into GnuPG home `homedir` (default: the home set in environment).
+    For `timeout` and `options` see :func:`import_keys`.
+    """
+    store = BackupStore(store_path)
+    members = store.get(key, generation=generation)
+    return import_keys(
+        keys_from_members(members), executable=executable, homedir=homedir,
+        timeout=timeout, options=options)
+
+
+def check_trustdb(executable='gpg', homedir=None, timeout=None):
+    """Update the trust database of GnuPG home `homedir`.
+
+    Returns the (stdout, stderr) output of gpg.
+    """
+    return execute(
+        [executable, '--batch', '--check-trustdb'], homedir=homedir,
+        timeout=timeout)
+
+
+def bulk_import(sources, executable='gpg', homedir=None, timeout=None,
+                store_path=None, verify_signature=False, passphrase=None):
+    """Import master keys from all `sources`, checking trust only once.
+
+    `sources` is a list of archive paths or, if `store_path` is
+    given, a list of key ids stored in the backup store at
+    `store_path`. All imports are done with automatic trustdb checks
+    disabled (see `BULK_IMPORT_OPTIONS`). A single trustdb check is
+    run afterwards. For `verify_signature` and `passphrase` see
+    :func:`import_master_key`.
+
+    Returns a dict with `results`, a list of (source, result) tuples
+    with result being a `status.ImportResult` or the exception raised
+    while importing, and the time needed for all imports
+    (`import_seconds`) and the trustdb check (`trustdb_seconds`).
+    Errors during single imports do not stop the bulk import.
+    """
+    results = []
+    start = time.time()
+    for source in sources:
+        try:
+            if store_path is not None:
+                result = import_from_store(
+                    store_path, source, executable, homedir=homedir,
+                    timeout=timeout, options=BULK_IMPORT_OPTIONS)
+            else:
+                result = import_master_key(
+                    source, executable, homedir=homedir, timeout=timeout,
+                    options=BULK_IMPORT_OPTIONS,
+                    verify_signature=verify_signature, passphrase=passphrase)
+        except Exception as err:
+            result = err
+        results.append((source, result))
+    trustdb_start = time.time()
+    check_trustdb(executable, homedir=homedir, timeout=timeout)
+    return dict(
+        results=results, import_seconds=trustdb_start - start,
+        trustdb_seconds=time.time() - trustdb_start)
+
+
+def get_bulk_summary(bulk_result):
+    """Get timings of `bulk_result` as returned by `bulk_import()`.
+
+    Returns a dict with the number of `sources` (master keys) imported
+    and the `import_seconds` and `trustdb_seconds` needed. The planner
+    of `gpg-export-homes` estimates imports from these.
+    """
+    return dict(
+        sources=len(bulk_result['results']),
+        import_seconds=bulk_result['import_seconds'],
+        trustdb_seconds=bulk_result['trustdb_seconds'])
+
+
+def output_import_result(result):
+    """Print a summary of `result`, a `status.ImportResult`.
+
+    Messages of gpg are passed to stderr.
+    """
+    if result.stderr:
+        sys.stderr.write(result.stderr.decode('utf-8', 'replace'))
+    counts = result.counts
+    print("Keys processed: %d, imported: %d, unchanged: %d, "
+          "secret keys imported: %d" % (
+              counts['count'], counts['imported'], counts['unchanged'],
+              counts['sec_imported']))
+    for keyword, args in result.errors:
+        print("Error: %s %s" % (keyword, ' '.join(args)), file=sys.stderr)
+
+
+def output_bulk_result(bulk_result):
+    """Print a summary of `bulk_result` as returned by `bulk_import()`.
+    """
+    for source, result in bulk_result['results']:
+        if isinstance(result, Exception):
+            print("%s: FAILED: %s" % (getattr(source, 'name', source), result),
+                  file=sys.stderr)
+            continue
+        print("%s: imported: %d, unchanged: %d, errors: %d" % (
+            getattr(source, 'name', source), result.counts['imported'],
+            result.counts['unchanged'], len(result.errors)))
+    print("Imported %d sources in %.2fs, trustdb check took %.2fs" % (
+        len(bulk_result['results']), bulk_result['import_seconds'],
+        bulk_result['trustdb_seconds']))
+
+
+def import_sources(sources, options, homedir=None):
+    """Import `sources` into `homedir` as requested by `options`.
+
+    Results are printed. Exits with status 2 if a single source cannot
+    be imported.
+    """
+    passphrase = None
+    if options.passphrase_file is not None:
+        passphrase = read_passphrase(options.passphrase_file)
+    if len(sources) > 1:
+        bulk_result = bulk_import(
+            sources, options.gnupg_path, homedir=homedir,
+            timeout=options.timeout, store_path=options.store_path,
+            verify_signature=options.verify_signature,
+            passphrase=passphrase)
+        output_bulk_result(bulk_result)
+        if options.summary is not None:
+            with open(options.summary, 'w') as fd:
+                json.dump(dict(imports=[get_bulk_summary(bulk_result)]),
+                          fd, indent=2)
+        return
+    if options.store_path is not None:
+        try:
+            result = import_from_store(
+                options.store_path, sources[0], options.gnupg_path,
+                homedir=homedir, timeout=options.timeout)
+        except (KeyError, ValueError) as err:
+            print(err.args[0], file=sys.stderr)
+            sys.exit(2)
+        output_import_result(result)
+        return
+    try:
+        result = import_master_key(
+            sources[0], options.gnupg_path, homedir=homedir,
+            timeout=options.timeout,
+            verify_signature=options.verify_signature, passphrase=passphrase)
+    except ValueError as err:
+        # keys not matching their names, invalid manifests/signatures
+        print(str(err), file=sys.stderr)
+        sys.exit(2)
+    output_import_result(result)
 
 
 def main(args=None):
     """Import a master key.
 
     This is the interface for the commandline. If `args` is not given, we
-    lookup `sys.argv`.
+    lookup `sys.argv`. If several sources are given, they are imported
+    in bulk mode (see :func:`bulk_import`). Dry runs import into an
+    ephemeral copy of the GnuPG home (see `ephemeral.ephemeral_home()`).
     """
     if args is None:
         args = sys.argv
     options = handle_options(args[1:])
-    if not is_valid_input_file(options.infile):
-        print("Not a valid master key archive: %s" % options.infile,
+    sources = options.infile
+    if options.store_path is None:
+        if sources.count('-') > 1:
+            print("stdin (-) can be read only once", file=sys.stderr)
+            sys.exit(2)
+        stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+        sources = [x == '-' and stdin or x for x in sources]
+        for path in sources:
+            if path is stdin:
+                continue  # cannot check streams in advance
+            if not is_valid_input_file(path):
+                print("Not a valid master key archive: %s" % path,
+                      file=sys.stderr)
+                sys.exit(2)
+    if not options.dry_run:
+        import_sources(sources, options, options.homedir)
+        return
+    with ephemeral_home(get_gnupg_home(options.homedir)) as homedir:
+        print("Dry run: importing into a temporary copy of the GnuPG home",
               file=sys.stderr)
-        sys.exit(2)
-    import_master_key(options.infile, options.gnupg_path)
-    return
+        import_sources(sources, options, homedir)
@@ -0,0 +1,135 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Search index over key lists.
+
+ Finds entries of lists as returned by
+ `export_master_key.get_key_list()` by key id, fingerprint or words
+ of their uids without scanning the whole list.
+"""
+import re
+from bisect import bisect_left
+
+#: Regular expression matching hex numbers (optionally prefixed by 0x)
+RE_HEX_TERM = re.compile('^(0x)?([0-9a-fA-F]+)$')
+
+#: Regular expression matching words in uids
+RE_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Split `text` into lowercase words.
+
+      >>> tokenize('Bob Tester <bob@example.org>')
+      ['bob', 'tester', 'bob', 'example', 'org']
+
+    """
+    return [x.lower() for x in RE_TOKEN.findall(text)]
+
+
+def get_entry_ids(entry):
+    """Get the key ids of key list `entry`.
+
+    These are the short key id and, for `records.KeyRecord` entries
+    with known fingerprint, also the fingerprint and long key id.
+    """
+    result = [entry[2]]
+    fingerprint = getattr(entry, 'fingerprint', None)
+    if fingerprint:
+        result.extend([fingerprint, fingerprint[-16:]])
+    return result
+
+
+class KeyIndex(object):
+    """An index over entries of `key_list`.
+
+    Key ids are looked up in a dict, prefixes of key ids and uid words
+    in sorted lists by bisection. Positions returned refer to
+    `key_list`.
+    """
+
+    def __init__(self, key_list):
+        self.key_list = key_list
+        self._ids = dict()
+        self._tokens = dict()
+        for pos, entry in enumerate(key_list):
+            for key_id in get_entry_ids(entry):
+                self._ids.setdefault(key_id.upper(), set()).add(pos)
+            for uid in entry[0]:
+                for token in tokenize(uid):
+                    self._tokens.setdefault(token, set()).add(pos)
+        self._sorted_ids = sorted(self._ids)
+        self._sorted_tokens = sorted(self._tokens)
+
+    def _prefix_lookup(self, sorted_keys, mapping, prefix):
+        # get positions of all entries with keys starting with `prefix`
+        result = set()
+        for num in range(bisect_left(sorted_keys, prefix), len(sorted_keys)):
+            if not sorted_keys[num].startswith(prefix):
+                break
+            result.update(mapping[sorted_keys[num]])
+        return result
+
+    def lookup(self, term):
+        """Get a set of positions of entries matching search `term`.
+
+        Hex numbers match key ids starting with `term`. Fingerprints and
+        long key ids also match the key id they end with. Words in
+        `term` must all start words of some uid of an entry.
+
+        If nothing is found that way, we fall back to a (slow) search
+        for uids containing `term`.
+        """
+        result = set()
+        match = RE_HEX_TERM.match(term)
+        if match:
+            hex_term = match.group(2).upper()
+            result.update(self._prefix_lookup(
+                self._sorted_ids, self._ids, hex_term))
+            for size in (16, 8):
+                if len(hex_term) > size:
+                    result.update(self._ids.get(hex_term[-size:], ()))
+        tokens = tokenize(term)
+        if tokens:
+            token_hits = None
+            for token in tokens:
+                hits = self._prefix_lookup(
+                    self._sorted_tokens, self._tokens, token)
+                if token_hits is not None:
+                    hits &= token_hits
+                token_hits = hits
+            result.update(token_hits)
+        if not result:
+            term = term.lower()
+            result = set([
+                pos for pos, entry in enumerate(self.key_list)
+                if [uid for uid in entry[0] if term in uid.lower()]])
+        return result
+
+    def search(self, query):
+        """Get a sorted list of positions of entries matching `query`.
+
+        `query` can consist of several whitespace separated terms, which
+        must all match (see :meth:`lookup`).
+        """
+        result = None
+        for term in query.split():
+            hits = self.lookup(term)
+            if result is not None:
+                hits &= result
+            result = hits
+        return sorted(result or ())
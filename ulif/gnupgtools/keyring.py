@@ -0,0 +1,197 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Read secret keys from GnuPG homes without calling gpg.
+
+ Supported are legacy homes (``secring.gpg``, as written by GnuPG
+ 1.x and 2.0) and homes of GnuPG 2.1 or later, where public keys are
+ stored in ``pubring.kbx`` or ``pubring.gpg`` and secret keys in
+ ``private-keys-v1.d/<keygrip>.key``.
+
+ The reader is read-only and does not check the trust database or
+ signatures.
+"""
+import os
+import struct
+import time
+from io import BytesIO
+from ulif.gnupgtools.packets import (
+    iter_packets, iter_keyblocks, parse_key, parse_user_id, get_keygrip,
+    PacketError, ALGO_LETTERS, KEY_TAGS, PRIMARY_KEY_TAGS, TAG_USER_ID,
+    )
+from ulif.gnupgtools.records import KeyRecord, sort_records
+
+#: Keybox blob type of blobs containing OpenPGP keyblocks
+KEYBOX_BLOB_OPENPGP = 2
+
+
+class UnsupportedKeyring(Exception):
+    """Raised if a keyring cannot be read without gpg.
+    """
+
+
+def get_gnupg_home(homedir=None):
+    """Get the path of the GnuPG home to use.
+
+    That is `homedir` if given, ``$GNUPGHOME`` if set or
+    ``~/.gnupg`` otherwise.
+    """
+    if homedir is not None:
+        return homedir
+    return os.environ.get(
+        'GNUPGHOME', os.path.join(os.path.expanduser('~'), '.gnupg'))
+
+
+def iter_keybox_blocks(fp):
+    """Iterate over the OpenPGP keyblocks stored in keybox file `fp`.
+
+    Yields the binary keyblocks. Blobs of other types (like the
+    header blob or X.509 certificates) are skipped.
+    """
+    while True:
+        header = fp.read(5)
+        if not header:
+            return
+        if len(header) < 5:
+            raise UnsupportedKeyring('Truncated keybox blob')
+        length, blob_type = struct.unpack('>IB', header)
+        if length < 5:
+            raise UnsupportedKeyring('Invalid keybox blob length')
+        blob = header + fp.read(length - 5)
+        if blob_type != KEYBOX_BLOB_OPENPGP:
+            continue
+        offset, size = struct.unpack('>II', blob[8:16])
+        yield blob[offset:offset + size]
+
+
+def format_key_info(key, is_stub=False):
+    """Get text describing `key` like gpg (1.x) does in key lists.
+
+      >>> from ulif.gnupgtools.packets import Key
+      >>> key = Key(5, 4, 1420520124, 1, 2048, 'ADCD...C5',
+      ...           '8C3589C9DAA011C5', b'', [], False)
+      >>> format_key_info(key)
+      'sec   2048R/DAA011C5 2015-01-06'
+      >>> format_key_info(key, is_stub=True)
+      'sec#  2048R/DAA011C5 2015-01-06'
+
+    """
+    return "%-5s %d%s/%s %s" % (
+        is_stub and 'sec#' or 'sec', key.bits, ALGO_LETTERS.get(key.algo, '?'),
+        key.key_id[-8:], time.strftime('%Y-%m-%d', time.gmtime(key.created)))
+
+
+def keyblock_to_record(keyblock, has_secret):
+    """Turn `keyblock` (a list of packets) into a key record.
+
+    `has_secret` is a callable that is passed a parsed key and tells
+    whether a (real, not a stub) secret key is available for it.
+
+    Returns a `records.KeyRecord` like the entries of the list
+    returned by `export_master_key.get_key_list()` or ``None`` if no
+    secret key is available for the primary key or any of its
+    subkeys.
+    """
+    primary, uids, subkeys, subkey_secret = None, [], [], False
+    for packet in keyblock:
+        if packet.tag == TAG_USER_ID:
+            uids.append(parse_user_id(packet))
+        elif packet.tag in KEY_TAGS:
+            key = parse_key(packet)
+            if packet.tag in PRIMARY_KEY_TAGS:
+                primary = key
+                continue
+            subkeys.append(key.key_id[-8:])
+            if has_secret(key):
+                subkey_secret = True
+    primary_secret = has_secret(primary)
+    if not (primary_secret or subkey_secret):
+        return None
+    return KeyRecord(
+        uids, format_key_info(primary, not primary_secret),
+        primary.key_id[-8:], fingerprint=primary.fingerprint,
+        subkeys=subkeys)
+
+
+def read_legacy_keys(path):
+    """Read secret keys from legacy secret keyring at `path`.
+    """
+    def has_secret(key):
+        return key.tag in (5, 7) and not key.is_stub
+    with open(path, 'rb') as fp:
+        keyblocks = list(iter_keyblocks(iter_packets(fp)))
+    return [keyblock_to_record(x, has_secret) for x in keyblocks]
+
+
+def read_agent_keys(path, private_keys_dir):
+    """Read keys from public keyring `path` and `private_keys_dir`.
+
+    Public keys are read from keyring `path` (a keybox or legacy
+    keyring). Secret keys are looked up by keygrip in
+    `private_keys_dir`.
+    """
+    grips = set()
+    if os.path.isdir(private_keys_dir):
+        grips = set(
+            name[:-4].upper() for name in os.listdir(private_keys_dir)
+            if name.endswith('.key'))
+
+    def has_secret(key):
+        grip = get_keygrip(key)
+        if grip is None:
+            raise UnsupportedKeyring(
+                'Cannot compute keygrip for algorithm %s' % key.algo)
+        return grip in grips
+    with open(path, 'rb') as fp:
+        if path.endswith('.kbx'):
+            keyblocks = []
+            for block in iter_keybox_blocks(fp):
+                keyblocks.extend(iter_keyblocks(iter_packets(BytesIO(block))))
+        else:
+            keyblocks = list(iter_keyblocks(iter_packets(fp)))
+    return [keyblock_to_record(x, has_secret) for x in keyblocks]
+
+
+def read_secret_keys(homedir=None):
+    """Get a sorted list of secret keys stored in GnuPG home `homedir`.
+
+    The list has the same format as the one returned by
+    `export_master_key.get_key_list()`. If `homedir` is not given,
+    we look up the default GnuPG home (see :func:`get_gnupg_home`).
+
+    Raises :exc:`UnsupportedKeyring` if the home cannot be read
+    without gpg.
+    """
+    home = get_gnupg_home(homedir)
+    private_keys_dir = os.path.join(home, 'private-keys-v1.d')
+    migrated = os.path.exists(os.path.join(home, '.gpg-v21-migrated'))
+    try:
+        for name in ('pubring.kbx', 'pubring.gpg'):
+            path = os.path.join(home, name)
+            if not os.path.isfile(path):
+                continue
+            if name == 'pubring.kbx' or migrated:
+                records = read_agent_keys(path, private_keys_dir)
+                break
+        else:
+            path = os.path.join(home, 'secring.gpg')
+            if os.path.isdir(private_keys_dir) or not os.path.isfile(path):
+                raise UnsupportedKeyring('No supported keyring in %s' % home)
+            records = read_legacy_keys(path)
+    except PacketError as err:
+        raise UnsupportedKeyring('Cannot parse keyring: %s' % err)
+    return sort_records([x for x in records if x is not None])
@@ -0,0 +1,172 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Integrity manifests for key archives.
+
+ Archives written by `gpg-export-master-key` contain a member
+ :data:`MANIFEST_NAME` listing SHA-256 digests of all other members
+ in the format of ``sha256sum``. Digests are computed while members
+ are written. The manifest can be signed, the detached, armored
+ signature is stored as :data:`SIGNATURE_NAME`.
+
+ Importers check digests before passing any key to gpg, so that
+ corrupted archives are rejected before partial imports happen.
+"""
+import hashlib
+import os
+import tempfile
+from ulif.gnupgtools.status import VerifyResult
+from ulif.gnupgtools.utils import execute
+
+#: Name of the manifest member in archives
+MANIFEST_NAME = 'SHA256SUMS'
+
+#: Name of the manifest signature member in archives
+SIGNATURE_NAME = 'SHA256SUMS.asc'
+
+#: Names of all manifest related members
+MANIFEST_MEMBERS = (MANIFEST_NAME, SIGNATURE_NAME)
+
+
+class ManifestError(ValueError):
+    """Raised if archive members do not match their manifest.
+    """
+
+
+class DigestReader(object):
+    """Wrap readable file object `fileobj`, hashing all data read.
+
+    The SHA-256 digest of all data read so far is available via
+    :meth:`hexdigest`. Pass instances where file objects are read
+    anyway (like `tarfile.TarFile.addfile()`) to compute digests
+    without reading data twice.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self._hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self._hash.update(data)
+        return data
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def get_digest(data):
+    """Get the SHA-256 hex digest of bytes-like `data`.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def format_manifest(digests):
+    """Turn dict `digests` into manifest contents (bytes).
+
+    `digests` maps member names to hex digests. Lines are sorted by
+    name:
+
+      >>> format_manifest({'b': '12', 'a': '34'})
+      b'34  a\\n12  b\\n'
+
+    """
+    return ''.join([
+        '%s  %s\n' % (digests[name], name)
+        for name in sorted(digests)]).encode('utf-8')
+
+
+def parse_manifest(data):
+    """Parse manifest contents `data` into a dict.
+
+    The dict maps member names to hex digests. Raises
+    :exc:`ManifestError` on malformed lines.
+    """
+    result = dict()
+    for line in bytes(data).decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+        fields = line.split('  ', 1)
+        if len(fields) != 2 or len(fields[0]) != 64:
+            raise ManifestError('Malformed manifest line: %s' % line)
+        result[fields[1]] = fields[0].lower()
+    return result
+
+
+def check_digests(archive_dict):
+    """Check members of `archive_dict` against its manifest.
+
+    `archive_dict` maps member names to contents (bytes-like objects),
+    including the manifest. All members (except the manifest and its
+    signature) must be listed in the manifest with correct digest and
+    all members listed must exist. Raises :exc:`ManifestError`
+    otherwise.
+    """
+    expected = parse_manifest(archive_dict[MANIFEST_NAME])
+    names = [x for x in archive_dict if x not in MANIFEST_MEMBERS]
+    for name in sorted(names):
+        if name not in expected:
+            raise ManifestError('Member not in manifest: %s' % name)
+        if get_digest(archive_dict[name]) != expected[name]:
+            raise ManifestError('Checksum mismatch: %s' % name)
+    missing = sorted(set(expected).difference(names))
+    if missing:
+        raise ManifestError('Members missing: %s' % ', '.join(missing))
+
+
+def sign_manifest(data, key=None, executable='gpg', homedir=None,
+                  timeout=None):
+    """Get a detached, armored signature of manifest contents `data`.
+
+    The signature is made with `key` (default: the default key of
+    GnuPG home `homedir`). Raises :exc:`ManifestError` if gpg creates
+    no signature.
+    """
+    cmd = [executable, '--batch', '--armor', '--detach-sign']
+    if key is not None:
+        cmd += ['--local-user', key]
+    signature, err = execute(cmd, input=data, homedir=homedir,
+                             timeout=timeout)
+    if not signature:
+        raise ManifestError('Could not sign manifest: %s' % (
+            err.decode('utf-8', 'replace').strip()))
+    return signature
+
+
+def verify_signature(data, signature, executable='gpg', homedir=None,
+                     timeout=None):
+    """Verify detached `signature` of manifest contents `data`.
+
+    The signing key must be available in GnuPG home `homedir`.
+    Returns a `status.VerifyResult`. Raises :exc:`ManifestError` if
+    the signature is not valid.
+    """
+    result = VerifyResult()
+    fd, sig_path = tempfile.mkstemp(suffix='.asc')
+    try:
+        with os.fdopen(fd, 'wb') as sig_file:
+            sig_file.write(signature)
+        out, err = execute(
+            [executable, '--batch', '--verify', sig_path, '-'],
+            input=data, homedir=homedir, timeout=timeout,
+            status_callback=result)
+        result.add_output(out, err)
+    finally:
+        os.unlink(sig_path)
+    if not result.valid:
+        raise ManifestError('Invalid manifest signature')
+    return result
@@ -0,0 +1,565 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Minimal OpenPGP packet parsing (RFC 4880).
+
+ Only the parts needed to find keys, user ids and fingerprints are
+ supported. Nothing here does any cryptography (apart from computing
+ fingerprints) or verifies signatures.
+"""
+import base64
+import binascii
+import hashlib
+import struct
+from collections import namedtuple
+
+#: Packet tags we are interested in
+TAG_PUBKEY_ENC_SESSION_KEY = 1
+TAG_SYMKEY_ENC_SESSION_KEY = 3
+TAG_SECRET_KEY = 5
+TAG_PUBLIC_KEY = 6
+TAG_SECRET_SUBKEY = 7
+TAG_USER_ID = 13
+TAG_PUBLIC_SUBKEY = 14
+
+#: Tags of packets starting a new key block
+PRIMARY_KEY_TAGS = (TAG_SECRET_KEY, TAG_PUBLIC_KEY)
+
+#: Tags of all key packets
+KEY_TAGS = (
+    TAG_SECRET_KEY, TAG_PUBLIC_KEY, TAG_SECRET_SUBKEY, TAG_PUBLIC_SUBKEY)
+
+#: Tags of secret key packets
+SECRET_KEY_TAGS = (TAG_SECRET_KEY, TAG_SECRET_SUBKEY)
+
+#: Public key algorithms and the number of MPIs in their public part.
+#: ECC algorithms are handled separately.
+ALGO_NUM_MPIS = {
+    1: 2, 2: 2, 3: 2,    # RSA (n, e)
+    16: 3, 20: 3,        # Elgamal (p, g, y)
+    17: 4,               # DSA (p, q, g, y)
+    }
+
+#: ECC algorithms: ECDH, ECDSA, EdDSA
+ECC_ALGOS = (18, 19, 22)
+
+#: Letters used by gpg (1.x) to denote public key algorithms
+ALGO_LETTERS = {
+    1: 'R', 2: 'r', 3: 's', 16: 'g', 17: 'D', 18: 'e', 19: 'E', 20: 'G',
+    22: 'E',
+    }
+
+#: Sizes of well-known ECC curves by their (encoded) OID
+CURVE_BITS = {
+    b'\x2a\x86\x48\xce\x3d\x03\x01\x07': 256,              # nistp256
+    b'\x2b\x81\x04\x00\x22': 384,                          # nistp384
+    b'\x2b\x81\x04\x00\x23': 521,                          # nistp521
+    b'\x2b\x06\x01\x04\x01\xda\x47\x0f\x01': 255,          # ed25519
+    b'\x2b\x06\x01\x04\x01\x97\x55\x01\x05\x01': 255,      # cv25519
+    }
+
+#: Domain parameters (p, a, b, g, n) of well-known ECC curves by their
+#: (encoded) OID, as hex numbers hashed into keygrips by libgcrypt. `a`
+#: and `b` are absolute values, `g` is the uncompressed base point.
+CURVE_PARAMS = {
+    b'\x2a\x86\x48\xce\x3d\x03\x01\x07': (  # nistp256
+        'ffffffff00000001000000000000000000000000ffffffffffffffffffffffff',
+        'ffffffff00000001000000000000000000000000fffffffffffffffffffffffc',
+        '5ac635d8aa3a93e7b3ebbd55769886bc651d06b0cc53b0f63bce3c3e27d2604b',
+        '04'
+        '6b17d1f2e12c4247f8bce6e563a440f277037d812deb33a0f4a13945d898c296'
+        '4fe342e2fe1a7f9b8ee7eb4a7c0f9e162bce33576b315ececbb6406837bf51f5',
+        'ffffffff00000000ffffffffffffffffbce6faada7179e84f3b9cac2fc632551',
+        ),
+    b'\x2b\x81\x04\x00\x22': (  # nistp384
+        'fffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffe'
+        'ffffffff0000000000000000ffffffff',
+        'fffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffe'
+        'ffffffff0000000000000000fffffffc',
+        'b3312fa7e23ee7e4988e056be3f82d19181d9c6efe8141120314088f5013875a'
+        'c656398d8a2ed19d2a85c8edd3ec2aef',
+        '04'
+        'aa87ca22be8b05378eb1c71ef320ad746e1d3b628ba79b9859f741e082542a38'
+        '5502f25dbf55296c3a545e3872760ab7'
+        '3617de4a96262c6f5d9e98bf9292dc29f8f41dbd289a147ce9da3113b5f0b8c0'
+        '0a60b1ce1d7e819d7a431d7c90ea0e5f',
+        'ffffffffffffffffffffffffffffffffffffffffffffffffc7634d81f4372ddf'
+        '581a0db248b0a77aecec196accc52973',
+        ),
+    b'\x2b\x81\x04\x00\x23': (  # nistp521
+        '01ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff'
+        'ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff'
+        'ffff',
+        '01ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff'
+        'ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff'
+        'fffc',
+        '51953eb9618e1c9a1f929a21a0b68540eea2da725b99b315f3b8b489918ef109'
+        'e156193951ec7e937b1652c0bd3bb1bf073573df883d2c34f1ef451fd46b503f'
+        '00',
+        '04'
+        '00c6858e06b70404e9cd9e3ecb662395b4429c648139053fb521f828af606b4d'
+        '3dbaa14b5e77efe75928fe1dc127a2ffa8de3348b3c1856a429bf97e7e31c2e5'
+        'bd66'
+        '011839296a789a3bc0045c8a5fb42c7d1bd998f54449579b446817afbd17273e'
+        '662c97ee72995ef42640c550b9013fad0761353c7086a272c24088be94769fd1'
+        '6650',
+        '01ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff'
+        'fffa51868783bf2f966b7fcc0148f709a5d03bb5c9b8899c47aebb6fb71e9138'
+        '6409',
+        ),
+    b'\x2b\x06\x01\x04\x01\xda\x47\x0f\x01': (  # ed25519
+        '7fffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffed',
+        '01',
+        '2dfc9311d490018c7338bf8688861767ff8ff5b2bebe27548a14b235eca6874a',
+        '04'
+        '216936d3cd6e53fec0a4e231fdd6dc5c692cc7609525a7b2c9562d608f25d51a'
+        '6666666666666666666666666666666666666666666666666666666666666658',
+        '1000000000000000000000000000000014def9dea2f79cd65812631a5cf5d3ed',
+        ),
+    b'\x2b\x06\x01\x04\x01\x97\x55\x01\x05\x01': (  # cv25519
+        '7fffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffed',
+        '01db41',
+        '01',
+        '04'
+        '0000000000000000000000000000000000000000000000000000000000000009'
+        '20ae19a1b8a086b4e01edd2c7748d14c923d4d7e6d7c61b229e9c5a27eced3d9',
+        '1000000000000000000000000000000014def9dea2f79cd65812631a5cf5d3ed',
+        ),
+    }
+
+#: Names of MPIs hashed into keygrips of DSA and Elgamal keys
+GRIP_MPI_NAMES = {16: 'pgy', 17: 'pqgy', 20: 'pgy'}
+
+#: Marks the begin of ASCII armored data
+ARMOR_BEGIN = b'-----BEGIN PGP '
+
+#: Marks the end of ASCII armored data
+ARMOR_END = b'-----END PGP '
+
+#: Initial value and generator polynomial of armor checksums (CRC24)
+CRC24_INIT = 0xB704CE
+CRC24_POLY = 0x1864CFB
+
+#: A raw packet with its `tag` and binary `body`
+Packet = namedtuple('Packet', ['tag', 'body'])
+
+#: A parsed key packet. `public` is the public part of the key
+#: packet, `mpis` the public key parameters. `is_stub` is true for
+#: secret key packets that contain no secret key material (like the
+#: primary keys exported with ``--export-secret-subkeys``).
+Key = namedtuple('Key', [
+    'tag', 'version', 'created', 'algo', 'bits', 'fingerprint', 'key_id',
+    'public', 'mpis', 'is_stub'])
+
+
+#: Fingerprint, key id, creation time and user ids of a key as found
+#: by :func:`scan_keys`. For primary keys, `subkeys` is a list of
+#: `ScannedKey` tuples (with empty `uids` and `subkeys`).
+ScannedKey = namedtuple('ScannedKey', [
+    'fingerprint', 'key_id', 'created', 'uids', 'subkeys'])
+
+
+class PacketError(ValueError):
+    """Raised if data cannot be parsed as OpenPGP packets.
+    """
+
+
+def _crc24_table():
+    table = []
+    for num in range(256):
+        crc = num << 16
+        for bit in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= CRC24_POLY
+        table.append(crc & 0xFFFFFF)
+    return tuple(table)
+
+
+#: Lookup table for CRC24 computation
+CRC24_TABLE = _crc24_table()
+
+
+def crc24(data, crc=CRC24_INIT):
+    """Compute the CRC24 checksum of `data` as used in ASCII armor.
+
+    Pass the result of a former call as `crc` to update a checksum.
+
+      >>> '%06X' % crc24(b'')
+      'B704CE'
+      >>> '%06X' % crc24(b'ab', crc24(b'c'))  == '%06X' % crc24(b'cab')
+      True
+
+    """
+    table = CRC24_TABLE
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xFFFFFF) ^ table[((crc >> 16) ^ byte) & 0xFF]
+    return crc
+
+
+def is_armored(data):
+    """Tell whether `data` (bytes) is ASCII armored.
+    """
+    return bytes(data[:64]).lstrip().startswith(ARMOR_BEGIN)
+
+
+class BufferReader(object):
+    """Minimal file-like object reading from a bytes-like `buffer`.
+
+    Unlike `io.BytesIO` this does not copy `buffer` (which could be a
+    memoryview of a memory mapped file). Only data actually read is
+    copied.
+    """
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def read(self, size=-1):
+        end = len(self._view)
+        if size is not None and size >= 0:
+            end = min(self._pos + size, end)
+        data = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return data
+
+
+class ArmorReader(object):
+    """File-like object reading binary data from ASCII armored `fp`.
+
+    The armored data is decoded incrementally, line by line. Only the
+    first armored block is read. The checksum is verified when the end
+    of the armored block is reached. Raises :exc:`PacketError` if data
+    is not properly armored.
+    """
+
+    def __init__(self, fp):
+        self._fp = fp
+        self._pending = b''
+        self._buffer = b''
+        self._crc = CRC24_INIT
+        self._done = False
+        for line in self._lines():         # skip to armor header
+            if line.startswith(ARMOR_BEGIN):
+                break
+        else:
+            raise PacketError('No ASCII armored data found')
+        for line in self._lines():         # skip armor headers
+            if not line:
+                break
+
+    def _lines(self):
+        while True:
+            while b'\n' not in self._pending:
+                chunk = self._fp.read(4096)
+                if not chunk:
+                    if self._pending:
+                        line, self._pending = self._pending, b''
+                        yield line.strip()
+                    return
+                self._pending += chunk
+            line, self._pending = self._pending.split(b'\n', 1)
+            yield line.strip()
+
+    def _decode_line(self):
+        for line in self._lines():
+            if line.startswith(ARMOR_END):
+                break
+            if line.startswith(b'='):
+                checksum = base64.b64decode(line[1:])
+                if checksum != struct.pack('>I', self._crc)[1:]:
+                    raise PacketError('Armor checksum mismatch')
+                continue
+            try:
+                data = base64.b64decode(line)
+            except (binascii.Error, TypeError):
+                raise PacketError('Invalid armor line: %r' % line)
+            self._crc = crc24(data, self._crc)
+            return data
+        else:
+            raise PacketError('Missing armor footer')
+        self._done = True
+        return b''
+
+    def read(self, size=-1):
+        while not self._done and (
+                size is None or size < 0 or len(self._buffer) < size):
+            self._buffer += self._decode_line()
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def enarmor(data, block_type='PUBLIC KEY BLOCK'):
+    """ASCII armor binary `data`.
+
+    `block_type` is the text used in armor header and footer, like
+    ``'PUBLIC KEY BLOCK'`` or ``'PRIVATE KEY BLOCK'``.
+
+      >>> print(enarmor(b'\\xcd\\x03bob').decode('ascii'))
+      -----BEGIN PGP PUBLIC KEY BLOCK-----
+      <BLANKLINE>
+      zQNib2I=
+      =slKg
+      -----END PGP PUBLIC KEY BLOCK-----
+      <BLANKLINE>
+
+    """
+    data = bytes(data)
+    block_type = block_type.encode('ascii')
+    lines = [ARMOR_BEGIN + block_type + b'-----', b'']
+    for pos in range(0, len(data), 48):
+        lines.append(base64.b64encode(data[pos:pos + 48]))
+    lines.append(b'=' + base64.b64encode(struct.pack('>I', crc24(data))[1:]))
+    lines.append(ARMOR_END + block_type + b'-----')
+    return b'\n'.join(lines) + b'\n'
+
+
+def open_packet_data(data):
+    """Get a file-like object for reading binary packets from `data`.
+
+    `data` can be binary or ASCII armored, given as bytes-like object.
+    """
+    if is_armored(data):
+        return ArmorReader(BufferReader(data))
+    return BufferReader(data)
+
+
+def _read(fp, size):
+    data = fp.read(size)
+    if len(data) != size:
+        raise PacketError('Unexpected end of packet data')
+    return data
+
+
+def read_packet_header(fp):
+    """Read a packet header from file-like `fp`.
+
+    Returns a tuple (`tag`, `length`, `partial`) where `length` is
+    ``None`` for packets of indeterminate length and `partial` tells
+    whether `length` is only the length of a first partial body. At
+    end of data we return ``None``.
+    """
+    first = fp.read(1)
+    if not first:
+        return None
+    octet = ord(first)
+    if not octet & 0x80:
+        raise PacketError('Not an OpenPGP packet header: %r' % first)
+    if octet & 0x40:                # new format
+        tag = octet & 0x3f
+        length, partial = read_new_length(fp)
+        return tag, length, partial
+    tag = (octet >> 2) & 0x0f       # old format
+    length_type = octet & 0x03
+    if length_type == 3:
+        return tag, None, False
+    size = (1, 2, 4)[length_type]
+    length = struct.unpack('>' + ' BH I'[size], _read(fp, size))[0]
+    return tag, length, False
+
+
+def read_new_length(fp):
+    """Read a new format packet length from `fp`.
+
+    Returns a tuple (`length`, `partial`).
+    """
+    octet = ord(_read(fp, 1))
+    if octet < 192:
+        return octet, False
+    if octet < 224:
+        return ((octet - 192) << 8) + ord(_read(fp, 1)) + 192, False
+    if octet == 255:
+        return struct.unpack('>I', _read(fp, 4))[0], False
+    return 1 << (octet & 0x1f), True
+
+
+def iter_packets(fp):
+    """Iterate over the OpenPGP packets in file-like `fp`.
+
+    Yields :data:`Packet` tuples. `fp` is read sequentially, only one
+    packet is held in memory at a time.
+    """
+    while True:
+        header = read_packet_header(fp)
+        if header is None:
+            return
+        tag, length, partial = header
+        if length is None:
+            yield Packet(tag, fp.read())
+            return
+        parts = [_read(fp, length)]
+        while partial:
+            length, partial = read_new_length(fp)
+            parts.append(_read(fp, length))
+        yield Packet(tag, b''.join(parts))
+
+
+def iter_keyblocks(packets):
+    """Group `packets` into key blocks.
+
+    Yields lists of packets, each starting with a primary key
+    packet. Packets before the first primary key are ignored.
+    """
+    block = None
+    for packet in packets:
+        if packet.tag in PRIMARY_KEY_TAGS:
+            if block:
+                yield block
+            block = []
+        if block is not None:
+            block.append(packet)
+    if block:
+        yield block
+
+
+def _read_mpi(data, pos):
+    bits = struct.unpack('>H', data[pos:pos + 2])[0]
+    end = pos + 2 + (bits + 7) // 8
+    if end > len(data):
+        raise PacketError('Truncated MPI')
+    return data[pos + 2:end], bits, end
+
+
+def parse_key(packet):
+    """Parse key packet `packet` into a :data:`Key`.
+
+    Only v3 and v4 keys are supported. Raises :exc:`PacketError` for
+    other keys or malformed packets.
+    """
+    body = packet.body
+    if len(body) < 6:
+        raise PacketError('Key packet too short')
+    version = ord(body[0:1])
+    if version not in (3, 4):
+        raise PacketError('Unsupported key version: %s' % version)
+    created = struct.unpack('>I', body[1:5])[0]
+    pos = (version == 3) and 8 or 6
+    algo = ord(body[pos - 1:pos])
+    mpis, bits = [], 0
+    if algo in ALGO_NUM_MPIS:
+        for num in range(ALGO_NUM_MPIS[algo]):
+            mpi, mpi_bits, pos = _read_mpi(body, pos)
+            mpis.append(mpi)
+            bits = bits or mpi_bits
+    elif algo in ECC_ALGOS:
+        oid_len = ord(body[pos:pos + 1])
+        oid = body[pos + 1:pos + 1 + oid_len]
+        point, point_bits, pos = _read_mpi(body, pos + 1 + oid_len)
+        mpis = [oid, point]
+        if algo == 18:                     # ECDH KDF parameters
+            kdf_len = ord(body[pos:pos + 1])
+            mpis.append(body[pos + 1:pos + 1 + kdf_len])
+            pos += 1 + kdf_len
+        bits = CURVE_BITS.get(oid, point_bits)
+    else:
+        raise PacketError('Unsupported public key algorithm: %s' % algo)
+    public = body[:pos]
+    if version == 4:
+        fingerprint = hashlib.sha1(
+            b'\x99' + struct.pack('>H', len(public)) + public).hexdigest()
+        key_id = fingerprint[-16:]
+    else:
+        fingerprint = hashlib.md5(b''.join(mpis)).hexdigest()
+        key_id = ''.join(['%02x' % x for x in bytearray(mpis[0][-8:])])
+    is_stub = False
+    if packet.tag in SECRET_KEY_TAGS:
+        is_stub = is_gnu_dummy(body[pos:])
+    return Key(
+        tag=packet.tag, version=version, created=created, algo=algo,
+        bits=bits, fingerprint=fingerprint.upper(), key_id=key_id.upper(),
+        public=public, mpis=mpis, is_stub=is_stub)
+
+
+def is_gnu_dummy(secret_part):
+    """Tell whether `secret_part` of a secret key packet is a stub.
+
+    GnuPG marks secret keys without secret key material by the
+    (private) S2K mode 101 'GNU' extension 1 ("gnu-dummy").
+    """
+    data = bytearray(secret_part)
+    if not data or data[0] not in (254, 255):
+        return False
+    # usage(1), cipher(1), s2k type(1), hash(1), 'GNU'(3), mode(1)
+    return len(data) >= 8 and data[2] == 101 and (
+        bytes(data[4:7]) == b'GNU' and data[7] == 1)
+
+
+def parse_user_id(packet):
+    """Get the user id of user id packet `packet` as text.
+    """
+    return packet.body.decode('utf-8', 'replace')
+
+
+def _signed(mpi):
+    # `mpi` as signed number (with leading zero if the high bit is set)
+    if bytearray(mpi[:1])[0] & 0x80:
+        return b'\x00' + mpi
+    return mpi
+
+
+def _grip_param(name, value):
+    # a named keygrip parameter in canonical S-expression format
+    return ('(1:%s%d:' % (name, len(value))).encode('ascii') + value + b')'
+
+
+def get_keygrip(key):
+    """Get the keygrip of `key` as used by gpg-agent.
+
+    Keygrips are the names of files in `private-keys-v1.d` (without
+    filename extension). Supported are RSA, DSA and Elgamal keys and
+    ECC keys on curves in :data:`CURVE_PARAMS`. For other keys we
+    return ``None``.
+    """
+    if key.algo in (1, 2, 3):
+        return hashlib.sha1(_signed(key.mpis[0])).hexdigest().upper()
+    if key.algo in GRIP_MPI_NAMES:
+        data = b''.join([_grip_param(name, _signed(mpi)) for name, mpi in zip(
+            GRIP_MPI_NAMES[key.algo], key.mpis)])
+    elif key.algo in ECC_ALGOS and key.mpis[0] in CURVE_PARAMS:
+        params = [binascii.unhexlify(x) for x in CURVE_PARAMS[key.mpis[0]]]
+        point = key.mpis[1]
+        if point[:1] == b'\x40':          # native (25519) point format
+            point = point[1:]
+        data = b''.join([_grip_param(name, value) for name, value in zip(
+            'pabgnq', params + [point])])
+    else:
+        return None
+    return hashlib.sha1(data).hexdigest().upper()
+
+
+def scan_keys(data):
+    """Scan `data` (binary or ASCII armored keys) for keys.
+
+    Returns a list of :data:`ScannedKey` tuples, one for each primary
+    key found. Packets are read one at a time, so only little memory
+    is needed even for big key blocks.
+    """
+    result = []
+    for packet in iter_packets(open_packet_data(data)):
+        if packet.tag in KEY_TAGS:
+            key = parse_key(packet)
+            scanned = ScannedKey(
+                key.fingerprint, key.key_id, key.created, [], [])
+            if packet.tag in PRIMARY_KEY_TAGS:
+                result.append(scanned)
+            elif result:
+                result[-1].subkeys.append(scanned)
+        elif packet.tag == TAG_USER_ID and result:
+            result[-1].uids.append(parse_user_id(packet))
+    return result
@@ -0,0 +1,129 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Parallel gzip compression.
+
+ Works like `pigz`: input is split into blocks, which are deflated
+ independently by a pool of threads. Each block is primed with the
+ last 32 KiB of the preceding block and ended with a sync flush, so
+ that the concatenated blocks form a single valid deflate stream.
+ The result is a regular gzip file.
+"""
+import struct
+import time
+import zlib
+from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+#: Size of uncompressed blocks compressed in one go
+BLOCK_SIZE = 128 * 1024
+
+#: Size of dictionary passed from one block to the next
+DICT_SIZE = 32 * 1024
+
+
+def compress_block(block, dictionary, level, last):
+    """Deflate `block` (raw deflate, no headers).
+
+    `dictionary` is the data preceding `block` (or ``b''``). Unless
+    `last` is set, the compressed block ends with a sync flush and
+    can be followed by other blocks.
+    """
+    args = [level, zlib.DEFLATED, -zlib.MAX_WBITS, 9, zlib.Z_DEFAULT_STRATEGY]
+    if dictionary:
+        args.append(dictionary)
+    compressor = zlib.compressobj(*args)
+    flush_mode = last and zlib.Z_FINISH or zlib.Z_SYNC_FLUSH
+    return compressor.compress(block) + compressor.flush(flush_mode)
+
+
+class ParallelGzipFile(object):
+    """A write-only file-like object creating gzip data in `fileobj`.
+
+    Compression is done by `threads` threads (default: number of
+    CPUs). `mtime` is the timestamp written into the gzip header
+    (default: current time).
+
+    Call `close()` to write remaining data. `fileobj` is not closed.
+    """
+
+    def __init__(self, fileobj, compresslevel=9, threads=None, mtime=None,
+                 block_size=BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.threads = threads or cpu_count()
+        self.block_size = block_size
+        self.closed = False
+        self._pool = ThreadPool(self.threads)
+        self._pending = deque()
+        self._chunks, self._buffered = [], 0
+        self._dictionary = b''
+        self._crc = zlib.crc32(b'')
+        self._size = 0
+        if mtime is None:
+            mtime = time.time()
+        self.fileobj.write(
+            b'\x1f\x8b\x08\x00' + struct.pack('<I', int(mtime)) +
+            b'\x02\xff')
+
+    def _submit(self, block, last=False):
+        self._pending.append(self._pool.apply_async(
+            compress_block,
+            (block, self._dictionary, self.compresslevel, last)))
+        self._dictionary = block[-DICT_SIZE:]
+        # keep memory bounded: write out finished blocks in order
+        while len(self._pending) > 2 * self.threads:
+            self.fileobj.write(self._pending.popleft().get())
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed file')
+        data = bytes(data)
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._chunks.append(data)
+        self._buffered += len(data)
+        if self._buffered < self.block_size:
+            return len(data)
+        buffer = b''.join(self._chunks)
+        while len(buffer) >= self.block_size:
+            self._submit(buffer[:self.block_size])
+            buffer = buffer[self.block_size:]
+        self._chunks, self._buffered = [buffer], len(buffer)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self._submit(b''.join(self._chunks), last=True)
+        self._chunks, self._buffered = [], 0
+        try:
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().get())
+        finally:
+            self._pool.close()
+            self._pool.join()
+        self.fileobj.write(struct.pack(
+            '<II', self._crc & 0xffffffff, self._size & 0xffffffff))
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,278 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Estimate size and duration of exports without running them.
+
+ Sizes of exported keys are estimated from key listings (key sizes,
+ number of user ids and subkeys), archive sizes from typical
+ compression ratios. Durations are predicted from the summaries of
+ former runs of `gpg-export-homes` (``summary.json``), which also
+ calibrate the size estimates. Durations of importing the exported
+ keys again are predicted from summaries of bulk imports written by
+ `gpg-import-master-key --summary`.
+"""
+from __future__ import print_function
+import heapq
+import json
+import re
+from multiprocessing import cpu_count
+
+#: Bytes added to each packet by its header
+PACKET_HEADER = 3
+
+#: Bytes of a v4 key packet besides the key material
+KEY_OVERHEAD = 13
+
+#: Bytes of a user id self-signature besides the signature MPI
+UID_SIG_OVERHEAD = 56
+
+#: Bytes of a subkey binding signature besides the signature MPI
+SUBKEY_SIG_OVERHEAD = 31
+
+#: Bytes added to secret key packets by S2K specifiers and checksums
+SECRET_OVERHEAD = 50
+
+#: Bytes added to stubs (secret key packets without secret key)
+STUB_OVERHEAD = 8
+
+#: Bytes added by armor headers, footers and checksums per member
+ARMOR_OVERHEAD = 110
+
+#: Size of compressed archives relative to the size of their members
+COMPRESSION_RATIOS = {'armor': 0.51, 'binary': 0.48}
+
+#: Bytes added to compressed archives by tar headers and the manifest
+ARCHIVE_OVERHEAD = 300
+
+#: Seconds needed per key exported if there is no history
+DEFAULT_SECONDS_PER_KEY = 0.5
+
+#: Seconds needed per key imported in bulk mode if there is no history
+DEFAULT_IMPORT_SECONDS_PER_KEY = 0.2
+
+#: Seconds needed for the trustdb check after bulk imports
+DEFAULT_TRUSTDB_SECONDS = 1.0
+
+#: Key size and algorithm letter in key infos like 'sec   2048R/DAA011C5'
+RE_KEY_SIZE = re.compile(r'\s(\d+)([A-Za-z])/')
+
+
+def get_key_size(info):
+    """Get (bits, algorithm letter) from key list entry info `info`.
+
+      >>> get_key_size('sec   2048R/DAA011C5 2015-01-06')
+      (2048, 'R')
+
+    Unknown sizes are reported as 2048 bit RSA keys.
+    """
+    match = RE_KEY_SIZE.search(info or '')
+    if match is None:
+        return 2048, 'R'
+    return int(match.group(1)), match.group(2)
+
+
+def estimate_members(record):
+    """Estimate the sizes of keys exported for key list entry `record`.
+
+    `record` is a `records.KeyRecord`. Returns a dict mapping member
+    types (``'pub'``, ``'priv'`` and ``'subkeys'``) to the sizes of
+    binary exports. Subkeys are assumed to be of the same size as the
+    primary key.
+    """
+    uids, info = record[0], record[1]
+    bits, algo = get_key_size(info)
+    size = (bits + 7) // 8
+    public = size + KEY_OVERHEAD + PACKET_HEADER
+    if algo in 'RrsDgG':
+        secret = public + size * 5 // 2 + SECRET_OVERHEAD
+    else:                                  # ECC keys have small secrets
+        secret = public + size + SECRET_OVERHEAD
+    stub = public + STUB_OVERHEAD
+    uid_block = sum([
+        len(uid.encode('utf-8')) + size + UID_SIG_OVERHEAD +
+        2 * PACKET_HEADER for uid in uids])
+    sig = size + SUBKEY_SIG_OVERHEAD + PACKET_HEADER
+    num_subkeys = len(getattr(record, 'subkeys', ()))
+    primary = info.startswith('sec#') and stub or secret
+    return dict(
+        pub=public + uid_block + num_subkeys * (public + sig),
+        priv=primary + uid_block + num_subkeys * (secret + sig),
+        subkeys=stub + uid_block + num_subkeys * (secret + sig))
+
+
+def estimate_archive_sizes(record, size_factor=1.0):
+    """Estimate the sizes of archives exported for `record`.
+
+    Returns a dict mapping formats (``'armor'`` and ``'binary'``) to
+    archive sizes in bytes, multiplied by `size_factor`.
+    """
+    members = estimate_members(record).values()
+    binary = sum(members)
+    armored = sum([
+        x * 4 * 65 // (3 * 64) + ARMOR_OVERHEAD for x in members])
+    return dict([
+        (name, int((value * COMPRESSION_RATIOS[name] + ARCHIVE_OVERHEAD) *
+                   size_factor))
+        for name, value in (('armor', armored), ('binary', binary))])
+
+
+def load_history(paths):
+    """Load results of former runs from summary files at `paths`.
+
+    Returns a list of home results as stored by `gpg-export-homes`
+    and bulk import timings as stored by `gpg-import-master-key`.
+    Missing or unreadable files are skipped.
+    """
+    result = []
+    for path in paths:
+        try:
+            with open(path) as fd:
+                summary = json.load(fd)
+            result.extend(summary.get('homes', []))
+            result.extend(summary.get('imports', []))
+        except (IOError, OSError, ValueError):
+            continue
+    return result
+
+
+def get_rates(history):
+    """Get rates to estimate exports with from `history`.
+
+    `history` is a list of home results and import timings (see
+    :func:`load_history`). Returns a dict with `seconds_per_key` and
+    `size_factor`, the ratio of real and estimated archive sizes, and
+    the number of `homes` the rates are based on. For imports, the
+    dict contains `import_seconds_per_key`, the `trustdb_seconds` of a
+    single trustdb check and the number of bulk `imports` these are
+    based on. Without usable history, defaults are returned.
+    """
+    keys = seconds = real_bytes = estimated_bytes = homes = 0
+    sources = import_seconds = trustdb_seconds = imports = 0
+    for home in history:
+        if 'import_seconds' in home:
+            if home.get('sources'):
+                imports += 1
+                sources += home['sources']
+                import_seconds += home['import_seconds']
+                trustdb_seconds += home.get('trustdb_seconds', 0.0)
+            continue
+        if not home.get('exported') or home.get('failures'):
+            continue
+        homes += 1
+        keys += len(home['exported'])
+        seconds += home.get('seconds', 0.0)
+        if home.get('bytes') and home.get('estimated_bytes'):
+            real_bytes += home['bytes']
+            estimated_bytes += home['estimated_bytes']
+    return dict(
+        seconds_per_key=keys and seconds / keys or DEFAULT_SECONDS_PER_KEY,
+        size_factor=(estimated_bytes and float(real_bytes) / estimated_bytes
+                     or 1.0),
+        homes=homes,
+        import_seconds_per_key=(
+            sources and import_seconds / sources or
+            DEFAULT_IMPORT_SECONDS_PER_KEY),
+        trustdb_seconds=(
+            imports and trustdb_seconds / imports or DEFAULT_TRUSTDB_SECONDS),
+        imports=imports)
+
+
+def schedule_jobs(durations, jobs=None):
+    """Schedule tasks lasting `durations` seconds on `jobs` workers.
+
+    Tasks are started in order, each as soon as a worker is free (like
+    `multiprocessing.Pool` does). Returns a list of (`job`, `start`,
+    `end`) tuples in order of `durations`, jobs are numbered from 1.
+
+      >>> schedule_jobs([3, 1, 1, 2], jobs=2)
+      [(1, 0, 3), (2, 0, 1), (2, 1, 2), (2, 2, 4)]
+
+    """
+    workers = [(0, num + 1) for num in range(jobs or cpu_count())]
+    result = []
+    for duration in durations:
+        start, job = heapq.heappop(workers)
+        result.append((job, start, start + duration))
+        heapq.heappush(workers, (start + duration, job))
+    return result
+
+
+def plan_exports(listings, jobs=None, history=None):
+    """Plan the export of all keys in `listings`.
+
+    `listings` is a list of (`home`, `key_list`) tuples, `key_list`
+    being a list of `records.KeyRecord`. `jobs` is the number of
+    homes exported in parallel, `history` a list of home results of
+    former runs (see :func:`load_history`).
+
+    Returns a dict with the `rates` used (see :func:`get_rates`), the
+    planned `homes` and the total estimated `seconds` and `sizes`.
+    `import_seconds` is the estimated time needed to import all keys
+    in bulk mode, including a single trustdb check.
+    Each home is a dict with `home`, `keys` (tuples of key id, first
+    uid and archive sizes), `sizes`, `seconds` and its `schedule`
+    (job, start, end).
+    """
+    rates = get_rates(history or [])
+    homes, totals = [], dict(armor=0, binary=0)
+    for home, key_list in listings:
+        keys, sizes = [], dict(armor=0, binary=0)
+        for record in key_list:
+            archive_sizes = estimate_archive_sizes(
+                record, rates['size_factor'])
+            keys.append((record[2], (list(record[0]) + [''])[0],
+                         archive_sizes))
+            for name, value in archive_sizes.items():
+                sizes[name] += value
+                totals[name] += value
+        homes.append(dict(
+            home=home, keys=keys, sizes=sizes,
+            seconds=len(keys) * rates['seconds_per_key']))
+    schedule = schedule_jobs([x['seconds'] for x in homes], jobs)
+    for home, slot in zip(homes, schedule):
+        home['schedule'] = slot
+    num_keys = sum([len(x['keys']) for x in homes])
+    return dict(
+        rates=rates, homes=homes, sizes=totals,
+        seconds=max([x[2] for x in schedule] or [0]),
+        import_seconds=(num_keys * rates['import_seconds_per_key'] +
+                        rates['trustdb_seconds']))
+
+
+def output_plan(plan):
+    """Print `plan` as returned by :func:`plan_exports`.
+    """
+    for home in plan['homes']:
+        job, start, end = home['schedule']
+        print("%-40s %3d keys %10d bytes (%d binary) job %d %8.2fs-%.2fs" % (
+            home['home'], len(home['keys']), home['sizes']['armor'],
+            home['sizes']['binary'], job, start, end))
+        for key, uid, sizes in home['keys']:
+            print("    %s %8d bytes (%d binary) %s" % (
+                key, sizes['armor'], sizes['binary'], uid))
+    rates = plan['rates']
+    print("%d homes, %d keys, %d bytes (%d binary) in %.2fs" % (
+        len(plan['homes']), sum([len(x['keys']) for x in plan['homes']]),
+        plan['sizes']['armor'], plan['sizes']['binary'], plan['seconds']))
+    print("Based on %.2fs per key and size factor %.2f from %d homes "
+          "exported before" % (
+              rates['seconds_per_key'], rates['size_factor'],
+              rates['homes']))
+    print("Bulk import would take %.2fs, based on %.2fs per key and "
+          "%.2fs for the trustdb check from %d imports before" % (
+              plan['import_seconds'], rates['import_seconds_per_key'],
+              rates['trustdb_seconds'], rates['imports']))
@@ -0,0 +1,211 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Compact records for key listings.
+
+ Key lists (as returned by `export_master_key.get_key_list()`) used to
+ be lists of ``(uids, info, key)`` tuples. :class:`KeyRecord` still
+ behaves like such a tuple, but needs less memory, sorts by a cheap,
+ stable key and carries fingerprints and subkeys. :class:`KeyTable`
+ stores complete listings column by column.
+"""
+import sys
+from array import array
+
+if sys.version_info >= (3, ):
+    intern = sys.intern
+
+
+class KeyRecord(object):
+    """A secret key as listed by gpg.
+
+    `uids` is a tuple of user ids, `info` a text describing the key
+    (like ``'sec   2048R/DAA011C5 2015-01-06'``) and `key_id` the short
+    key id (8 hex digits). `fingerprint` (if known) is the complete
+    fingerprint and `subkeys` a tuple of the key ids of subkeys.
+
+    Records can be used like ``(uids, info, key_id)`` tuples, which is
+    the format of key lists used by former versions:
+
+      >>> record = KeyRecord(['Bob'], 'sec   2048R/DAA011C5', 'DAA011C5')
+      >>> uids, info, key = record
+      >>> uids, record[2]
+      (['Bob'], 'DAA011C5')
+      >>> record == (['Bob'], 'sec   2048R/DAA011C5', 'DAA011C5')
+      True
+
+    Records equal to tuples hash like them, if the tuples are hashable
+    (i.e. `uids` is a tuple as well).
+    """
+    __slots__ = ('uids', 'info', 'key_id', 'fingerprint', 'subkeys')
+
+    #: Attributes returned for tuple indexes
+    _fields = ('uids', 'info', 'key_id')
+
+    def __init__(self, uids, info, key_id, fingerprint=None, subkeys=()):
+        self.uids = tuple([intern(x) for x in uids])
+        self.info = info
+        self.key_id = key_id
+        self.fingerprint = fingerprint
+        self.subkeys = tuple(subkeys)
+
+    def as_tuple(self):
+        """Get record as ``(uids, info, key_id)`` tuple.
+
+        `uids` is a list.
+        """
+        return (list(self.uids), self.info, self.key_id)
+
+    def sort_key(self):
+        """Get a key to sort records by.
+
+        That is the first uid and the key id. Records without uids come
+        first.
+        """
+        return (self.uids and self.uids[0] or '', self.key_id)
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, num):
+        if isinstance(num, slice):
+            return self.as_tuple()[num]
+        name = self._fields[num]
+        if name == 'uids':
+            return list(self.uids)
+        return getattr(self, name)
+
+    def __eq__(self, other):
+        if isinstance(other, KeyRecord):
+            return (self.uids == other.uids and self.info == other.info and
+                    self.key_id == other.key_id and
+                    self.fingerprint == other.fingerprint and
+                    self.subkeys == other.subkeys)
+        if not isinstance(other, (tuple, list)) or len(other) != 3:
+            return False
+        return (self.uids, self.info, self.key_id) == (
+            tuple(other[0]), other[1], other[2])
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self.sort_key() < other.sort_key()
+
+    def __hash__(self):
+        return hash((self.uids, self.info, self.key_id))
+
+    def __repr__(self):
+        return 'KeyRecord(%r, %r, %r, fingerprint=%r, subkeys=%r)' % (
+            list(self.uids), self.info, self.key_id, self.fingerprint,
+            list(self.subkeys))
+
+
+def sort_records(records):
+    """Get a list of `records` sorted by their sort keys.
+    """
+    return sorted(records, key=KeyRecord.sort_key)
+
+
+class KeyTable(object):
+    """A read-only list of key records, stored as columns.
+
+    Uids and subkey ids of all keys are stored in flat lists, with
+    the start of each key's entries kept in arrays of offsets. Records
+    are created on access. Use it for huge listings::
+
+      >>> table = KeyTable([
+      ...     KeyRecord(['Bob', 'Bobby'], 'info', 'DAA011C5',
+      ...               subkeys=['75DD62A6'])])
+      >>> len(table), table[0].uids, table[0].subkeys
+      (1, ('Bob', 'Bobby'), ('75DD62A6',))
+      >>> list(table) == [(['Bob', 'Bobby'], 'info', 'DAA011C5')]
+      True
+
+    """
+
+    def __init__(self, records=()):
+        self.infos, self.key_ids, self.fingerprints = [], [], []
+        self.uids, self.uid_offsets = [], array('L', [0])
+        self.subkeys, self.subkey_offsets = [], array('L', [0])
+        for record in records:
+            self.append(record)
+
+    def append(self, record):
+        """Append `record` (a :class:`KeyRecord`) to the table.
+        """
+        self.add(record.uids, record.info, record.key_id,
+                 record.fingerprint, record.subkeys)
+
+    def add(self, uids, info, key_id, fingerprint=None, subkeys=()):
+        """Append a key with the fields given to the table.
+
+        Same as :meth:`append`, but no record is created.
+        """
+        self.infos.append(info)
+        self.key_ids.append(key_id)
+        self.fingerprints.append(fingerprint)
+        self.uids.extend([intern(x) for x in uids])
+        self.uid_offsets.append(len(self.uids))
+        self.subkeys.extend(subkeys)
+        self.subkey_offsets.append(len(self.subkeys))
+
+    def sort_key(self, num):
+        """Get the sort key of entry `num` (see `KeyRecord.sort_key()`).
+        """
+        start, end = self.uid_offsets[num], self.uid_offsets[num + 1]
+        return (start < end and self.uids[start] or '', self.key_ids[num])
+
+    def sort(self):
+        """Sort entries in place by first uid and key id.
+        """
+        order = sorted(range(len(self)), key=self.sort_key)
+        uids, uid_offsets = [], array('L', [0])
+        subkeys, subkey_offsets = [], array('L', [0])
+        for num in order:
+            uids.extend(
+                self.uids[self.uid_offsets[num]:self.uid_offsets[num + 1]])
+            uid_offsets.append(len(uids))
+            subkeys.extend(self.subkeys[
+                self.subkey_offsets[num]:self.subkey_offsets[num + 1]])
+            subkey_offsets.append(len(subkeys))
+        self.uids, self.uid_offsets = uids, uid_offsets
+        self.subkeys, self.subkey_offsets = subkeys, subkey_offsets
+        self.infos = [self.infos[num] for num in order]
+        self.key_ids = [self.key_ids[num] for num in order]
+        self.fingerprints = [self.fingerprints[num] for num in order]
+
+    def __len__(self):
+        return len(self.key_ids)
+
+    def __getitem__(self, num):
+        if num < 0:
+            num += len(self)
+        if not 0 <= num < len(self):
+            raise IndexError('KeyTable index out of range')
+        return KeyRecord(
+            self.uids[self.uid_offsets[num]:self.uid_offsets[num + 1]],
+            self.infos[num], self.key_ids[num], self.fingerprints[num],
+            self.subkeys[
+                self.subkey_offsets[num]:self.subkey_offsets[num + 1]])
+
+    def __iter__(self):
+        for num in range(len(self)):
+            yield self[num]
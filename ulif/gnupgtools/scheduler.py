@@ -0,0 +1,249 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Schedule concurrent gpg operations without fighting for keyring locks.
+
+ Operations are classified per GnuPG home as readers (listing,
+ exporting) or writers (importing). Readers of a home run
+ concurrently, writers run one at a time and only while no reader is
+ active. Imports queued for the same home are coalesced into a single
+ gpg call per key format.
+
+ Example::
+
+   with KeyringScheduler(threads=4) as scheduler:
+       results = [scheduler.import_archive(path, homedir=home)
+                  for path in paths]
+       for result in results:
+           print(result.get().counts)
+
+"""
+import os
+import threading
+from multiprocessing import cpu_count, TimeoutError
+from multiprocessing.pool import ThreadPool
+from ulif.gnupgtools.export_master_key import get_key_list, export_keys
+from ulif.gnupgtools.import_master_key import keys_from_arch, verify_keys
+from ulif.gnupgtools.keyring import get_gnupg_home
+from ulif.gnupgtools.status import ImportResult
+from ulif.gnupgtools.utils import execute
+
+
+class ReadWriteLock(object):
+    """A lock that can be held by many readers or a single writer.
+
+    Writers are preferred: once a writer waits, no new readers are
+    let in.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+
+    def release_write(self):
+        with self._cond:
+            self._writing = False
+            self._cond.notify_all()
+
+
+class PendingResult(object):
+    """The result of a queued operation.
+
+    Works like `multiprocessing.pool.AsyncResult`.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+
+    def set(self, value=None, error=None):
+        self._value, self._error = value, error
+        self._event.set()
+
+    def ready(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+
+    def get(self, timeout=None):
+        """Get the result, raising any exception raised while computing it.
+        """
+        if not self._event.wait(timeout):
+            raise TimeoutError('Result not ready yet')
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class KeyringScheduler(object):
+    """Run operations on GnuPG homes in a pool of `threads` threads.
+
+    `executable` is the gpg binary used for imports. gpg calls running
+    longer than `timeout` seconds are aborted.
+
+    All `submit_*` and convenience methods return immediately with an
+    object providing `get()` to wait for the result.
+    """
+
+    def __init__(self, threads=None, executable='gpg', timeout=None):
+        self.executable = executable
+        self.timeout = timeout
+        self._pool = ThreadPool(threads or cpu_count())
+        self._lock = threading.Lock()
+        self._home_locks = dict()
+        self._import_queues = dict()
+
+    def _home_key(self, homedir):
+        return os.path.abspath(get_gnupg_home(homedir))
+
+    def home_lock(self, homedir):
+        """Get the :class:`ReadWriteLock` of GnuPG home `homedir`.
+        """
+        key = self._home_key(homedir)
+        with self._lock:
+            return self._home_locks.setdefault(key, ReadWriteLock())
+
+    def _run_read(self, lock, func, args, kw):
+        lock.acquire_read()
+        try:
+            return func(*args, **kw)
+        finally:
+            lock.release_read()
+
+    def _run_write(self, lock, func, args, kw):
+        lock.acquire_write()
+        try:
+            return func(*args, **kw)
+        finally:
+            lock.release_write()
+
+    def submit_reader(self, home, func, *args, **kw):
+        """Run `func(*args, **kw)` as reader of GnuPG home `home`.
+        """
+        return self._pool.apply_async(
+            self._run_read, (self.home_lock(home), func, args, kw))
+
+    def submit_writer(self, home, func, *args, **kw):
+        """Run `func(*args, **kw)` as writer of GnuPG home `home`.
+        """
+        return self._pool.apply_async(
+            self._run_write, (self.home_lock(home), func, args, kw))
+
+    def list_keys(self, homedir=None, gnupg_path='gpg', native=False):
+        """List secret keys of `homedir` (see `get_key_list()`).
+        """
+        return self.submit_reader(
+            homedir, get_key_list, gnupg_path=gnupg_path, native=native,
+            homedir=homedir, timeout=self.timeout)
+
+    def export_keys(self, hex_id, homedir=None, **kw):
+        """Export key `hex_id` of `homedir` (see `export_keys()`).
+        """
+        kw.setdefault('timeout', self.timeout)
+        return self.submit_reader(
+            homedir, export_keys, hex_id, homedir=homedir, **kw)
+
+    def import_keys(self, keys_dict, homedir=None):
+        """Queue keys from `keys_dict` for import into `homedir`.
+
+        `keys_dict` must be a dict as returned by
+        `import_master_key.keys_from_members()`. Keys are verified
+        immediately, `ValueError` is raised for invalid keys.
+
+        Imports queued for the same home before the import starts are
+        coalesced into one gpg call per key format. The result is an
+        `status.ImportResult` covering all keys imported together.
+        """
+        verify_keys(keys_dict)
+        pending = PendingResult()
+        key = self._home_key(homedir)
+        with self._lock:
+            queue = self._import_queues.get(key)
+            start = queue is None
+            if start:
+                queue = self._import_queues[key] = []
+            queue.append((keys_dict, pending))
+        if start:
+            self.submit_writer(homedir, self._flush_imports, key, homedir)
+        return pending
+
+    def import_archive(self, path, homedir=None):
+        """Queue keys from archive at `path` for import into `homedir`.
+
+        See :meth:`import_keys`.
+        """
+        return self.import_keys(keys_from_arch(path), homedir=homedir)
+
+    def _flush_imports(self, key, homedir):
+        # called with write lock held: import all keys queued so far
+        with self._lock:
+            queue = self._import_queues.pop(key)
+        inputs = dict()
+        for keys_dict, pending in queue:
+            data = inputs.setdefault(keys_dict['format'], [])
+            data.extend([bytes(keys_dict['pub']),
+                         bytes(keys_dict['subkeys'])])
+        result = ImportResult()
+        try:
+            for key_format in sorted(inputs):
+                out, err = execute(
+                    [self.executable, '--import'],
+                    input=b''.join(inputs[key_format]), homedir=homedir,
+                    timeout=self.timeout, status_callback=result)
+                result.add_output(out, err)
+        except Exception as error:
+            for keys_dict, pending in queue:
+                pending.set(error=error)
+            return
+        for keys_dict, pending in queue:
+            pending.set(result)
+
+    def close(self):
+        """Wait for all scheduled operations and stop the pool.
+        """
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
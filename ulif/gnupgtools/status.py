@@ -0,0 +1,193 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Parse machine readable status output of gpg (``--status-fd``).
+
+ Status lines look like ``[GNUPG:] KEYWORD ARG1 ARG2 ...``. The
+ collectors in here are callables, which can be passed as
+ `status_callback` to `utils.execute()` and are fed while gpg runs.
+ See ``doc/DETAILS`` in the GnuPG sources for all keywords.
+"""
+
+#: Prefix of all status lines
+STATUS_PREFIX = b'[GNUPG:] '
+
+#: Bits set in the reason field of IMPORT_OK lines
+IMPORT_OK_NEW_KEY = 1
+IMPORT_OK_NEW_UIDS = 2
+IMPORT_OK_NEW_SIGS = 4
+IMPORT_OK_NEW_SUBKEYS = 8
+IMPORT_OK_SECRET = 16
+
+#: Names of the fields of IMPORT_RES lines, in order
+IMPORT_RES_FIELDS = (
+    'count', 'no_user_id', 'imported', 'imported_rsa', 'unchanged',
+    'n_uids', 'n_subk', 'n_sigs', 'n_revoc', 'sec_read', 'sec_imported',
+    'sec_dups', 'skipped_new_keys', 'not_imported', 'skipped_v3_keys')
+
+#: Names of the fields of EXPORT_RES lines, in order
+EXPORT_RES_FIELDS = ('count', 'secret_count', 'exported')
+
+#: Keywords signalling errors
+ERROR_KEYWORDS = ('IMPORT_PROBLEM', 'ERROR', 'FAILURE')
+
+
+def parse_status_line(line):
+    """Parse a single status `line` (bytes).
+
+    Returns a tuple (keyword, args) with `args` being a list of
+    strings or ``None`` for lines not being status lines:
+
+      >>> parse_status_line(b'[GNUPG:] IMPORT_OK 1 ABCDEF\\n')
+      ('IMPORT_OK', ['1', 'ABCDEF'])
+      >>> parse_status_line(b'gpg: some message') is None
+      True
+
+    """
+    if not line.startswith(STATUS_PREFIX):
+        return None
+    fields = line[len(STATUS_PREFIX):].decode('utf-8', 'replace').split()
+    if not fields:
+        return None
+    return fields[0], fields[1:]
+
+
+def parse_counts(args, names):
+    """Get a dict mapping `names` to int values of `args`.
+
+    Missing values are set to zero.
+    """
+    values = [int(x) for x in args if x.isdigit()]
+    values += [0] * (len(names) - len(values))
+    return dict(zip(names, values))
+
+
+class StatusCollector(object):
+    """Collect status lines of one or more gpg runs.
+
+    Instances can be passed as `status_callback` to
+    `utils.execute()`. All parsed lines are kept in `lines`, lines
+    signalling errors also in `errors`. Subclasses handle keywords by
+    methods named like ``handle_<KEYWORD>``.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.errors = []
+        self.stdout = b''
+        self.stderr = b''
+
+    def __call__(self, keyword, args):
+        self.lines.append((keyword, args))
+        if keyword in ERROR_KEYWORDS:
+            self.errors.append((keyword, args))
+        handler = getattr(self, 'handle_%s' % keyword, None)
+        if handler is not None:
+            handler(args)
+
+    def add_output(self, stdout, stderr):
+        """Add `stdout` and `stderr` of a gpg run.
+        """
+        self.stdout += stdout or b''
+        self.stderr += stderr or b''
+
+    @property
+    def ok(self):
+        """``True`` if no errors were reported.
+        """
+        return not self.errors
+
+
+class ImportResult(StatusCollector):
+    """Result of gpg imports.
+
+    `imported` is a list of (long key id, user id) tuples of newly
+    imported keys, `import_ok` a list of (reason flags, fingerprint)
+    tuples of all keys processed successfully, `unchanged` the list
+    of fingerprints of keys that were already present and not
+    changed. `counts` sums up the IMPORT_RES counters of all runs.
+    """
+
+    def __init__(self):
+        super(ImportResult, self).__init__()
+        self.imported = []
+        self.import_ok = []
+        self.unchanged = []
+        self.counts = dict([(x, 0) for x in IMPORT_RES_FIELDS])
+
+    def handle_IMPORTED(self, args):
+        self.imported.append((args[0], ' '.join(args[1:])))
+
+    def handle_IMPORT_OK(self, args):
+        flags = int(args[0])
+        fingerprint = len(args) > 1 and args[1] or None
+        self.import_ok.append((flags, fingerprint))
+        if flags == 0:
+            self.unchanged.append(fingerprint)
+
+    def handle_IMPORT_RES(self, args):
+        for name, value in parse_counts(args, IMPORT_RES_FIELDS).items():
+            self.counts[name] += value
+
+
+class ExportResult(StatusCollector):
+    """Result of gpg exports.
+
+    `exported` is a list of fingerprints of exported keys, `counts`
+    sums up the EXPORT_RES counters of all runs.
+    """
+
+    def __init__(self):
+        super(ExportResult, self).__init__()
+        self.exported = []
+        self.counts = dict([(x, 0) for x in EXPORT_RES_FIELDS])
+
+    def handle_EXPORTED(self, args):
+        self.exported.append(args[0])
+
+    def handle_EXPORT_RES(self, args):
+        for name, value in parse_counts(args, EXPORT_RES_FIELDS).items():
+            self.counts[name] += value
+
+
+class VerifyResult(StatusCollector):
+    """Result of gpg signature verifications.
+
+    `signatures` is a list of fingerprints of good signatures, `bad`
+    a list of key ids of bad signatures or signatures that could not
+    be checked.
+    """
+
+    def __init__(self):
+        super(VerifyResult, self).__init__()
+        self.signatures = []
+        self.bad = []
+
+    def handle_VALIDSIG(self, args):
+        self.signatures.append(args[0])
+
+    def handle_BADSIG(self, args):
+        self.bad.append(args[0])
+
+    def handle_ERRSIG(self, args):
+        self.bad.append(args[0])
+
+    @property
+    def valid(self):
+        """``True`` if there were good and no bad signatures.
+        """
+        return bool(self.signatures) and not self.bad
@@ -0,0 +1,247 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Synchronize secret keys between two GnuPG homes.
+
+ Secret keys of both homes are listed (in parallel) and compared by
+ fingerprint. Only master keys and subkeys missing in the target home
+ are exported from the source home. Exported keys are piped directly
+ into the importing gpg process, they are never written to disk.
+"""
+from __future__ import print_function
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from collections import namedtuple
+from ulif.gnupgtools.import_master_key import (
+    check_trustdb, output_import_result, BULK_IMPORT_OPTIONS)
+from ulif.gnupgtools.scheduler import KeyringScheduler
+from ulif.gnupgtools.status import ImportResult
+from ulif.gnupgtools.utils import (
+    execute, get_env, get_error, kill_process_group, wait_exited, EXIT_WAIT,
+    NEW_SESSION)
+
+#: Keys missing in a target home: fingerprints of `masters` to transfer
+#: completely and of single `subkeys` to transfer.
+SyncPlan = namedtuple('SyncPlan', ['masters', 'subkeys'])
+
+
+class SyncError(Exception):
+    """Raised if keys could not be exported from the source home.
+    """
+
+
+def handle_options(args):
+    """Handle commandline options.
+    """
+    parser = argparse.ArgumentParser(
+        prog="gpg-sync-homes",
+        description="Copy secret keys missing in one GnuPG home from another")
+    parser.add_argument('source', metavar='SOURCE',
+                        help='GnuPG home to copy keys from')
+    parser.add_argument('target', metavar='TARGET',
+                        help='GnuPG home to copy keys into')
+    parser.add_argument('-b', '--binary', dest="gnupg_path", default='gpg',
+                        metavar='PATH', help='Path to GnuPG binary to use')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only show keys that would be copied')
+    parser.add_argument('-t', '--timeout', type=float, default=None,
+                        metavar='SECS',
+                        help='Abort gpg commands running longer than SECS')
+    return parser.parse_args(args)
+
+
+def parse_secret_listing(output):
+    """Parse `output` of ``gpg --with-colons --with-fingerprint -K``.
+
+    Returns a dict mapping fingerprints of primary keys to tuples
+    (`secret`, `subkeys`). `secret` tells whether the secret primary
+    key is available (and not only a stub), `subkeys` is a frozenset
+    of fingerprints of subkeys with secret parts available.
+    """
+    result = dict()
+    primary, record = None, None
+    for line in output.decode('utf-8', 'replace').splitlines():
+        fields = line.split(':')
+        if fields[0] in ('sec', 'ssb'):
+            record = fields
+        elif fields[0] == 'fpr' and record is not None:
+            fpr, secret = fields[9], record[14:15] != ['#']
+            if record[0] == 'sec':
+                primary = fpr
+                result[primary] = (secret, frozenset())
+            elif primary is not None and secret:
+                has_secret, subkeys = result[primary]
+                result[primary] = (has_secret, subkeys | set([fpr]))
+            record = None
+    return result
+
+
+def get_secret_fingerprints(gnupg_path='gpg', homedir=None, timeout=None):
+    """Get fingerprints of secret keys in GnuPG home `homedir`.
+
+    See :func:`parse_secret_listing` for the result.
+    """
+    # given twice, --with-fingerprint makes gpg 1.x list subkey fprs, too
+    output, err = execute(
+        [gnupg_path, '--with-colons', '--fixed-list-mode',
+         '--with-fingerprint', '--with-fingerprint', '-K'],
+        homedir=homedir, timeout=timeout)
+    return parse_secret_listing(output)
+
+
+def plan_sync(source_keys, target_keys):
+    """Get a :class:`SyncPlan` for keys of `source_keys` not in `target_keys`.
+
+    Both are dicts as returned by :func:`get_secret_fingerprints`.
+    Master keys with secret primary key missing in the target are
+    transferred with all their subkeys. Otherwise only subkeys missing
+    are transferred. Fingerprints are sorted.
+    """
+    masters, subkeys = [], []
+    for fpr, (secret, source_subkeys) in source_keys.items():
+        target_secret, target_subkeys = target_keys.get(
+            fpr, (False, frozenset()))
+        if secret and not target_secret:
+            masters.append(fpr)
+        else:
+            subkeys.extend(source_subkeys - target_subkeys)
+    return SyncPlan(sorted(masters), sorted(subkeys))
+
+
+def get_export_commands(plan):
+    """Get lists of gpg export options transferring keys of `plan`.
+    """
+    result = []
+    if plan.masters:
+        result.append(['--export-secret-keys'] + plan.masters)
+    if plan.subkeys:
+        # '!' exports exactly this subkey, not all subkeys of its master
+        result.append(
+            ['--export-secret-subkeys'] + [x + '!' for x in plan.subkeys])
+    return result
+
+
+def transfer_keys(export_options, source_home, target_home, executable='gpg',
+                  timeout=None, result=None):
+    """Export keys from `source_home` and import them into `target_home`.
+
+    `export_options` are passed to the exporting gpg process, whose
+    output is piped directly into the importing gpg process. Both run
+    concurrently. Raises :exc:`SyncError` if the export fails. If the
+    import takes longer than `timeout` seconds, `utils.CommandTimeout`
+    is raised.
+
+    Returns an `status.ImportResult`, `result` if given.
+    """
+    if result is None:
+        result = ImportResult()
+    stderr = tempfile.TemporaryFile()
+    try:
+        exporter = subprocess.Popen(
+            [executable, '--batch'] + export_options, stdout=subprocess.PIPE,
+            stderr=stderr, env=get_env(source_home), **NEW_SESSION)
+        try:
+            out, err = execute(
+                [executable] + BULK_IMPORT_OPTIONS + ['--import'],
+                homedir=target_home, timeout=timeout, status_callback=result,
+                stdin=exporter.stdout)
+            result.add_output(out, err)
+        finally:
+            exporter.stdout.close()
+            if not wait_exited(exporter, EXIT_WAIT):
+                kill_process_group(exporter, reap=False)
+                exporter.wait()
+        if exporter.returncode != 0:
+            raise SyncError(get_error(exporter, stderr))
+    finally:
+        stderr.close()
+    return result
+
+
+def sync_homes(source_home, target_home, executable='gpg', timeout=None,
+               dry_run=False):
+    """Copy secret keys missing in `target_home` from `source_home`.
+
+    Both homes are listed in parallel, then all keys missing (see
+    :func:`plan_sync`) are transferred (see :func:`transfer_keys`)
+    and the trustdb of `target_home` is checked once. If `dry_run` is
+    set, nothing is transferred.
+
+    Returns a tuple (`plan`, `result`) with `result` being an
+    `status.ImportResult` or ``None`` if nothing was transferred.
+    """
+    with KeyringScheduler(
+            threads=2, executable=executable, timeout=timeout) as scheduler:
+        listings = [
+            scheduler.submit_reader(
+                home, get_secret_fingerprints, executable, homedir=home,
+                timeout=timeout) for home in (source_home, target_home)]
+        plan = plan_sync(*[x.get() for x in listings])
+        commands = get_export_commands(plan)
+        if dry_run or not commands:
+            return plan, None
+        result = scheduler.submit_writer(
+            target_home, transfer_all, commands, source_home, target_home,
+            executable, timeout).get()
+    return plan, result
+
+
+def transfer_all(commands, source_home, target_home, executable='gpg',
+                 timeout=None):
+    """Run :func:`transfer_keys` for each of `commands`.
+
+    Checks the trustdb of `target_home` afterwards.
+    """
+    result = ImportResult()
+    for export_options in commands:
+        transfer_keys(export_options, source_home, target_home, executable,
+                      timeout=timeout, result=result)
+    check_trustdb(executable, homedir=target_home, timeout=timeout)
+    return result
+
+
+def main(args=None):
+    """Copy secret keys from one GnuPG home into another.
+
+    This is the interface for the commandline. If `args` is not given, we
+    lookup `sys.argv`.
+    """
+    if args is None:
+        args = sys.argv
+    options = handle_options(args[1:])
+    for home in (options.source, options.target):
+        if not os.path.isdir(home):
+            print("No such GnuPG home: %s" % home, file=sys.stderr)
+            sys.exit(2)
+    if os.path.realpath(options.source) == os.path.realpath(options.target):
+        print("Source and target are the same home", file=sys.stderr)
+        sys.exit(2)
+    plan, result = sync_homes(
+        options.source, options.target, executable=options.gnupg_path,
+        timeout=options.timeout, dry_run=options.dry_run)
+    prefix = options.dry_run and "Would transfer" or "Transferred"
+    if not (plan.masters or plan.subkeys):
+        print("Nothing to transfer.")
+    for name, fprs in (("master keys", plan.masters),
+                       ("subkeys", plan.subkeys)):
+        if fprs:
+            print("%s %s: %s" % (prefix, name, ', '.join(fprs)))
+    if result is not None:
+        output_import_result(result)
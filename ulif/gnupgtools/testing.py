@@ -3,7 +3,27 @@
 #
 import os
 import shutil
+import struct
 import tempfile
+import threading
+import time
+from ulif.gnupgtools.ephemeral import HomeTemplate
+from ulif.gnupgtools.keyring import get_gnupg_home
+from ulif.gnupgtools.packets import (
+    iter_packets, iter_keyblocks, open_packet_data, parse_key,
+    parse_user_id, enarmor, is_armored, Packet, PacketError, ARMOR_BEGIN,
+    ALGO_LETTERS, PRIMARY_KEY_TAGS, SECRET_KEY_TAGS, TAG_PUBLIC_KEY,
+    TAG_PUBLIC_SUBKEY, TAG_SECRET_KEY, TAG_SECRET_SUBKEY, TAG_USER_ID)
+from ulif.gnupgtools.status import (
+    IMPORT_RES_FIELDS, IMPORT_OK_NEW_KEY, IMPORT_OK_NEW_UIDS,
+    IMPORT_OK_NEW_SUBKEYS, IMPORT_OK_SECRET)
+from ulif.gnupgtools.utils import CommandCancelled
+
+#: Version output of :class:`FakeGnuPG`
+FAKE_GNUPG_VERSION = b'gpg (GnuPG fake) 2.2.40\n'
+
+#: Secret part of secret key stubs (S2K "gnu-dummy" extension)
+GNU_DUMMY = b'\xff\x00\x65\x00GNU\x01'
 
 
 class FakeGnuPGHomeTestCase(object):
@@ -12,9 +32,16 @@ class FakeGnuPGHomeTestCase(object):
 
     gnupg_home = None
 
-    def create_empty_gpg_home(self):
+    def create_empty_gpg_home(self, template=None):
+        """Create a new GnuPG home and set it in environment.
+
+        If `template`, an `ephemeral.HomeTemplate`, is given, the home
+        is created from it.
+        """
         self._old_gnupg_home = os.getenv('GNUPGHOME', None)
         self.gnupg_home = tempfile.mkdtemp()
+        if template is not None:
+            template.create(self.gnupg_home)
         os.environ['GNUPGHOME'] = self.gnupg_home
         return os.environ['GNUPGHOME']
 
@@ -26,3 +53,435 @@ class FakeGnuPGHomeTestCase(object):
         if (self.gnupg_home is None) or (not os.path.isdir(self.gnupg_home)):
             return
         shutil.rmtree(self.gnupg_home)
+
+
+class HomeTemplates(object):
+    """Templates of the GnuPG homes in `samples_dir`.
+
+    The template of each home is created on first use (see
+    `ephemeral.HomeTemplate`) and kept until :meth:`close`.
+    """
+
+    def __init__(self, samples_dir):
+        self.samples_dir = samples_dir
+        self._templates = dict()
+
+    def get(self, name):
+        """Get the template of sample home `name`.
+        """
+        if name not in self._templates:
+            self._templates[name] = HomeTemplate(
+                os.path.join(self.samples_dir, name))
+        return self._templates[name]
+
+    def close(self):
+        for template in self._templates.values():
+            template.close()
+        self._templates.clear()
+
+
+def encode_packet(tag, body):
+    """Get an OpenPGP packet with `tag` and `body` (new format).
+    """
+    size = len(body)
+    if size < 192:
+        length = struct.pack('>B', size)
+    elif size < 8384:
+        length = struct.pack('>BB', ((size - 192) >> 8) + 192,
+                             (size - 192) & 0xff)
+    else:
+        length = b'\xff' + struct.pack('>I', size)
+    return struct.pack('>B', 0xc0 | tag) + length + body
+
+
+def encode_mpi(data):
+    """Get `data` (bytes, big endian) encoded as MPI.
+    """
+    data = data.lstrip(b'\x00') or b'\x00'
+    top_bits = len(bin(bytearray(data)[0])) - 2
+    if data == b'\x00':
+        top_bits = 0
+    return struct.pack('>H', (len(data) - 1) * 8 + top_bits) + data
+
+
+def create_rsa_key(tag=TAG_PUBLIC_KEY, bits=2048, created=None):
+    """Get a parsed `packets.Key` with a random RSA modulus.
+
+    The key cannot be used for anything but listing, exporting and
+    importing it with :class:`FakeGnuPG`.
+    """
+    if created is None:
+        created = int(time.time())
+    modulus = b'\x80' + os.urandom(bits // 8 - 1)
+    body = (b'\x04' + struct.pack('>I', created) + b'\x01' +
+            encode_mpi(modulus) + encode_mpi(b'\x01\x00\x01'))
+    return parse_key(Packet(tag, body))
+
+
+class FakeKey(object):
+    """A key or subkey stored by :class:`FakeGnuPG`.
+
+    `key` is the parsed `packets.Key`, `secret` the secret part of
+    its secret key packet (``None`` if the secret key is not
+    available) and `capabilities` a string like ``'sc'``.
+    """
+
+    __slots__ = ('key', 'secret', 'capabilities')
+
+    def __init__(self, key, secret=None, capabilities='e'):
+        self.key = key
+        self.secret = secret
+        self.capabilities = capabilities
+
+    def matches(self, spec):
+        """Tell whether key spec `spec` (key id or fingerprint) matches.
+        """
+        spec = spec.upper()
+        if spec.startswith('0X'):
+            spec = spec[2:]
+        return len(spec) >= 8 and self.key.fingerprint.endswith(spec)
+
+    def packet(self, tag, secret=False):
+        """Get the key as encoded packet with `tag`.
+
+        Secret key packets contain the secret part, if available, or
+        mark a stub otherwise.
+        """
+        body = self.key.public
+        if secret:
+            body += self.secret or GNU_DUMMY
+        return encode_packet(tag, body)
+
+
+class FakeKeyblock(object):
+    """A primary key with `uids` and `subkeys` stored by :class:`FakeGnuPG`.
+    """
+
+    def __init__(self, primary, uids=None, subkeys=None):
+        self.primary = primary
+        self.uids = uids or []
+        self.subkeys = subkeys or []
+
+    @property
+    def has_secret(self):
+        return bool(self.primary.secret or [
+            x for x in self.subkeys if x.secret])
+
+    def merge(self, other):
+        """Add uids, subkeys and secret keys of `other`.
+
+        Returns the `status.IMPORT_OK_*` flags describing the changes.
+        """
+        flags = 0
+        if other.primary.secret and not self.primary.secret:
+            self.primary.secret = other.primary.secret
+            flags |= IMPORT_OK_SECRET
+        for uid in other.uids:
+            if uid not in self.uids:
+                self.uids.append(uid)
+                flags |= IMPORT_OK_NEW_UIDS
+        known = dict((x.key.fingerprint, x) for x in self.subkeys)
+        for subkey in other.subkeys:
+            mine = known.get(subkey.key.fingerprint)
+            if mine is None:
+                self.subkeys.append(subkey)
+                flags |= IMPORT_OK_NEW_SUBKEYS | (
+                    subkey.secret and IMPORT_OK_SECRET or 0)
+            elif subkey.secret and not mine.secret:
+                mine.secret = subkey.secret
+                flags |= IMPORT_OK_SECRET
+        return flags
+
+
+def parse_keyblock(packets):
+    """Get a :class:`FakeKeyblock` from a list of `packets`.
+    """
+    primary, uids, subkeys = None, [], []
+    for packet in packets:
+        if packet.tag == TAG_USER_ID:
+            uids.append(parse_user_id(packet))
+        elif packet.tag in (TAG_PUBLIC_KEY, TAG_SECRET_KEY, TAG_PUBLIC_SUBKEY,
+                            TAG_SECRET_SUBKEY):
+            key = parse_key(packet)
+            secret = None
+            if packet.tag in SECRET_KEY_TAGS and not key.is_stub:
+                secret = packet.body[len(key.public):]
+            if packet.tag in PRIMARY_KEY_TAGS:
+                primary = FakeKey(key, secret, 'sc')
+            else:
+                subkeys.append(FakeKey(key, secret))
+    return FakeKeyblock(primary, uids, subkeys)
+
+
+def split_key_data(data):
+    """Get the key blocks contained in `data` (binary or armored).
+
+    Armored data can contain several armored blocks. Returns a list of
+    :class:`FakeKeyblock`.
+    """
+    data = bytes(data)
+    chunks = [data]
+    if is_armored(data):
+        chunks = [ARMOR_BEGIN + x for x in data.split(ARMOR_BEGIN)[1:]]
+    result = []
+    for chunk in chunks:
+        packets = iter_packets(open_packet_data(chunk))
+        result.extend(parse_keyblock(x) for x in iter_keyblocks(packets))
+    return result
+
+
+def format_date(timestamp):
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+
+class FakeGnuPG(object):
+    """An in-process gpg backend keeping keyrings in memory.
+
+    Use it with `utils.set_backend()` or `utils.use_backend()`. The
+    gpg commands used by this package are understood: secret and
+    public key listings (also in colon format), exports, imports,
+    ``--version`` and ``--check-trustdb``. Keyrings are kept per GnuPG
+    home, no files are read or written, nothing is encrypted or
+    signed. Status lines are passed to `status_callback` as gpg would.
+    As there are no signatures, subkeys imported are assumed to be
+    encryption keys.
+
+    Instances can be used from several threads at once.
+    """
+
+    def __init__(self):
+        self.keyrings = dict()
+        self._lock = threading.RLock()
+
+    def get_keyring(self, homedir=None):
+        """Get the keyring of GnuPG home `homedir`.
+
+        That is a list of :class:`FakeKeyblock`.
+        """
+        path = os.path.abspath(get_gnupg_home(homedir))
+        with self._lock:
+            return self.keyrings.setdefault(path, [])
+
+    def create_key(self, uid, homedir=None, subkeys='e', secret=True,
+                   bits=2048, created=None):
+        """Create a key with user id `uid` in GnuPG home `homedir`.
+
+        One subkey is created for each capability in `subkeys`. If
+        `secret` is set, secret keys are available. Returns the
+        fingerprint of the primary key.
+        """
+        def fake_key(tag, capabilities):
+            secret_part = secret and (b'\x00' + encode_mpi(
+                b'\x80' + os.urandom(bits // 8 - 1))) or None
+            return FakeKey(
+                create_rsa_key(tag, bits, created), secret_part,
+                capabilities)
+        keyblock = FakeKeyblock(
+            fake_key(TAG_PUBLIC_KEY, 'sc'), [uid],
+            [fake_key(TAG_PUBLIC_SUBKEY, x) for x in subkeys])
+        with self._lock:
+            self.get_keyring(homedir).append(keyblock)
+        return keyblock.primary.key.fingerprint
+
+    def find(self, specs, homedir=None):
+        """Get the keyblocks of `homedir` matching any of `specs`.
+
+        Returns a list of tuples (`keyblock`, `subkeys`) with `subkeys`
+        being the subkeys matched exactly (spec ending with ``!``).
+        All keyblocks are returned if `specs` is empty.
+        """
+        result = []
+        for keyblock in self.get_keyring(homedir):
+            matched, exact = not specs, []
+            for spec in specs:
+                if keyblock.primary.matches(spec.rstrip('!')):
+                    matched = True
+                for subkey in keyblock.subkeys:
+                    if subkey.matches(spec.rstrip('!')):
+                        matched = True
+                        if spec.endswith('!'):
+                            exact.append(subkey)
+            if matched:
+                result.append((keyblock, exact))
+        return result
+
+    def execute(self, cmd_list, input=None, homedir=None, timeout=None,
+                cancel=None, status_callback=None, stdin=None):
+        """Run gpg command `cmd_list` in memory, see `utils.execute()`.
+
+        Commands not understood produce an error message on stderr
+        only.
+        """
+        if cancel is not None and cancel.is_set():
+            raise CommandCancelled(cmd_list)
+        if input is None and stdin is not None:
+            input = stdin.read()
+        options, specs, command = [], [], None
+        args = iter(cmd_list[1:])
+        for arg in args:
+            if arg in self.COMMANDS and command is None:
+                command = arg
+            elif arg == '--export-options':
+                next(args, None)
+            elif arg.startswith('-'):
+                options.append(arg)
+            else:
+                specs.append(arg)
+        if command is None:
+            return b'', (
+                'gpg: fake: unsupported command: %s\n' % ' '.join(
+                    cmd_list[1:])).encode('utf-8')
+        status = status_callback or (lambda keyword, args: None)
+        with self._lock:
+            return getattr(self, self.COMMANDS[command])(
+                specs, options, homedir, input, status)
+
+    #: Commands understood and the methods handling them
+    COMMANDS = {
+        '--version': 'version', '-K': 'list_secret_keys',
+        '--list-secret-keys': 'list_secret_keys', '-k': 'list_keys',
+        '--list-keys': 'list_keys', '--export': 'export',
+        '--export-secret-keys': 'export_secret_keys',
+        '--export-secret-subkeys': 'export_secret_subkeys',
+        '--import': 'import_keys', '--check-trustdb': 'check_trustdb',
+        }
+
+    def version(self, specs, options, homedir, input, status):
+        return FAKE_GNUPG_VERSION, b''
+
+    def check_trustdb(self, specs, options, homedir, input, status):
+        return b'', b''
+
+    def list_keys(self, specs, options, homedir, input, status,
+                  secret=False):
+        lines = []
+        for keyblock, exact in self.find(specs, homedir):
+            if secret and not keyblock.has_secret:
+                continue
+            if '--with-colons' in options:
+                lines.extend(self._colon_lines(keyblock, secret))
+            else:
+                lines.extend(self._text_lines(keyblock, secret))
+        return ''.join(x + '\n' for x in lines).encode('utf-8'), b''
+
+    def list_secret_keys(self, *args):
+        return self.list_keys(*args, secret=True)
+
+    def _text_lines(self, keyblock, secret):
+        result = []
+        keys = [('pub', keyblock.primary)] + [
+            ('sub', x) for x in keyblock.subkeys]
+        for num, (prefix, fake_key) in enumerate(keys):
+            key = fake_key.key
+            if secret:
+                prefix = prefix == 'pub' and 'sec' or 'ssb'
+                prefix += fake_key.secret is None and '#' or ''
+            result.append('%-5s %d%s/%s %s' % (
+                prefix, key.bits, ALGO_LETTERS[key.algo], key.key_id[-8:],
+                format_date(key.created)))
+            if not num:
+                result.extend('uid%18s%s' % ('', x) for x in keyblock.uids)
+        return result
+
+    def _colon_lines(self, keyblock, secret):
+        result = []
+        keys = [('pub', keyblock.primary)] + [
+            ('sub', x) for x in keyblock.subkeys]
+        for num, (prefix, fake_key) in enumerate(keys):
+            key = fake_key.key
+            token = ''
+            if secret:
+                prefix = prefix == 'pub' and 'sec' or 'ssb'
+                token = fake_key.secret is None and '#' or '+'
+            result.append(':'.join([
+                prefix, 'u', str(key.bits), str(key.algo), key.key_id,
+                str(key.created), '', '', 'u', '', '',
+                fake_key.capabilities, '', '', token, '', '', '23', '']))
+            result.append('fpr:::::::::%s:' % key.fingerprint)
+            if not num:
+                result.extend(
+                    'uid:u::::%s::::%s:' % (key.created, x)
+                    for x in keyblock.uids)
+        return result
+
+    def _export(self, exported, options, status, block_type):
+        # `exported` is a list of (fingerprint, encoded keyblock)
+        for fpr, data in exported:
+            status('EXPORTED', [fpr])
+        count = str(len(exported))
+        status('EXPORT_RES', [
+            count, block_type.startswith('PRIVATE') and count or '0', count])
+        data = b''.join(x[1] for x in exported)
+        if not data:
+            return b'', b'gpg: WARNING: nothing exported\n'
+        if '--armor' in options or '-a' in options:
+            data = enarmor(data, block_type)
+        return data, b''
+
+    def export(self, specs, options, homedir, input, status):
+        result = []
+        for keyblock, exact in self.find(specs, homedir):
+            result.append((
+                keyblock.primary.key.fingerprint,
+                keyblock.primary.packet(TAG_PUBLIC_KEY) + b''.join(
+                    encode_packet(TAG_USER_ID, x.encode('utf-8'))
+                    for x in keyblock.uids) + b''.join(
+                    x.packet(TAG_PUBLIC_SUBKEY) for x in keyblock.subkeys)))
+        return self._export(result, options, status, 'PUBLIC KEY BLOCK')
+
+    def export_secret_keys(self, specs, options, homedir, input, status,
+                           subkeys_only=False):
+        result = []
+        for keyblock, exact in self.find(specs, homedir):
+            subkeys = exact or [x for x in keyblock.subkeys if x.secret]
+            primary = keyblock.primary
+            if subkeys_only:
+                primary = FakeKey(primary.key)  # exported as stub
+            if not (subkeys or primary.secret):
+                continue
+            result.append((
+                primary.key.fingerprint,
+                primary.packet(TAG_SECRET_KEY, True) + b''.join(
+                    encode_packet(TAG_USER_ID, x.encode('utf-8'))
+                    for x in keyblock.uids) + b''.join(
+                    x.packet(TAG_SECRET_SUBKEY, True) for x in subkeys)))
+        return self._export(result, options, status, 'PRIVATE KEY BLOCK')
+
+    def export_secret_subkeys(self, *args):
+        return self.export_secret_keys(*args, subkeys_only=True)
+
+    def import_keys(self, specs, options, homedir, input, status):
+        try:
+            keyblocks = split_key_data(input or b'')
+        except PacketError as err:
+            return b'', ('gpg: invalid key data: %s\n' % err).encode('utf-8')
+        if not keyblocks:
+            status('NODATA', ['1'])
+            return b'', b'gpg: no valid OpenPGP data found.\n'
+        counts = dict([(x, 0) for x in IMPORT_RES_FIELDS])
+        keyring = self.get_keyring(homedir)
+        known = dict((x.primary.key.fingerprint, x) for x in keyring)
+        for keyblock in keyblocks:
+            fpr = keyblock.primary.key.fingerprint
+            counts['count'] += 1
+            if keyblock.has_secret:
+                counts['sec_read'] += 1
+            mine = known.get(fpr)
+            if mine is None:
+                keyring.append(keyblock)
+                known[fpr] = keyblock
+                flags = IMPORT_OK_NEW_KEY | (
+                    keyblock.has_secret and IMPORT_OK_SECRET or 0)
+                counts['imported'] += 1
+                status('IMPORTED', [fpr[-16:]] + keyblock.uids[:1])
+            else:
+                flags = mine.merge(keyblock)
+                if not flags:
+                    counts['unchanged'] += 1
+            if flags & IMPORT_OK_SECRET:
+                counts['sec_imported'] += 1
+            elif keyblock.has_secret:
+                counts['sec_dups'] += 1
+            status('IMPORT_OK', [str(flags), fpr])
+        status('IMPORT_RES', [str(counts[x]) for x in IMPORT_RES_FIELDS])
+        return b'', b''
@@ -17,23 +17,285 @@
 #
 """Helpers needed by at least two other modules.
 """
+import os
+import re
 import shutil
+import signal
 import subprocess
+import sys
 import tarfile
 import tempfile
+import threading
+import time
 from contextlib import contextmanager
+from ulif.gnupgtools.status import parse_status_line
 
+#: Seconds to wait between checks for cancellation of running commands
+POLL_INTERVAL = 0.1
 
-def execute(cmd_list):
+#: Seconds to wait for commands to exit when passing data failed
+EXIT_WAIT = 1
+
+#: Popen keywords to start commands in a new session (process group)
+if sys.version_info >= (3, 2):
+    NEW_SESSION = dict(start_new_session=True)
+else:  # pragma: no cover
+    NEW_SESSION = dict(preexec_fn=os.setsid)
+
+
+class CommandTimeout(Exception):
+    """Raised if a command did not finish within `timeout` seconds.
+
+    The command (a list of arguments) is available as `cmd_list`.
+    """
+    def __init__(self, cmd_list, timeout):
+        super(CommandTimeout, self).__init__(
+            'Command timed out after %s seconds: %s' % (
+                timeout, ' '.join(cmd_list)))
+        self.cmd_list = cmd_list
+        self.timeout = timeout
+
+
+class CommandCancelled(Exception):
+    """Raised if a command was cancelled before it finished.
+
+    The command (a list of arguments) is available as `cmd_list`.
+    """
+    def __init__(self, cmd_list):
+        super(CommandCancelled, self).__init__(
+            'Command cancelled: %s' % ' '.join(cmd_list))
+        self.cmd_list = cmd_list
+
+
+def get_env(homedir=None):
+    """Get the environment for commands run with GnuPG home `homedir`.
+
+    Returns ``None`` (inherit the current environment) if `homedir` is
+    ``None``, otherwise a copy of the current environment with
+    ``GNUPGHOME`` set to `homedir`. The process environment itself is
+    never changed.
+    """
+    if homedir is None:
+        return None
+    env = os.environ.copy()
+    env['GNUPGHOME'] = homedir
+    return env
+
+
+def kill_process_group(proc, reap=True):
+    """Kill process `proc` and all processes in its process group.
+
+    `proc` must have been started in a new session (see
+    `NEW_SESSION`). The killed process is reaped if `reap` is set.
+    Callers waiting for `proc` themselves pass ``reap=False``.
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass  # already gone
+    if reap:
+        proc.communicate()
+
+
+def wait_exited(proc, seconds):
+    """Wait at most `seconds` for `proc` to exit.
+
+    Returns ``True`` if `proc` exited.
+    """
+    deadline = time.time() + seconds
+    while proc.poll() is None and time.time() < deadline:
+        time.sleep(0.01)
+    return proc.returncode is not None
+
+
+def get_error(proc, stderr):
+    """Get an error message for failed gpg `proc` with `stderr` output.
+
+    `stderr` is a file, which must still be open.
+    """
+    stderr.seek(0)
+    return 'gpg failed (%s): %s' % (
+        proc.returncode, stderr.read().decode('utf-8', 'replace').strip())
+
+
+def read_status(fd, status_callback):
+    """Read gpg status lines from file descriptor `fd` until EOF.
+
+    Each status line is parsed and passed to `status_callback` as
+    (keyword, args). `fd` is closed afterwards.
+    """
+    with os.fdopen(fd, 'rb') as fp:
+        for line in iter(fp.readline, b''):
+            parsed = parse_status_line(line)
+            if parsed is not None:
+                status_callback(*parsed)
+
+
+def communicate(proc, cmd_list, input=None, timeout=None, cancel=None):
+    """Wait for `proc`, started from `cmd_list`, to finish.
+
+    Works like `proc.communicate(input)`, but supports `timeout` and
+    `cancel` as described in :func:`execute`.
+    """
+    deadline = timeout is not None and time.time() + timeout or None
+    finished = False
+    try:
+        if timeout is None and cancel is None:
+            result = proc.communicate(input)
+            finished = True
+            return result
+        while True:
+            wait = cancel is not None and POLL_INTERVAL or None
+            if deadline is not None:
+                remaining = max(deadline - time.time(), 0)
+                wait = min(wait or remaining, remaining)
+            try:
+                result = proc.communicate(input, timeout=wait)
+                finished = True
+                return result
+            except subprocess.TimeoutExpired:
+                input = None  # already passed, must not be sent again
+            if cancel is not None and cancel.is_set():
+                raise CommandCancelled(cmd_list)
+            if deadline is not None and time.time() >= deadline:
+                raise CommandTimeout(cmd_list, timeout)
+    finally:
+        if not finished:
+            kill_process_group(proc)
+
+
+class SubprocessBackend(object):
+    """Run commands as separate processes.
+
+    This is the default backend used by :func:`execute`.
+    """
+
+    def execute(self, cmd_list, input=None, homedir=None, timeout=None,
+                cancel=None, status_callback=None, stdin=None):
+        """Execute the command in `cmd_list`, see :func:`execute`.
+        """
+        if input is not None:
+            stdin = subprocess.PIPE
+        kw = dict(NEW_SESSION)
+        read_fd = write_fd = None
+        if status_callback is not None:
+            read_fd, write_fd = os.pipe()
+            cmd_list = cmd_list[:1] + ['--status-fd', str(write_fd)] + (
+                cmd_list[1:])
+            if sys.version_info >= (3, 2):
+                kw['pass_fds'] = (write_fd, )
+        try:
+            proc = subprocess.Popen(
+                cmd_list, stdin=stdin, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, shell=False, env=get_env(homedir),
+                **kw)
+        except Exception:
+            if read_fd is not None:
+                os.close(read_fd)
+            raise
+        finally:
+            if write_fd is not None:
+                os.close(write_fd)
+        reader = None
+        if read_fd is not None:
+            reader = threading.Thread(
+                target=read_status, args=(read_fd, status_callback))
+            reader.daemon = True
+            reader.start()
+        try:
+            output, err = communicate(proc, cmd_list, input, timeout, cancel)
+        finally:
+            if reader is not None:
+                reader.join()
+        return output, err
+
+
+#: The backend commands are run by, see :func:`set_backend`
+_backend = SubprocessBackend()
+
+
+def get_backend():
+    """Get the backend currently used to run commands.
+    """
+    return _backend
+
+
+def set_backend(backend):
+    """Run all commands passed to :func:`execute` by `backend`.
+
+    A backend is any object with an `execute` method accepting the
+    arguments of :func:`execute` (see `testing.FakeGnuPG` for an
+    in-process fake). Returns the backend used before.
+    """
+    global _backend
+    old_backend, _backend = _backend, backend
+    return old_backend
+
+
+@contextmanager
+def use_backend(backend):
+    """Run commands by `backend` while in the `with` block.
+    """
+    old_backend = set_backend(backend)
+    try:
+        yield backend
+    finally:
+        set_backend(old_backend)
+
+
+def execute(cmd_list, input=None, homedir=None, timeout=None, cancel=None,
+            status_callback=None, stdin=None):
     """Execute the command in `cmd_list`.
 
     `cmd_list` must be a list of arguments as entered, for instance,
     on the shell.  Returns (stdout, stderr) output.
+
+    If `input` is given, it is sent to the commands stdin. `input` can
+    be any bytes-like object, for instance a `memoryview`, which is
+    passed to the process without copying. Instead of `input`, a file
+    object with file descriptor (like the stdout pipe of another
+    process) can be passed as `stdin`, which the command reads from
+    directly.
+
+    If `homedir` is given, the command is run with ``GNUPGHOME`` set
+    to this path. This is safe to use from several threads.
+
+    If `timeout` (seconds) is given, raises :exc:`CommandTimeout` if
+    the command takes longer. `cancel` can be a `threading.Event`
+    (or anything else with an `is_set()` method). If it is set while
+    the command runs, :exc:`CommandCancelled` is raised. In both cases
+    the command and all processes it started in its process group are
+    killed. The same happens if waiting is interrupted by any other
+    exception, like `KeyboardInterrupt`.
+
+    If `status_callback` is given, `cmd_list` must be a gpg command.
+    We then pass ``--status-fd`` to gpg and call `status_callback`
+    with (keyword, args) for each status line while gpg runs (see
+    `status.parse_status_line()`), from a separate thread.
+
+    Commands are run by the current backend (see :func:`set_backend`),
+    as separate processes by default.
+    """
+    return _backend.execute(
+        cmd_list, input=input, homedir=homedir, timeout=timeout,
+        cancel=cancel, status_callback=status_callback, stdin=stdin)
+
+
+#: Regular expression matching version numbers in `gpg --version` output
+RE_GNUPG_VERSION = re.compile(b'^gpg \\(GnuPG[^)]*\\) ([0-9]+(\\.[0-9]+)*)')
+
+
+def get_gnupg_version(gnupg_path='gpg'):
+    """Get version of GnuPG binary at `gnupg_path`.
+
+    Returns a tuple of ints like ``(2, 2, 40)`` or ``None`` if the
+    version cannot be determined.
     """
-    proc = subprocess.Popen(
-        cmd_list, stdout=subprocess.PIPE, shell=False)
-    output, err = proc.communicate()
-    return output, err
+    output, err = execute([gnupg_path, "--version"])
+    match = RE_GNUPG_VERSION.match(output or b'')
+    if match is None:
+        return None
+    return tuple([int(x) for x in match.group(1).split(b'.')])
 
 
 @contextmanager
@@ -0,0 +1,361 @@
+#
+#    ulif.gnupgtools -- gnupg made less complex
+#    Copyright (C) 2015  Uli Fouquet
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Watch GnuPG homes and export keys when they change.
+
+ Keyring files are watched with inotify (Linux, via `ctypes`) or, if
+ that is not available, by polling their modification times. Bursts
+ of changes are collected until the keyring is quiet for a while.
+ Then the secret keys are listed again and only keys added or changed
+ since the last listing are exported.
+
+ The last listing is stored in a state file, so that changes made
+ while nobody was watching are exported on the next start.
+"""
+from __future__ import print_function
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import sys
+import time
+from ulif.gnupgtools.keyring import get_gnupg_home
+
+#: Names of files in GnuPG homes that contain keys
+KEYRING_FILES = ('pubring.gpg', 'pubring.kbx', 'secring.gpg')
+
+#: Subdir of GnuPG homes containing secret keys (GnuPG >= 2.1)
+PRIVATE_KEYS_DIR = 'private-keys-v1.d'
+
+#: Seconds without changes before a burst of changes is considered done
+QUIET_SECONDS = 1.0
+
+#: Seconds to wait at most for a burst of changes to end
+MAX_DELAY = 30.0
+
+#: Seconds between checks of the polling watcher
+POLL_INTERVAL = 1.0
+
+#: Name of the state file written into output dirs
+STATE_FILE = '.watch-state.json'
+
+#: inotify flags (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+
+#: Events we watch for
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+#: Size of the fixed part of inotify events (wd, mask, cookie, len)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_keyring_file(name):
+    """Tell whether a file called `name` contains keys.
+
+    `name` is a basename of some file in a GnuPG home or its private
+    keys dir. Lock files, sockets, trust databases etc. do not count.
+    """
+    return name in KEYRING_FILES or name.endswith('.key')
+
+
+def get_watched_dirs(homedir):
+    """Get the dirs of GnuPG home `homedir` that we watch.
+
+    These are the home itself and its private keys dir, if it exists.
+    """
+    result = [homedir]
+    private_dir = os.path.join(homedir, PRIVATE_KEYS_DIR)
+    if os.path.isdir(private_dir):
+        result.append(private_dir)
+    return result
+
+
+def load_libc():
+    """Get the C library with inotify support, or ``None``.
+    """
+    try:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class InotifyWatcher(object):
+    """Watch keyring files of GnuPG home `homedir` with inotify.
+
+    Raises `OSError` if inotify is not available.
+    """
+
+    def __init__(self, homedir):
+        self.homedir = homedir
+        self._libc = load_libc()
+        if self._libc is None:
+            raise OSError('inotify not available')
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        try:
+            for path in get_watched_dirs(homedir):
+                self.add_watch(path)
+        except OSError:
+            self.close()
+            raise
+
+    def add_watch(self, path):
+        """Watch dir at `path`.
+        """
+        if not isinstance(path, bytes):
+            path = path.encode(sys.getfilesystemencoding())
+        if self._libc.inotify_add_watch(self.fd, path, WATCH_MASK) < 0:
+            raise OSError(ctypes.get_errno(), 'Cannot watch %r' % path)
+
+    def read_changes(self, timeout=None):
+        """Wait at most `timeout` seconds for changes of keyring files.
+
+        Returns a set of names of changed files (empty if nothing
+        changed).
+        """
+        result = set()
+        deadline = timeout is not None and time.time() + timeout or None
+        while not result:
+            wait = None
+            if deadline is not None:
+                wait = max(deadline - time.time(), 0)
+            if not select.select([self.fd], [], [], wait)[0]:
+                break
+            data = os.read(self.fd, 65536)
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, size = EVENT_HEADER.unpack_from(data, pos)
+                pos += EVENT_HEADER.size
+                name = data[pos:pos + size].rstrip(b'\0').decode(
+                    'utf-8', 'replace')
+                pos += size
+                if name == PRIVATE_KEYS_DIR and mask & IN_CREATE:
+                    # keys might be written before we watch the new dir
+                    self.add_watch(os.path.join(self.homedir, name))
+                    result.add(name)
+                elif is_keyring_file(name):
+                    result.add(name)
+        return result
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher(object):
+    """Watch keyring files of GnuPG home `homedir` by polling.
+
+    Files are checked every `interval` seconds.
+    """
+
+    def __init__(self, homedir, interval=POLL_INTERVAL):
+        self.homedir = homedir
+        self.interval = interval
+        self._snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        """Get a dict mapping keyring file paths to their stats.
+        """
+        result = dict()
+        for path in get_watched_dirs(self.homedir):
+            for name in os.listdir(path):
+                if not is_keyring_file(name):
+                    continue
+                try:
+                    st = os.stat(os.path.join(path, name))
+                except OSError:
+                    continue  # removed meanwhile
+                result[os.path.join(path, name)] = (
+                    st.st_mtime, st.st_size, st.st_ino)
+        return result
+
+    def read_changes(self, timeout=None):
+        """Wait at most `timeout` seconds for changes of keyring files.
+
+        See :meth:`InotifyWatcher.read_changes`.
+        """
+        deadline = timeout is not None and time.time() + timeout or None
+        while True:
+            snapshot, old = self.take_snapshot(), self._snapshot
+            self._snapshot = snapshot
+            changed = set([
+                os.path.basename(path) for path in set(snapshot) | set(old)
+                if snapshot.get(path) != old.get(path)])
+            if changed:
+                return changed
+            if deadline is not None and time.time() >= deadline:
+                return changed
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.time(), 0))
+            time.sleep(wait)
+
+    def close(self):
+        pass
+
+
+def get_watcher(homedir, poll_interval=None):
+    """Get a watcher for keyring files of GnuPG home `homedir`.
+
+    That is an :class:`InotifyWatcher` if available, a
+    :class:`PollingWatcher` otherwise or if `poll_interval` is given.
+    """
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(homedir)
+        except OSError:
+            poll_interval = POLL_INTERVAL
+    return PollingWatcher(homedir, poll_interval)
+
+
+def wait_for_changes(watcher, timeout=None, quiet=QUIET_SECONDS,
+                     max_delay=MAX_DELAY):
+    """Wait for a burst of keyring changes to happen and end.
+
+    Waits at most `timeout` seconds for a first change. Afterwards
+    changes are collected until there were none for `quiet` seconds
+    (or `max_delay` seconds passed). Returns the set of names of
+    changed files.
+    """
+    result = watcher.read_changes(timeout)
+    deadline = time.time() + max_delay
+    while result and time.time() < deadline:
+        more = watcher.read_changes(
+            min(quiet, max(deadline - time.time(), 0)))
+        if not more:
+            break
+        result.update(more)
+    return result
+
+
+def get_key_state(record):
+    """Get a JSON serializable state of key list entry `record`.
+
+    Keys with different states were changed.
+    """
+    return [list(record[0]), record[1], getattr(record, 'fingerprint', None),
+            list(getattr(record, 'subkeys', ()))]
+
+
+def diff_listings(old_states, key_list):
+    """Get ids of keys in `key_list` added or changed since `old_states`.
+
+    `old_states` maps key ids to states (see :func:`get_key_state`).
+    Key ids are returned in order of `key_list`.
+    """
+    return [record[2] for record in key_list
+            if old_states.get(record[2]) != get_key_state(record)]
+
+
+def load_state(path):
+    """Load key states stored at `path`.
+
+    Returns an empty dict if there is no state stored yet.
+    """
+    if not os.path.exists(path):
+        return dict()
+    with open(path) as fd:
+        return json.load(fd)
+
+
+def save_state(path, states):
+    """Store key states `states` at `path`, replacing it atomically.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fd:
+        json.dump(states, fd, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+def report_failure(key_id, err):
+    """Print a message about a failed export of `key_id` to stderr.
+
+    `key_id` is ``None`` if listing the keys failed.
+    """
+    print("Export of %s failed: %s" % (key_id or 'key list', err),
+          file=sys.stderr)
+
+
+def watch_keys(list_func, export_func, homedir=None, state_path=None,
+               poll_interval=None, quiet=QUIET_SECONDS, wait=None,
+               error_func=report_failure):
+    """Export keys of GnuPG home `homedir` whenever they change.
+
+    Generator. First keys added or changed since the state stored at
+    `state_path` (all keys, if nothing was stored) are exported, then
+    each burst of changes of keyring files is waited for (see
+    :func:`wait_for_changes`) and the changed keys are exported.
+
+    `list_func` is called without arguments to list the secret keys
+    of `homedir` (see `export_master_key.get_key_list()`),
+    `export_func` with the key id of each key to export. After each
+    round the list of key ids exported is yielded. If no change
+    happens within `wait` seconds, an empty list is yielded.
+
+    Failed listings and exports do not stop watching. They are passed
+    to `error_func` as (key id, exception), with key id ``None`` for
+    listings. Keys that failed are exported again with the next change.
+    The state is stored also if watching is interrupted.
+
+    For `poll_interval` see :func:`get_watcher`.
+    """
+    homedir = get_gnupg_home(homedir)
+    states = state_path and load_state(state_path) or dict()
+    watcher = get_watcher(homedir, poll_interval)
+    try:
+        changed = True
+        while True:
+            exported = []
+            if changed:
+                try:
+                    key_list = list_func()
+                except Exception as err:
+                    error_func(None, err)
+                    key_list = None
+            if changed and key_list is not None:
+                new_states = dict(
+                    (record[2], get_key_state(record)) for record in key_list)
+                for key_id in diff_listings(states, key_list):
+                    try:
+                        export_func(key_id)
+                    except Exception as err:
+                        error_func(key_id, err)
+                        continue
+                    states[key_id] = new_states[key_id]
+                    exported.append(key_id)
+                states = dict(
+                    (key_id, state) for key_id, state in states.items()
+                    if key_id in new_states)
+                if state_path:
+                    save_state(state_path, states)
+            yield exported
+            changed = wait_for_changes(watcher, timeout=wait, quiet=quiet)
+    finally:
+        watcher.close()
+        if state_path:
+            save_state(state_path, states)